@@ -1,10 +1,40 @@
-import cv2
-import numpy as np
 import tkinter as tk
 import os
 import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import filedialog, colorchooser
-from PIL import Image, ImageTk, ImageDraw, ImageFont
+from alignment import ALIGN_MODES
+from compare_engine import (CompareEngine, LazyModule, LineStyle, TaskCancelled, TaskHandle, hex_to_rgb,
+                            match_folder_pairs)
+from image_cache import ImageCache
+from export import DEFAULT_OPTIONS, EXPORT_FORMATS, ExportOptions
+from grid import GridEngine
+from metrics import METRICS
+from minimap import Minimap
+from profiling import format_rows
+from regions import write_regions
+from review import FollowedTask, ReviewSession
+from video import VIDEO_EXTENSIONS, VideoPair
+
+# OpenCV / Pillow 较重，首次用到时才导入，窗口可以先显示出来
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+Image = LazyModule("PIL.Image")
+ImageTk = LazyModule("PIL.ImageTk")
+
+# 同时绘制的差异区域框上限，当前选中的区域总会画出
+MAX_REGION_BOXES = 200
+# 视频对比时差异曲线的高度 (像素)
+VIDEO_PLOT_HEIGHT = 48
+IMAGE_FILETYPES = [('Images', '*.jpg *.jpeg *.png *.bmp *.tiff *.tif')]
+# 画布线条的虚线样式，与 draw_line 的实线 / 虚线 / 点线对应
+CANVAS_DASH = {'solid': None, 'dashed': (10, 7), 'dotted': (2, 4)}
+# 解码、预处理等界面等待结果的后台任务的线程数，A / B 可以并行解码
+BACKGROUND_WORKERS = max(2, min(4, os.cpu_count() or 2))
+# 差异小地图与画布右下角的距离 (像素)
+MINIMAP_MARGIN = 12
 
 # 自定义 UI 组件
 class RoundedButton(tk.Canvas):
@@ -188,6 +218,154 @@ class ModernPopup(tk.Toplevel):
         y = parent.winfo_rooty() + (parent.winfo_height() // 2) - (total_height // 2)
         self.geometry(f"+{x}+{y}")
 
+class ExportDialog(tk.Toplevel):
+    """导出动画的参数：帧数、缩放比例与时长，确定后以 ExportOptions 调用 on_confirm"""
+    def __init__(self, parent, title, options, on_confirm):
+        super().__init__(parent)
+        self.title(title)
+        self.on_confirm = on_confirm
+
+        bg_color = '#1e1e1e'
+        fg_color = '#e0e0e0'
+        input_color = '#3c3c3c'
+
+        self.configure(bg=bg_color)
+        self.transient(parent)
+        self.grab_set()
+        self.resizable(False, False)
+
+        frame = tk.Frame(self, bg=bg_color, padx=20, pady=20)
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        self.frames_var = tk.StringVar(value=str(options.frames))
+        self.scale_var = tk.StringVar(value=f"{options.scale * 100:g}")
+        self.duration_var = tk.StringVar(value=f"{options.duration:g}")
+        fields = [("帧数", self.frames_var, 2, 1000), ("缩放 (%)", self.scale_var, 1, 100), ("时长 (秒)", self.duration_var, 0.1, 600)]
+        for row, (label, var, low, high) in enumerate(fields):
+            tk.Label(frame, text=label, bg=bg_color, fg=fg_color, font=('Microsoft YaHei UI', 10)).grid(
+                row=row, column=0, sticky=tk.W, pady=4)
+            tk.Spinbox(frame, textvariable=var, from_=low, to=high, width=8, bg=input_color, fg=fg_color,
+                       buttonbackground=input_color, relief=tk.FLAT, insertbackground=fg_color).grid(
+                row=row, column=1, sticky=tk.E, padx=(20, 0), pady=4)
+
+        self.error_label = tk.Label(frame, text="", bg=bg_color, fg='#ff6b6b', font=('Microsoft YaHei UI', 9))
+        self.error_label.grid(row=len(fields), column=0, columnspan=2, pady=(6, 0))
+        btn = RoundedButton(frame, text="导 出", command=self.confirm, width=100, height=35)
+        btn.grid(row=len(fields) + 1, column=0, columnspan=2, pady=(10, 0))
+
+        self.bind('<Return>', lambda e: self.confirm())
+        self.bind('<Escape>', lambda e: self.destroy())
+
+        self.update_idletasks()
+        x = parent.winfo_rootx() + (parent.winfo_width() // 2) - (self.winfo_reqwidth() // 2)
+        y = parent.winfo_rooty() + (parent.winfo_height() // 2) - (self.winfo_reqheight() // 2)
+        self.geometry(f"+{x}+{y}")
+
+    def confirm(self):
+        try:
+            options = ExportOptions(int(self.frames_var.get()), float(self.scale_var.get()) / 100,
+                                    float(self.duration_var.get()))
+        except ValueError:
+            self.error_label.config(text="请输入数字")
+            return
+        if options.frames < 2 or not 0 < options.scale <= 1 or options.duration <= 0:
+            self.error_label.config(text="帧数至少为 2，缩放在 1-100% 之间，时长大于 0")
+            return
+        self.destroy()
+        self.on_confirm(options)
+
+# 重绘调度
+class RenderScheduler:
+    """
+    重绘请求只把对应图层标记为脏，每帧最多真正渲染一次，渲染时总是读取最新状态
+    同一帧内被后续请求覆盖的旧请求直接丢弃，不再排队
+    """
+    def __init__(self, root, render, fps=60):
+        self.root = root
+        self.render = render
+        self.frame_ms = 1000.0 / fps
+        self.dirty = set()
+        self.pending = None
+        self.last_frame = 0.0
+
+        # 统计：dropped 为被合并掉的过期请求，late 为渲染耗时超出帧预算的帧
+        self.frames = 0
+        self.dropped = 0
+        self.late = 0
+        self.render_ms = 0.0
+        self.frame_times = deque(maxlen=240)
+
+    def request(self, layer='view'):
+        if layer in self.dirty:
+            self.dropped += 1
+        self.dirty.add(layer)
+        if self.pending is not None: return
+
+        # 距上一帧不足一帧时间时等到下一帧，否则在事件队列清空后立即渲染
+        wait = self.frame_ms - (time.perf_counter() - self.last_frame) * 1000
+        if wait >= 1:
+            self.pending = self.root.after(int(wait), self.flush)
+        else:
+            self.pending = self.root.after_idle(self.flush)
+
+    def flush(self):
+        self.pending = None
+        if not self.dirty: return
+        layers, self.dirty = self.dirty, set()
+
+        start = time.perf_counter()
+        self.render(layers)
+        end = time.perf_counter()
+
+        self.last_frame = start
+        self.render_ms = (end - start) * 1000
+        if self.render_ms > self.frame_ms: self.late += 1
+        self.frames += 1
+        self.frame_times.append(end)
+
+    def cancel(self):
+        if self.pending is not None:
+            self.root.after_cancel(self.pending)
+            self.pending = None
+        self.dirty.clear()
+
+    def fps(self):
+        """最近一秒内实际渲染的帧数"""
+        now = time.perf_counter()
+        return sum(1 for t in self.frame_times if now - t <= 1.0)
+
+    def stats(self):
+        return {'fps': self.fps(), 'frames': self.frames, 'dropped': self.dropped,
+                'late': self.late, 'render_ms': round(self.render_ms, 2)}
+
+class CanvasSprite:
+    """画布上的一个 RGBA 图层：key 不变时只移动画布对象，不重新上传像素"""
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.item = None
+        self.photo = None
+        self.key = None
+
+    def show(self, key, rgba, x, y):
+        if key != self.key:
+            h, w = rgba.shape[:2]
+            image = Image.frombytes('RGBA', (w, h), np.ascontiguousarray(rgba))
+            if self.photo is not None and (self.photo.width(), self.photo.height()) == (w, h):
+                self.photo.paste(image)
+            else:
+                self.photo = ImageTk.PhotoImage(image)
+                if self.item is not None: self.canvas.itemconfig(self.item, image=self.photo)
+            self.key = key
+        if self.item is None:
+            self.item = self.canvas.create_image(x, y, anchor="nw", image=self.photo)
+        else:
+            self.canvas.itemconfig(self.item, state="normal")
+            self.canvas.coords(self.item, x, y)
+
+    def hide(self):
+        if self.item is not None:
+            self.canvas.itemconfig(self.item, state="hidden")
+
 # 主程序
 class ImageComparer:
     def __init__(self, root_window):
@@ -222,23 +400,49 @@ class ImageComparer:
         
         self.root.configure(bg=self.colors['bg'])
 
-        self.img_a_cv = None
-        self.img_b_cv = None
-        self.img_a_final = None
-        self.img_b_final = None
-        self.img_combined_bgr = None
-        self.combined_image_pil = None
-        self.diff_mask = None
-        self.diff_overlay = None
+        # 图片、差异与合成都由引擎负责，界面只保存与画布相关的状态
+        self.engine = CompareEngine()
+        # 解码结果与差异图按文件内容缓存在磁盘上，重新打开同一对图片时直接读取
+        self.image_cache = ImageCache()
+        self.display_offset_x = 0
+        self.display_offset_y = 0
+        self.view_canvas_size = None
+        self.display_frame = None
+
+        self.image_item = None
+        self.magnifier_item = None
+        self.magnifier_photo = None
+        # 底图与放大镜各自复用一个 PIL 图像和 PhotoImage，只在尺寸变化时重新创建
+        self.frame_image = None
+        self.combined_photo = None
+        self.magnifier_image = None
+        # 局部更新时先把改动的矩形写到暂存图像左上角，再由 Tk 复制到底图的对应位置
+        self.staging_photo = None
+
+        # 滑块、拖动、按键重复与动画都只请求重绘，由调度器按帧合并
+        self.renderer = RenderScheduler(self.root, self.render_frame)
+
+        # 性能 HUD：F3 开关，开启期间记录各阶段耗时，F4 导出逐帧记录
+        self.hud_updated = 0.0
+        self.hud_timer = None
+
+        # 解码与预处理在工作线程中进行；差异区域、小地图与区域统计等较快的分析、SSIM 等耗时的指标
+        # 与导出动画各用单独的线程池，耗时很长的指标或导出不会挤占换图时的解码、差异计算与其他分析
+        self.executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS)
+        self.analysis_executor = ThreadPoolExecutor(max_workers=1)
+        self.metric_executor = ThreadPoolExecutor(max_workers=1)
+        self.export_executor = ThreadPoolExecutor(max_workers=1)
+        self.tasks = {}
+        self.busy_frame = 0
+        self.busy_timer = None
 
         self.line_color = "#ff0000"
         self.line_thickness = 2
         self.line_style = "solid"
         self.show_line = True
         self.show_diff = False
-        self.diff_threshold = 30
-        self.split_x = 0
         self.is_dragging = False
+        self.pan_last = None
 
         self.ctrl_pressed = False
         self.magnifier_zoom = 4.0
@@ -251,7 +455,31 @@ class ImageComparer:
         self.show_ab_labels = False
         self.ab_label_timer = None
         self.ab_label_alpha = 1.0
-        self.swapped = False
+
+        # 差异区域：show_regions 为是否画出全部区域框，region_index 为当前跳转到的区域
+        self.show_regions = False
+        self.region_index = -1
+        # 文件夹对比的图片对列表与预取队列，手动导入图片时退出
+        self.review = None
+        # 上次导出动画使用的参数
+        self.export_options = DEFAULT_OPTIONS
+        # 视频对比：两个视频的预解码缓冲区与逐帧差异，video_index 为当前帧，video_shown 为已经显示的帧
+        self.video = None
+        self.video_index = 0
+        self.video_shown = -1
+        self.video_playing = False
+        self.video_timer = None
+        # 多图对比：engine 换成 GridEngine，grid_queue 为等待按顺序解码加入的文件
+        self.grid_queue = deque()
+        # Shift 拖动框选的原图矩形 (x0, y0, x1, y1)，差异统计栏显示其中灰度差的统计；select_start 为拖动起点
+        self.selection = None
+        self.select_start = None
+        # 正在后台计算积分图的 RegionStats
+        self.stats_building = None
+        # 差异小地图：按当前图片对的 RegionFinder 建立，minimap_dragging 为是否正在小地图上拖动
+        self.show_minimap = False
+        self.minimap = None
+        self.minimap_dragging = False
 
         self.create_ui()
         self.show_initial_message()
@@ -266,6 +494,27 @@ class ImageComparer:
         self.root.bind('<KeyRelease-Control_L>', self.on_ctrl_release)
         self.root.bind('<KeyRelease-Control_R>', self.on_ctrl_release)
         self.root.bind('<MouseWheel>', self.on_mouse_wheel)
+        self.root.bind('<Button-4>', self.on_mouse_wheel)
+        self.root.bind('<Button-5>', self.on_mouse_wheel)
+        self.root.bind('<KeyPress-0>', self.zoom_fit)
+        self.root.bind('<KeyPress-1>', self.zoom_actual)
+        self.root.bind('<KeyPress-n>', self.next_region)
+        self.root.bind('<KeyPress-p>', self.prev_region)
+        self.root.bind('<KeyPress-r>', self.toggle_regions)
+        self.root.bind('<KeyPress-e>', self.export_regions)
+        self.root.bind('<KeyPress-m>', self.toggle_minimap)
+        self.root.bind('<Escape>', self.cancel_export)
+        self.root.bind('<Next>', self.next_pair)
+        self.root.bind('<Prior>', self.prev_pair)
+        self.root.bind('<space>', self.toggle_play)
+        self.root.bind('<KeyPress-comma>', self.prev_frame)
+        self.root.bind('<KeyPress-period>', self.next_frame)
+        self.root.bind('<Home>', self.first_frame)
+        self.root.bind('<KeyPress-g>', self.toggle_grid_layout)
+        self.root.bind('<KeyPress-f>', self.set_grid_reference)
+        self.root.bind('<F3>', self.toggle_hud)
+        self.root.bind('<F4>', self.dump_trace)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def create_ui(self):
         self.main_container = tk.Frame(self.root, bg=self.colors['bg'])
@@ -292,9 +541,24 @@ class ImageComparer:
         center_frame = tk.Frame(import_frame, bg=self.colors['bg'])
         center_frame.pack(side=tk.LEFT, expand=True, fill=tk.X)
 
-        btn_swap = RoundedButton(center_frame, text="🔄 交换", command=self.swap_images, 
+        center_buttons = tk.Frame(center_frame, bg=self.colors['bg'])
+        center_buttons.pack()
+
+        btn_swap = RoundedButton(center_buttons, text="🔄 交换", command=self.swap_images, 
                                  width=100, height=40, bg_color=self.colors['toolbar'], hover_color=self.colors['toolbar_hover'])
-        btn_swap.pack()
+        btn_swap.pack(side=tk.LEFT, padx=5)
+
+        btn_folders = RoundedButton(center_buttons, text="📂 文件夹对比", command=self.open_folders,
+                                    width=130, height=40, bg_color=self.colors['toolbar'], hover_color=self.colors['toolbar_hover'])
+        btn_folders.pack(side=tk.LEFT, padx=5)
+
+        btn_videos = RoundedButton(center_buttons, text="🎬 视频对比", command=self.open_videos,
+                                   width=130, height=40, bg_color=self.colors['toolbar'], hover_color=self.colors['toolbar_hover'])
+        btn_videos.pack(side=tk.LEFT, padx=5)
+
+        btn_grid = RoundedButton(center_buttons, text="🗂 多图对比", command=self.open_grid_images,
+                                 width=130, height=40, bg_color=self.colors['toolbar'], hover_color=self.colors['toolbar_hover'])
+        btn_grid.pack(side=tk.LEFT, padx=5)
 
         right_frame = tk.Frame(import_frame, bg=self.colors['bg'])
         right_frame.pack(side=tk.RIGHT, padx=20)
@@ -352,31 +616,70 @@ class ImageComparer:
         tk.Label(toolbar, text="阈值", **label_style).pack(side=tk.LEFT)
         
         # 使用 ModernSlider 自定义组件
-        self.threshold_scale = ModernSlider(toolbar, from_=0, to=100, initial=self.diff_threshold,
+        self.threshold_scale = ModernSlider(toolbar, from_=0, to=100, initial=self.engine.diff_threshold,
                                            command=self.on_threshold_change, width=100, height=24, bg_color=self.colors['toolbar'])
         self.threshold_scale.pack(side=tk.LEFT, padx=5)
 
+        # 高亮与统计所用的指标：灰度差阈值，或分块计算的 SSIM / PSNR / ΔE2000 热力图
+        self.metric_titles = {"像素差": None}
+        self.metric_titles.update((title, name) for name, (title, _) in METRICS.items())
+        self.metric_var = tk.StringVar(value="像素差")
+        om = tk.OptionMenu(toolbar, self.metric_var, *self.metric_titles, command=self.on_metric_change)
+        om.config(bg=self.colors['toolbar'], fg=self.colors['text'], highlightthickness=0, bd=0, relief=tk.FLAT)
+        om["menu"].config(bg=self.colors['toolbar'], fg=self.colors['text'])
+        om.pack(side=tk.LEFT)
+
+        # 计算差异前自动配准 B：平移、相似变换或透视
+        tk.Label(toolbar, text="对齐", **label_style).pack(side=tk.LEFT, padx=(5, 0))
+        self.align_titles = {"尺寸": None}
+        self.align_titles.update((title, name) for name, title in ALIGN_MODES.items())
+        self.align_var = tk.StringVar(value="尺寸")
+        om = tk.OptionMenu(toolbar, self.align_var, *self.align_titles, command=self.on_align_change)
+        om.config(bg=self.colors['toolbar'], fg=self.colors['text'], highlightthickness=0, bd=0, relief=tk.FLAT)
+        om["menu"].config(bg=self.colors['toolbar'], fg=self.colors['text'])
+        om.pack(side=tk.LEFT)
+
         self.diff_info_label = tk.Label(toolbar, text="0%", **label_style)
         self.diff_info_label.pack(side=tk.LEFT, padx=5)
 
         add_sep()
         
-        tk.Button(toolbar, text="💾 保存GIF", command=self.save_gif_animation, **btn_style).pack(side=tk.LEFT)
+        tk.Button(toolbar, text="💾 导出动画", command=self.save_animation, **btn_style).pack(side=tk.LEFT)
         add_sep()
         tk.Button(toolbar, text="❓ 帮助", command=self.show_shortcuts_help, **btn_style).pack(side=tk.LEFT)
 
+        # 后台任务状态
+        self.busy_label = tk.Label(toolbar, text="", bg=self.colors['toolbar'], fg=self.colors['accent'], 
+                                   font=('Microsoft YaHei UI', 9))
+        self.busy_label.pack(side=tk.RIGHT, padx=10)
+        # 点击状态文字取消正在进行的导出
+        self.busy_label.bind("<Button-1>", self.cancel_export)
+        # 导出进度条，只在导出期间画出
+        self.progress_bar = tk.Canvas(toolbar, width=120, height=6, bg=self.colors['toolbar'], highlightthickness=0)
+        self.progress_bar.pack(side=tk.RIGHT)
+
     def create_canvas(self):
         canvas_container = tk.Frame(self.main_container, bg=self.colors['canvas'])
         canvas_container.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
         self.canvas = tk.Canvas(canvas_container, bg=self.colors['canvas'], highlightthickness=0)
         self.canvas.pack(fill=tk.BOTH, expand=True)
+        # 中线与 A/B 标签是底图之上的独立图层
+        self.line_sprite = CanvasSprite(self.canvas)
+        self.label_sprites = [CanvasSprite(self.canvas), CanvasSprite(self.canvas)]
+        self.minimap_sprite = CanvasSprite(self.canvas)
         
         self.canvas.bind("<Configure>", self.on_canvas_configure)
         self.canvas.bind("<Button-1>", self.on_canvas_click)
         self.canvas.bind("<B1-Motion>", self.on_canvas_drag)
+        self.canvas.bind("<Shift-Button-1>", self.on_select_start)
+        self.canvas.bind("<Shift-B1-Motion>", self.on_canvas_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_canvas_release)
         self.canvas.bind("<Motion>", self.on_mouse_move)
+        # 中键或右键拖动平移
+        for button in (2, 3):
+            self.canvas.bind(f"<ButtonPress-{button}>", self.on_pan_start)
+            self.canvas.bind(f"<B{button}-Motion>", self.on_pan_drag)
 
     def create_slider(self):
         self.slider_frame = tk.Frame(self.main_container, bg=self.colors['toolbar'])
@@ -388,40 +691,55 @@ class ImageComparer:
         self.slider = ModernSlider(self.slider_frame, from_=0, to=100, command=self.redraw, 
                                   width=500, height=30, bg_color=self.colors['toolbar'])
         self.slider.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=10)
+
+        self.zoom_label = tk.Label(self.slider_frame, text="", width=6,
+                                   bg=self.colors['toolbar'], fg=self.colors['text_secondary'],
+                                   font=('Microsoft YaHei UI', 8))
+        self.zoom_label.pack(side=tk.RIGHT, padx=10)
         
         self.slider_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=10)
 
+        # 视频对比时在滑块上方显示逐帧差异曲线，点击或拖动跳转
+        self.video_plot = tk.Canvas(self.main_container, height=VIDEO_PLOT_HEIGHT, bg=self.colors['toolbar'],
+                                    highlightthickness=0)
+        self.video_plot.bind("<Button-1>", self.on_plot_click)
+        self.video_plot.bind("<B1-Motion>", self.on_plot_click)
+        self.video_plot.bind("<Configure>", lambda event: self.draw_video_plot())
+
     # 逻辑代码
-    def apply_magnifier_overlay(self, display_img_bgr):
-        if not self.ctrl_pressed or self.img_combined_bgr is None:
-            return display_img_bgr
-            
-        h_disp, w_disp = display_img_bgr.shape[:2]
-        h_src, w_src = self.img_combined_bgr.shape[:2]
+    def update_magnifier(self):
+        """放大镜是独立的画布图层，只刷新自身的小块图像，不触碰底图"""
+        engine = self.engine
+        if not self.ctrl_pressed or not engine.has_pair() or engine.view_a is None:
+            self.hide_magnifier()
+            return
+
+        w_disp, h_disp = engine.view_size()
+        h_src, w_src = engine.height, engine.width
         
         mx_canvas, my_canvas = self.mouse_x, self.mouse_y
         rel_x = mx_canvas - self.display_offset_x
         rel_y = my_canvas - self.display_offset_y
         
         if not (0 <= rel_x < w_disp and 0 <= rel_y < h_disp):
-            return display_img_bgr
+            self.hide_magnifier()
+            return
 
-        src_cx = int(rel_x / self.display_scale)
-        src_cy = int(rel_y / self.display_scale)
+        img_x, img_y = engine.canvas_to_image(mx_canvas, my_canvas)
+        src_cx = min(int(img_x), w_src - 1)
+        src_cy = min(int(img_y), h_src - 1)
         
-        zoom = self.magnifier_zoom
         box_size = self.magnifier_size
-        
-        crop_radius = int(box_size / zoom / 2)
-        x1 = max(0, src_cx - crop_radius)
-        y1 = max(0, src_cy - crop_radius)
-        x2 = min(w_src, src_cx + crop_radius)
-        y2 = min(h_src, src_cy + crop_radius)
-        
-        if x2 <= x1 or y2 <= y1: return display_img_bgr
-        
-        src_patch = self.img_combined_bgr[y1:y2, x1:x2]
-        zoomed_patch = cv2.resize(src_patch, (box_size, box_size), interpolation=cv2.INTER_NEAREST)
+        self.ensure_region_stats()
+        with engine.timer.stage("放大镜合成"):
+            loupe = engine.render_loupe(src_cx, src_cy, self.magnifier_zoom, box_size, self.show_diff,
+                                        self.line_spec())
+        if loupe is None:
+            self.hide_magnifier()
+            return
+        border = engine.LOUPE_BORDER
+        # 信息栏在放大区域下方，放大镜比 box_size 高
+        box_h = loupe.shape[0] - 2 * border
 
         offset = 20
         pos_x = rel_x + offset
@@ -429,160 +747,551 @@ class ImageComparer:
         
         if pos_x + box_size > w_disp:
             pos_x = rel_x - offset - box_size
-        if pos_y + box_size > h_disp:
-            pos_y = rel_y - offset - box_size
+        if pos_y + box_h > h_disp:
+            pos_y = rel_y - offset - box_h
 
         pos_x = max(0, min(pos_x, w_disp - box_size))
-        pos_y = max(0, min(pos_y, h_disp - box_size))
+        pos_y = max(0, min(pos_y, h_disp - box_h))
         
-        dx1, dy1 = int(pos_x), int(pos_y)
-        dx2, dy2 = dx1 + box_size, dy1 + box_size
-
-        cv2.rectangle(display_img_bgr, (dx1-1, dy1-1), (dx2+1, dy2+1), (255, 255, 255), 1)
-        cv2.rectangle(display_img_bgr, (dx1-2, dy1-2), (dx2+2, dy2+2), (0, 0, 0), 2)
+        with engine.timer.stage("放大镜 PhotoImage"):
+            self.magnifier_photo, self.magnifier_image = self.paste_frame(self.magnifier_photo,
+                                                                          self.magnifier_image, loupe)
         
-        try:
-            display_img_bgr[dy1:dy2, dx1:dx2] = zoomed_patch
-        except ValueError:
-            pass
-        
-        cx, cy = dx1 + box_size // 2, dy1 + box_size // 2
-        cv2.line(display_img_bgr, (cx, dy1), (cx, dy2), (0, 255, 0), 1)
-        cv2.line(display_img_bgr, (dx1, cy), (dx2, cy), (0, 255, 0), 1)
-
-        try:
-            b, g, r_val = self.img_combined_bgr[src_cy, src_cx]
-            info_text = f"RGB: {r_val},{g},{b}"
-            
-            text_bg_h = 24
-            text_y1 = dy2 - text_bg_h
-            text_y2 = dy2
-            
-            if text_y1 >= 0 and text_y2 <= h_disp:
-                cv2.rectangle(display_img_bgr, (dx1, text_y1), (dx2, text_y2), (20, 20, 20), -1)
-                swatch_size = 12
-                sx1 = dx1 + 8
-                sy1 = text_y1 + (text_bg_h - swatch_size) // 2
-                cv2.rectangle(display_img_bgr, (sx1, sy1), (sx1+swatch_size, sy1+swatch_size), 
-                             (int(b), int(g), int(r_val)), -1)
-                cv2.rectangle(display_img_bgr, (sx1, sy1), (sx1+swatch_size, sy1+swatch_size), 
-                             (200, 200, 200), 1)
-                cv2.putText(display_img_bgr, info_text, (sx1 + swatch_size + 8, text_y2 - 6), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.45, (230, 230, 230), 1, cv2.LINE_AA)
-        except:
-            pass
-
-        return display_img_bgr
+        canvas_x = self.display_offset_x + int(pos_x) - border
+        canvas_y = self.display_offset_y + int(pos_y) - border
+        if self.magnifier_item is None:
+            self.magnifier_item = self.canvas.create_image(canvas_x, canvas_y, anchor="nw", image=self.magnifier_photo)
+        else:
+            self.canvas.itemconfig(self.magnifier_item, image=self.magnifier_photo, state="normal")
+            self.canvas.coords(self.magnifier_item, canvas_x, canvas_y)
+        self.canvas.tag_raise(self.magnifier_item)
+
+    def hide_magnifier(self):
+        if self.magnifier_item is not None:
+            self.canvas.itemconfig(self.magnifier_item, state="hidden")
+
+    def set_base_image(self, photo, x, y):
+        # 底图只保留一个画布图像对象，PhotoImage 换了才重新关联，否则只更新坐标
+        if self.image_item is None:
+            self.image_item = self.canvas.create_image(x, y, anchor="nw", image=photo)
+            self.canvas.tag_lower(self.image_item)
+        elif photo is not self.combined_photo:
+            self.canvas.itemconfig(self.image_item, image=photo)
+        self.canvas.coords(self.image_item, x, y)
+        self.combined_photo = photo
+        self.canvas.image = photo
+
+    def paste_frame(self, photo, image, frame):
+        """
+        把 RGB 数组写入复用的 PIL 图像，再原地更新 PhotoImage，返回 (photo, image)
+        frombytes 直接写入已有图像内存，paste 不会创建新的 Tk 图像
+        """
+        h, w = frame.shape[:2]
+        if image is None or image.size != (w, h):
+            image = Image.new('RGB', (w, h))
+            photo = ImageTk.PhotoImage('RGB', (w, h))
+        image.frombytes(frame)
+        photo.paste(image)
+        return photo, image
+
+    def paste_region(self, frame, rect):
+        x0, y0, x1, y1 = rect
+        w, h = x1 - x0, y1 - y0
+        if self.staging_photo is None or (self.staging_photo.width(), self.staging_photo.height()) != self.frame_image.size:
+            self.staging_photo = ImageTk.PhotoImage('RGB', self.frame_image.size)
+        region = Image.frombytes('RGB', (w, h), np.ascontiguousarray(frame[y0:y1, x0:x1]))
+        self.staging_photo.paste(region)
+        self.root.tk.call(str(self.combined_photo), 'copy', str(self.staging_photo),
+                          '-from', 0, 0, w, h, '-to', x0, y0)
 
     def update_image_display(self):
-        if self.combined_image_pil is None: return
+        if self.display_frame is None: return
+
+        # 引擎输出即为 RGB，不再转换通道顺序，也不再为每一帧创建新的图像对象
+        frame = self.display_frame
+        h, w = frame.shape[:2]
+        dirty = self.engine.dirty_rects
+        timer = self.engine.timer
+
+        # 只移动了中线或标签在淡出时，只把改动过的矩形推给 Tk；改动面积过半时整幅更新更划算
+        partial = (dirty is not None and self.frame_image is not None and self.frame_image.size == (w, h)
+                   and sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in dirty) * 2 < w * h)
+        if partial:
+            with timer.stage("局部更新"):
+                for rect in dirty:
+                    self.paste_region(frame, rect)
+            photo = self.combined_photo
+        else:
+            with timer.stage("PhotoImage"):
+                photo, self.frame_image = self.paste_frame(self.combined_photo, self.frame_image, frame)
+        with timer.stage("画布更新"):
+            self.set_base_image(photo, self.display_offset_x, self.display_offset_y)
         
+        if self.ctrl_pressed:
+            self.update_magnifier()
+
+    def invalidate_view_cache(self):
+        self.view_canvas_size = None
+        self.engine.invalidate_view()
+
+    def update_view_cache(self):
         canvas_width = self.canvas.winfo_width()
         canvas_height = self.canvas.winfo_height()
-        
-        if canvas_width <= 1 or canvas_height <= 1: return
-        
-        img_width, img_height = self.combined_image_pil.size
-        scale_x = canvas_width / img_width
-        scale_y = canvas_height / img_height
-        self.display_scale = min(scale_x, scale_y)
-        
-        new_width = int(img_width * self.display_scale)
-        new_height = int(img_height * self.display_scale)
-        
-        resized_pil = self.combined_image_pil.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        display_img = np.array(resized_pil)
-        display_img = cv2.cvtColor(display_img, cv2.COLOR_RGB2BGR)
-        
-        self.display_offset_x = (canvas_width - new_width) // 2
-        self.display_offset_y = (canvas_height - new_height) // 2
-        
-        if self.ctrl_pressed:
-            display_img = self.apply_magnifier_overlay(display_img)
 
-        display_img = cv2.cvtColor(display_img, cv2.COLOR_BGR2RGB)
-        final_pil = Image.fromarray(display_img)
-        self.combined_photo = ImageTk.PhotoImage(image=final_pil)
-        
-        self.canvas.delete("all")
-        self.canvas.create_image(self.display_offset_x, self.display_offset_y, anchor="nw", image=self.combined_photo)
-        self.canvas.image = self.combined_photo
+        if canvas_width <= 1 or canvas_height <= 1: return False
+
+        if self.view_canvas_size != (canvas_width, canvas_height):
+            self.engine.set_viewport(canvas_width, canvas_height)
+            self.view_canvas_size = (canvas_width, canvas_height)
+
+        self.display_offset_x, self.display_offset_y = self.engine.update_view()
+        self.zoom_label.config(text=f"{self.engine.display_scale * 100:.0f}%")
+        return True
 
     def on_mouse_move(self, event):
-        if self.img_a_final is None: return
+        if not self.engine.has_pair(): return
         self.mouse_x = event.x
         self.mouse_y = event.y
+        if isinstance(self.engine, GridEngine): self.update_grid_focus(event.x, event.y)
         if self.ctrl_pressed:
             if abs(self.mouse_x - self.last_mouse_x) > 1 or abs(self.mouse_y - self.last_mouse_y) > 1:
-                self.update_image_display()
+                self.renderer.request('magnifier')
                 self.last_mouse_x = self.mouse_x
                 self.last_mouse_y = self.mouse_y
 
     def on_mouse_wheel(self, event):
+        # Windows / macOS 使用 event.delta，X11 使用 Button-4 / Button-5
+        scroll_up = event.num == 4 or event.delta > 0
         if self.ctrl_pressed:
-            delta = 1.0 if event.delta > 0 else -1.0
+            delta = 1.0 if scroll_up else -1.0
             self.magnifier_zoom = max(1.0, min(16.0, self.magnifier_zoom + delta))
-            self.update_image_display()
+            self.renderer.request('magnifier')
+        elif self.engine.has_pair() and self.engine.viewport is not None:
+            # 以鼠标所在位置为中心缩放视图
+            x = event.x_root - self.canvas.winfo_rootx()
+            y = event.y_root - self.canvas.winfo_rooty()
+            if not (0 <= x < self.canvas.winfo_width() and 0 <= y < self.canvas.winfo_height()): return
+            self.engine.zoom_at(1.25 if scroll_up else 0.8, x, y)
+            self.redraw(self.engine.split_x)
+
+    def on_pan_start(self, event):
+        self.pan_last = (event.x, event.y)
+
+    def on_pan_drag(self, event):
+        if not self.engine.has_pair() or self.pan_last is None: return
+        dx, dy = event.x - self.pan_last[0], event.y - self.pan_last[1]
+        self.pan_last = (event.x, event.y)
+        self.engine.pan(dx, dy)
+        self.redraw(self.engine.split_x)
+
+    def zoom_fit(self, event=None):
+        if not self.engine.has_pair() or self.engine.viewport is None: return
+        self.engine.fit()
+        self.redraw(self.engine.split_x)
+
+    def zoom_actual(self, event=None):
+        if not self.engine.has_pair() or self.engine.viewport is None: return
+        view_w, view_h = self.engine.viewport
+        self.engine.zoom_to(1.0, view_w / 2, view_h / 2)
+        self.redraw(self.engine.split_x)
 
     # 显示帮助消息
     def show_initial_message(self):
-        canvas_width = 800
-        canvas_height = 500
-        canvas = Image.new('RGB', (canvas_width, canvas_height), color=(30, 30, 30))
-        draw = ImageDraw.Draw(canvas)
-        
-        try:
-            font_large = ImageFont.truetype("msyh.ttc", 32)
-            font_small = ImageFont.truetype("msyh.ttc", 20)
-        except:
-            font_large = ImageFont.load_default()
-            font_small = ImageFont.load_default()
-        
-        w, h = canvas_width, canvas_height
-        msg1 = "请导入图片 A 与 图片 B"
-        msg2 = "按住 Ctrl 移动鼠标可使用放大镜"
-        
-        draw.text((w//2 - 150, h//2 - 50), msg1, fill=(200, 200, 200), font=font_large)
-        draw.text((w//2 - 140, h//2 + 10), msg2, fill=(150, 150, 150), font=font_small)
-        
-        self.combined_image_pil = canvas
-        self.img_combined_bgr = cv2.cvtColor(np.array(canvas), cv2.COLOR_RGB2BGR)
-        self.root.after(100, self.update_image_display)
+        # 用画布原生文字绘制，启动时无需加载 Pillow
+        self.canvas.create_text(0, 0, text="请导入图片 A 与 图片 B", fill="#c8c8c8",
+                                font=('Microsoft YaHei UI', 24), tags=("placeholder", "placeholder_title"))
+        self.canvas.create_text(0, 0, text="按住 Ctrl 移动鼠标可使用放大镜", fill="#969696",
+                                font=('Microsoft YaHei UI', 15), tags=("placeholder", "placeholder_hint"))
+        self.layout_placeholder(800, 500)
+
+    def layout_placeholder(self, width, height):
+        self.canvas.coords("placeholder_title", width // 2, height // 2 - 30)
+        self.canvas.coords("placeholder_hint", width // 2, height // 2 + 25)
 
     def load_image(self, side):
-        path = filedialog.askopenfilename(title=f'请选择图片 {side}', filetypes=[('Images', '*.jpg *.jpeg *.png *.bmp *.tiff *.tif')])
+        path = filedialog.askopenfilename(title=f'请选择图片 {side}', filetypes=IMAGE_FILETYPES)
         if not path: return
 
+        # 新选择的文件会取代同侧尚未完成的解码，以及基于旧图片的预处理
+        self.cancel_task('pair')
+        self.close_video()
+        self.close_grid()
+        if self.review is not None:
+            self.review.close()
+            self.review = None
+            self.update_title()
+        self.run_in_background(side, f"图片 {side}", self.image_cache.decode, path,
+                               on_done=lambda result: self.on_image_decoded(side, *result),
+                               error_text=f"无法读取图片 {side}！")
+
+    def on_image_decoded(self, side, image, key=None):
+        self.engine.set_image(side, image, key)
+        if self.engine.can_prepare():
+            self.prepare_images()
+
+    # 文件夹对比
+    def open_folders(self):
+        dir_a = filedialog.askdirectory(title="请选择文件夹 A")
+        if not dir_a: return
+        dir_b = filedialog.askdirectory(title="请选择文件夹 B")
+        if not dir_b: return
+        pairs, only_a, only_b = match_folder_pairs(dir_a, dir_b)
+        if not pairs:
+            ModernPopup(self.root, "提示", "两个文件夹中没有同名的图片", is_error=True)
+            return
+        if only_a or only_b:
+            ModernPopup(self.root, "文件夹对比", f"匹配到 {len(pairs)} 对图片\n仅 A 中有 {len(only_a)} 张，仅 B 中有 {len(only_b)} 张")
+        self.close_video()
+        self.close_grid()
+        if self.review is not None: self.review.close()
+        self.review = ReviewSession(pairs, self.image_cache)
+        self.goto_pair(0)
+
+    def next_pair(self, event=None): self.step_pair(1)
+    def prev_pair(self, event=None): self.step_pair(-1)
+
+    def step_pair(self, step):
+        if self.review is None: return
+        index = self.review.index + step
+        if 0 <= index < len(self.review): self.goto_pair(index)
+
+    def goto_pair(self, index):
+        """显示第 index 对；已经预取好时立即显示，否则等待它准备好，同时在后台继续准备之后的几对"""
+        review = self.review
+        self.cancel_task('A')
+        self.cancel_task('B')
+        entry = review.request(index, self.align_titles[self.align_var.get()])
+        self.update_title()
+        self.track_task('pair', FollowedTask(entry, f"图片对 {index + 1}/{len(review)}"),
+                        on_done=lambda pair: self.on_review_pair_ready(review, pair),
+                        error_text=f"无法准备图片对 {review.name(index)}！")
+
+    def on_review_pair_ready(self, review, pair):
+        if review is not self.review or pair.index != review.index: return
+        self.engine.set_image('A', pair.img_a, pair.key_a)
+        self.engine.set_image('B', pair.img_b, pair.key_b)
+        self.on_pair_prepared(pair.result, pair.previews, pair.alignment)
+
+    def update_title(self):
+        review = self.review
+        if self.video is not None:
+            self.root.title(f"图片比较 - {os.path.basename(self.video.path_a)} / {os.path.basename(self.video.path_b)}")
+        elif isinstance(self.engine, GridEngine):
+            self.root.title(f"图片比较 - 多图对比 {len(self.engine.items)} 张")
+        elif review is None or review.index < 0:
+            self.root.title("图片比较")
+        else:
+            self.root.title(f"图片比较 - {review.index + 1}/{len(review)} {review.name(review.index)}")
+
+    # 视频对比
+    def open_videos(self):
+        filetypes = [('Videos', ' '.join(f'*{ext}' for ext in VIDEO_EXTENSIONS))]
+        path_a = filedialog.askopenfilename(title="请选择视频 A", filetypes=filetypes)
+        if not path_a: return
+        path_b = filedialog.askopenfilename(title="请选择视频 B", filetypes=filetypes)
+        if not path_b: return
+        self.cancel_task('A')
+        self.cancel_task('B')
+        self.run_in_background('pair', "打开视频", VideoPair, path_a, path_b,
+                               on_done=self.on_video_opened, error_text="无法打开视频！")
+
+    def on_video_opened(self, video):
+        if self.review is not None:
+            self.review.close()
+            self.review = None
+        self.close_video()
+        self.close_grid()
+        # 视频帧不经过图片的预处理流程，切换对齐方式不会用旧图片覆盖当前帧
+        self.engine.set_image('A', None)
+        self.engine.set_image('B', None)
+        video.set_threshold(self.engine.diff_threshold)
+        self.video = video
+        self.video_plot.pack(side=tk.BOTTOM, fill=tk.X, padx=10, after=self.slider_frame)
+        self.update_title()
+        self.goto_frame(0)
+
+    def close_video(self):
+        if self.video is None: return
+        if self.video_timer:
+            self.root.after_cancel(self.video_timer)
+            self.video_timer = None
+        self.video.close()
+        self.video = None
+        self.video_playing = False
+        self.video_shown = -1
+        self.video_plot.pack_forget()
+        self.update_title()
+
+    def toggle_play(self, event=None):
+        video = self.video
+        if video is None: return
+        self.video_playing = not self.video_playing
+        # 在最后一帧按播放时从头开始
+        if self.video_playing and self.video_index >= video.frame_count - 1: self.video_index = 0
+        self.draw_video_plot()
+        self.video_tick()
+
+    def next_frame(self, event=None): self.step_frame(1)
+    def prev_frame(self, event=None): self.step_frame(-1)
+    def first_frame(self, event=None): self.goto_frame(0)
+
+    def step_frame(self, step):
+        if self.video is None: return
+        self.video_playing = False
+        self.goto_frame(self.video_index + step)
+
+    def goto_frame(self, index):
+        if self.video is None: return
+        self.video_index = max(0, min(int(index), self.video.frame_count - 1))
+        self.draw_video_plot()
+        self.video_tick()
+
+    def video_tick(self):
+        """
+        显示当前帧；还没准备好时稍后再试（不阻塞界面）。播放时按帧率推进，
+        跟不上时等待而不是跳帧，逐帧差异曲线不会缺帧
+        """
+        if self.video_timer:
+            self.root.after_cancel(self.video_timer)
+            self.video_timer = None
+        video = self.video
+        if video is None: return
+        started = time.perf_counter()
         try:
-            image = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
-            if image is None: raise ValueError("Image decode failed")
+            frame = video.frame(self.video_index, timeout=0)
         except Exception as e:
-            ModernPopup(self.root, "错误", f"无法读取图片 {side}！\n{e}", is_error=True)
+            self.video_playing = False
+            ModernPopup(self.root, "错误", f"视频解码失败！\n{e}", is_error=True)
+            return
+        if frame is None:
+            # 实际帧数比文件头记录的少时停在最后一帧
+            if self.video_index >= video.buffer.count:
+                self.video_playing = False
+                if video.buffer.count > 0: self.goto_frame(video.buffer.count - 1)
+                return
+            self.video_timer = self.root.after(10, self.video_tick)
+            return
+        if frame.index != self.video_shown: self.show_video_frame(frame)
+
+        if not self.video_playing: return
+        if self.video_index + 1 >= video.buffer.count:
+            self.video_playing = False
+            self.draw_video_plot()
             return
-            
-        if side == 'A':
-            self.img_a_cv = image
-            if self.img_b_cv is not None: self.prepare_images()
+        self.video_index += 1
+        delay = 1000 / video.fps - (time.perf_counter() - started) * 1000
+        self.video_timer = self.root.after(max(1, int(delay)), self.video_tick)
+
+    def show_video_frame(self, frame):
+        engine = self.engine
+        if not engine.has_pair() or engine.img_a_final.shape != frame.result[0].shape:
+            self.on_pair_prepared(frame.result)
         else:
-            self.img_b_cv = image
-            if self.img_a_cv is not None: self.prepare_images()
+            engine.apply_frame(frame.result)
+            self.region_index = -1
+            self.update_diff_info()
+            # 播放时只按像素差统计，暂停或单步时才计算所选的分块指标与差异区域
+            if not self.video_playing:
+                self.on_metric_change(self.metric_var.get())
+                if self.show_regions: self.with_regions(self.on_regions_ready)
+            self.redraw(engine.split_x)
+        self.video_shown = frame.index
+        self.video.record(frame.index, engine.diff_percent())
+        self.draw_video_plot()
+
+    def draw_video_plot(self):
+        """差异曲线：每个像素列取该列所含各帧的最大值，长视频也只画画布宽度个点"""
+        plot = self.video_plot
+        plot.delete("all")
+        video = self.video
+        if video is None: return
+        w, h = plot.winfo_width(), VIDEO_PLOT_HEIGHT
+        if w <= 1: return
+        count = video.frame_count
+        edges = np.minimum(np.arange(w + 1) * count // w, count - 1)
+        columns = np.fmax.reduceat(video.percents, edges[:-1])
+        # 帧数少于像素列时 reduceat 的空区间取起点的值，与相邻列相同即可
+        peak = np.nanmax(columns) if not np.all(np.isnan(columns)) else 0
+        scale = (h - 14) / max(peak, 1.0)
+        run = []
+        for x, value in enumerate(columns.tolist()):
+            if np.isnan(value):
+                if len(run) >= 4: plot.create_line(*run, fill=self.colors['accent'])
+                run = []
+                continue
+            run += [x, h - 2 - value * scale]
+        if len(run) >= 4: plot.create_line(*run, fill=self.colors['accent'])
+        x = self.video_index * w / max(1, count - 1)
+        plot.create_line(x, 0, x, h, fill=self.colors['text'])
+        value = video.percents[self.video_index]
+        text = f"帧 {self.video_index + 1}/{count}" + ("" if np.isnan(value) else f"   差异 {value:.2f}%")
+        text += f"   峰值 {peak:.2f}%" + ("   ▶" if self.video_playing else "")
+        plot.create_text(6, 2, anchor="nw", text=text, fill=self.colors['text_secondary'],
+                         font=('Microsoft YaHei UI', 8))
+
+    def on_plot_click(self, event):
+        video = self.video
+        if video is None: return
+        w = max(1, self.video_plot.winfo_width() - 1)
+        self.video_playing = False
+        self.goto_frame(round(event.x / w * (video.frame_count - 1)))
+
+    # 多图对比
+    def open_grid_images(self):
+        """选择若干张图片加入多图对比；已经在多图对比中时追加，不重新解码已有的图片"""
+        paths = filedialog.askopenfilenames(title="请选择要对比的图片（可多选）", filetypes=IMAGE_FILETYPES)
+        if not paths: return
+        if not isinstance(self.engine, GridEngine): self.enter_grid()
+        self.grid_queue.extend(paths)
+        if 'grid decode' not in self.tasks: self.decode_next_grid_image()
+
+    def enter_grid(self):
+        """换成多图对比引擎，沿用阈值与计时器；原来的 A / B 不带入"""
+        for key in ('A', 'B', 'pair'):
+            self.cancel_task(key)
+        self.close_video()
+        if self.review is not None:
+            self.review.close()
+            self.review = None
+        engine = GridEngine(self.engine.diff_threshold)
+        engine.timer = self.engine.timer
+        self.engine = engine
+        self.region_index = -1
+        self.invalidate_view_cache()
+        self.update_title()
+
+    def close_grid(self):
+        if not isinstance(self.engine, GridEngine): return
+        for key in [k for k in self.tasks if k.startswith('grid')]:
+            self.cancel_task(key)
+        self.grid_queue.clear()
+        engine = CompareEngine(self.engine.diff_threshold)
+        engine.timer = self.engine.timer
+        self.engine = engine
+        self.canvas.delete("grid")
+        self.invalidate_view_cache()
+        self.update_title()
+
+    def decode_next_grid_image(self):
+        """按选择的顺序逐张解码加入，前一张的差异计算与后一张的解码同时进行"""
+        if not self.grid_queue: return
+        path = self.grid_queue.popleft()
+
+        def on_done(result):
+            self.on_grid_image_decoded(path, *result)
+            self.decode_next_grid_image()
+        self.run_in_background('grid decode', f"解码 {os.path.basename(path)}", self.image_cache.decode, path,
+                               on_done=on_done, error_text=f"无法读取图片 {os.path.basename(path)}！")
+
+    def on_grid_image_decoded(self, path, image, key=None):
+        engine = self.engine
+        if not isinstance(engine, GridEngine): return
+        index = engine.add_image(os.path.basename(path), image, key)
+        if index == engine.reference:
+            self.canvas.delete("placeholder")
+            self.slider.set_range(0, engine.width)
+        else:
+            self.prepare_grid_item(index)
+        self.update_title()
+        self.on_grid_changed()
+
+    def prepare_grid_item(self, index):
+        """在后台计算第 index 张相对基准的差异；结果经磁盘缓存，换回算过的基准时直接读取"""
+        engine = self.engine
+        ref, item = engine.items[engine.reference], engine.items[index]
+        reference = engine.reference
+        align = self.align_titles[self.align_var.get()]
+        self.run_in_background(f'grid diff {index}', f"差异 {item.name}", self.image_cache.prepare_pair,
+                               ref.image, item.image, ref.key, item.key, align,
+                               on_done=lambda result: self.on_grid_item_prepared(engine, index, reference, *result),
+                               error_text=f"{item.name} 差异计算失败！")
+
+    def prepare_grid(self):
+        engine = self.engine
+        for index in range(len(engine.items)):
+            if index != engine.reference: self.prepare_grid_item(index)
+
+    def on_grid_item_prepared(self, engine, index, reference, result, previews=None, alignment=None):
+        if engine is not self.engine or not engine.apply_item(index, reference, result, previews, alignment): return
+        self.on_grid_changed()
+
+    def on_grid_changed(self):
+        self.update_diff_info()
+        self.invalidate_view_cache()
+        self.slider.set(self.engine.split_x)
+        self.redraw(self.engine.split_x)
+
+    def update_grid_focus(self, x, y):
+        """焦点跟随鼠标：差异数字、指标、差异区域与放大镜都换成鼠标所在的图片与基准的比较"""
+        engine = self.engine
+        index = engine.item_at(x, y)
+        if index is None or index == engine.focus or not engine.set_focus(index): return
+        self.region_index = -1
+        self.update_diff_info()
+        self.on_metric_change(self.metric_var.get())
+        if self.show_regions: self.with_regions(self.on_regions_ready)
+        self.redraw_overlays()
+
+    def toggle_grid_layout(self, event=None):
+        engine = self.engine
+        if not isinstance(engine, GridEngine) or not engine.has_pair(): return
+        engine.set_layout('split' if engine.layout == 'grid' else 'grid')
+        self.on_grid_changed()
+
+    def set_grid_reference(self, event=None):
+        """以鼠标所在的图片为基准，其余图片重新计算差异（磁盘缓存中有的直接读取）"""
+        engine = self.engine
+        if not isinstance(engine, GridEngine) or not engine.has_pair(): return
+        index = engine.item_at(self.mouse_x, self.mouse_y)
+        if index is None or index == engine.reference: return
+        for key in [k for k in self.tasks if k.startswith('grid diff')]:
+            self.cancel_task(key)
+        for i in engine.set_reference(index):
+            self.prepare_grid_item(i)
+        self.region_index = -1
+        self.slider.set_range(0, engine.width)
+        self.on_grid_changed()
+
+    def update_grid_marks(self):
+        """多图对比的图片名称（基准、焦点、计算中）与多分割布局的分割线，都是底图之上的画布图层"""
+        self.canvas.delete("grid")
+        engine = self.engine
+        if not isinstance(engine, GridEngine): return
+        font = ('Microsoft YaHei UI', 9)
+        if engine.layout == 'grid':
+            ox, oy = engine.cell_offset
+            positions = [(x + ox, y + oy) for x, y in map(engine.cell_origin, range(len(engine.items)))]
+        else:
+            _, h = engine.view_size()
+            left, top = self.display_offset_x, self.display_offset_y
+            line = self.line_spec()
+            positions = [(max(left, engine.image_to_canvas(x, 0)[0]), top) for x in [0] + engine.dividers]
+            for x in engine.dividers if line is not None else ():
+                cx = engine.image_to_canvas(x, 0)[0]
+                self.canvas.create_line(cx, top, cx, top + h, fill=self.line_color, width=line.thickness,
+                                        dash=CANVAS_DASH[line.style], tags="grid")
+        for i, (item, (x, y)) in enumerate(zip(engine.items, positions)):
+            text = item.name + (" [基准]" if i == engine.reference else "") + ("" if item.ready else " …")
+            color = self.colors['accent'] if i == engine.focus else self.colors['text']
+            label = self.canvas.create_text(x + 8, y + 6, anchor="nw", text=text, fill=color, font=font, tags="grid")
+            x1, y1, x2, y2 = self.canvas.bbox(label)
+            self.canvas.create_rectangle(x1 - 4, y1 - 2, x2 + 4, y2 + 2, fill="#000000", outline="", tags="grid")
+            self.canvas.tag_raise(label)
 
     def load_image_a(self): self.load_image('A')
     def load_image_b(self): self.load_image('B')
 
     def swap_images(self, event=None):
-        if self.img_a_final is None or self.img_b_final is None: return
+        if not self.engine.has_pair(): return
         
-        self.img_a_final, self.img_b_final = self.img_b_final, self.img_a_final
-        self.swapped = not self.swapped
-        self.calculate_diff()
+        self.engine.swap()
         
         self.show_ab_labels = True
         if self.ab_label_timer:
             self.root.after_cancel(self.ab_label_timer)
         self.ab_label_timer = self.root.after(1000, self.hide_ab_labels)
         
-        self.redraw(self.split_x)
+        self.redraw(self.engine.split_x)
 
     def hide_ab_labels(self):
         self.fade_out_ab_labels()
@@ -591,258 +1300,638 @@ class ImageComparer:
         if alpha <= 0:
             self.show_ab_labels = False
             self.ab_label_alpha = 1.0
-            self.redraw(self.split_x)
+            self.redraw_overlays()
             return
         
         self.ab_label_alpha = alpha
-        self.redraw(self.split_x)
+        self.redraw_overlays()
         
         self.root.after(30, lambda: self.fade_out_ab_labels(alpha - 0.05))
 
     def prepare_images(self):
-        if self.img_a_cv is None or self.img_b_cv is None: return
-
-        target_h, target_w, _ = self.img_a_cv.shape
-        self.img_a_final = self.img_a_cv.copy()
-        
-        if self.img_b_cv.shape[:2] != (target_h, target_w):
-            self.img_b_final = cv2.resize(self.img_b_cv, (target_w, target_h))
+        if not self.engine.can_prepare(): return
+        engine = self.engine
+        align = self.align_titles[self.align_var.get()]
+        self.run_in_background('pair', "配准" if align else "预处理", self.image_cache.prepare_pair,
+                               engine.img_a, engine.img_b, engine.key_a, engine.key_b, align,
+                               on_done=lambda result: self.on_pair_prepared(*result), error_text="图片预处理失败！")
+
+    def on_align_change(self, title):
+        # 变换按图片对缓存在磁盘上，切换回已经算过的模式时不再重新配准
+        if isinstance(self.engine, GridEngine):
+            self.prepare_grid()
         else:
-            self.img_b_final = self.img_b_cv.copy()
+            self.prepare_images()
+
+    def on_pair_prepared(self, result, previews=None, alignment=None):
+        self.engine.apply_prepared(result, previews, alignment)
+        self.region_index = -1
+        self.canvas.delete("placeholder")
+        self.update_diff_info()
+        self.invalidate_view_cache()
+        self.on_metric_change(self.metric_var.get())
 
-        self.calculate_diff()
-        
         # 更新 ModernSlider 的范围
-        self.slider.set_range(0, target_w)
-        self.split_x = target_w // 2
-        self.slider.set(self.split_x)
-        self.redraw(self.split_x)
-
-    def calculate_diff(self):
-        if self.img_a_final is None or self.img_b_final is None: return
-        diff = cv2.absdiff(self.img_a_final, self.img_b_final)
-        gray_diff = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
-        _, thresholded = cv2.threshold(gray_diff, self.diff_threshold, 255, cv2.THRESH_BINARY)
-        self.diff_mask = thresholded
-        
-        diff_pixels = np.count_nonzero(thresholded)
-        total_pixels = thresholded.size
-        diff_percent = (diff_pixels / total_pixels) * 100
-        self.diff_info_label.config(text=f"差异: {diff_percent:.2f}%")
-
-        self.diff_overlay = np.zeros_like(self.img_a_final)
-        self.diff_overlay[thresholded > 0] = [0, 0, 255]
+        self.slider.set_range(0, self.engine.width)
+        self.slider.set(self.engine.split_x)
+        self.redraw(self.engine.split_x)
+        if self.show_regions: self.with_regions(self.on_regions_ready)
+
+    def update_diff_info(self):
+        text = self.engine.diff_text()
+        regions = self.engine.diff_regions() if self.engine.has_pair() else None
+        if regions is not None and (self.show_regions or self.region_index >= 0):
+            current = f"{self.region_index + 1}/" if self.region_index >= 0 else ""
+            text += f"   区域 {current}{len(regions)}"
+        text += self.selection_text()
+        self.diff_info_label.config(text=text)
+
+    # 差异小地图
+    def toggle_minimap(self, event=None):
+        self.show_minimap = not self.show_minimap
+        if self.engine.has_pair(): self.renderer.request('overlay')
+
+    def current_minimap(self):
+        """当前图片对的小地图，换了图片对（或多图对比换了焦点）时重建；能量图在后台计算，视频播放时不计算"""
+        finder = self.engine.region_finder
+        if finder is None: return None
+        if self.minimap is None or self.minimap.finder is not finder:
+            self.cancel_task('minimap')
+            self.minimap = Minimap(finder)
+        minimap = self.minimap
+        if not minimap.ready and 'minimap' not in self.tasks and not self.video_playing:
+            def on_done(result):
+                if minimap is self.minimap: self.renderer.request('overlay')
+            self.run_in_background('minimap', "差异小地图", minimap.compute, on_done=on_done,
+                                   error_text="差异小地图计算失败！", executor=self.analysis_executor)
+        return minimap
+
+    def minimap_origin(self, minimap):
+        canvas_w, canvas_h = self.view_canvas_size
+        w, h = minimap.size
+        return canvas_w - w - MINIMAP_MARGIN, canvas_h - h - MINIMAP_MARGIN
+
+    def update_minimap(self):
+        """小地图画在画布右下角，框出当前视口；阈值变化时只重新着色"""
+        self.canvas.delete("minimap")
+        minimap = self.current_minimap() if self.show_minimap and self.view_canvas_size is not None else None
+        if minimap is None or not minimap.ready:
+            self.minimap_sprite.hide()
+            return
+        engine = self.engine
+        threshold = engine.diff_threshold
+        x, y = self.minimap_origin(minimap)
+        self.minimap_sprite.show((minimap, threshold), minimap.render(threshold), x, y)
+        w, h = minimap.size
+        self.canvas.create_rectangle(x - 1, y - 1, x + w, y + h, outline="#808080", tags="minimap")
+        view_w, view_h = engine.viewport
+        vx0, vy0 = minimap.to_minimap(engine.view_x0, engine.view_y0)
+        vx1, vy1 = minimap.to_minimap(engine.view_x0 + view_w / engine.display_scale,
+                                      engine.view_y0 + view_h / engine.display_scale)
+        self.canvas.create_rectangle(x + max(0, vx0), y + max(0, vy0), x + min(w, vx1), y + min(h, vy1),
+                                     outline="#ffffff", tags="minimap")
+
+    def minimap_at(self, cx, cy):
+        """画布坐标在小地图上时返回小地图坐标，否则返回 None"""
+        minimap = self.minimap
+        if not self.show_minimap or minimap is None or not minimap.ready or self.view_canvas_size is None: return None
+        if minimap.finder is not self.engine.region_finder: return None
+        x, y = self.minimap_origin(minimap)
+        w, h = minimap.size
+        if not (x <= cx < x + w and y <= cy < y + h): return None
+        return cx - x, cy - y
+
+    def minimap_jump(self, cx, cy, zoom_in):
+        """
+        视图跳转到小地图上 (cx, cy) 处；适应窗口显示时 zoom_in 为 True 则放大到该处附近，否则只平移
+        按住 Ctrl 时放大镜跟随到该处
+        """
+        minimap, engine = self.minimap, self.engine
+        w, h = minimap.size
+        x, y = self.minimap_origin(minimap)
+        mx = max(0, min(w - 1, cx - x)) + 0.5
+        my = max(0, min(h - 1, cy - y)) + 0.5
+        ix, iy = minimap.to_image(mx, my)
+        if zoom_in and engine.fit_mode:
+            # 放大到小地图上约 4x4 像素的范围
+            rx, ry = 2 * minimap.width / w, 2 * minimap.height / h
+            engine.show_rect(ix - rx, iy - ry, ix + rx, iy + ry)
+        else:
+            engine.center_on(ix, iy)
+        self.mouse_x, self.mouse_y = (int(v) for v in engine.image_to_canvas(ix, iy))
+        self.redraw(engine.split_x)
+
+    # 区域统计
+    def ensure_region_stats(self):
+        """当前图片对的积分图还没有算好时在后台计算，算好后刷新放大镜与选区统计；视频播放时不计算"""
+        stats = self.engine.region_stats
+        if stats is None or stats.ready or self.video_playing: return
+        if stats is self.stats_building and 'stats' in self.tasks: return
+        self.stats_building = stats
+
+        def on_done(result):
+            self.stats_building = None
+            if stats is not self.engine.region_stats: return
+            self.update_diff_info()
+            if self.ctrl_pressed: self.renderer.request('magnifier')
+        self.run_in_background('stats', "区域统计", stats.compute, on_done=on_done, error_text="区域统计计算失败！",
+                               executor=self.analysis_executor)
+
+    def selection_text(self):
+        stats = self.engine.region_stats
+        if self.selection is None or stats is None: return ""
+        if not stats.ready:
+            self.ensure_region_stats()
+            return ""
+        window = stats.query(*self.selection)
+        if window is None: return ""
+        x0, y0, x1, y1 = self.selection
+        return (f"   选区 {x1 - x0}x{y1 - y0}  均值 {window.mean:.2f}  标准差 {window.std:.2f}"
+                f"  最大 {window.max}")
+
+    def on_select_start(self, event):
+        engine = self.engine
+        if not engine.has_pair() or engine.display_scale == 0: return
+        self.select_start = engine.canvas_to_image(event.x, event.y)
+        self.update_selection(event)
+
+    def update_selection(self, event):
+        engine = self.engine
+        (sx, sy), (ex, ey) = self.select_start, engine.canvas_to_image(event.x, event.y)
+        x0, x1 = max(0, int(min(sx, ex))), min(engine.width, int(max(sx, ex)) + 1)
+        y0, y1 = max(0, int(min(sy, ey))), min(engine.height, int(max(sy, ey)) + 1)
+        self.selection = (x0, y0, x1, y1)
+        self.update_diff_info()
+        self.update_selection_box()
+
+    def update_selection_box(self):
+        self.canvas.delete("selection")
+        if self.selection is None: return
+        x0, y0, x1, y1 = self.selection
+        cx0, cy0 = self.engine.image_to_canvas(x0, y0)
+        cx1, cy1 = self.engine.image_to_canvas(x1, y1)
+        self.canvas.create_rectangle(cx0, cy0, cx1, cy1, outline="#00e5ff", dash=CANVAS_DASH['dashed'],
+                                     tags="selection")
+
+    # 差异区域
+    def with_regions(self, then):
+        """当前阈值下的差异区域算好后调用 then()，已经缓存时立即调用"""
+        engine = self.engine
+        if not engine.has_pair(): return
+        if engine.diff_regions() is not None:
+            then()
+            return
+        finder, threshold = engine.region_finder, engine.diff_threshold
+
+        def on_done(regions):
+            # 计算期间换了图片或阈值时丢弃结果
+            if finder is self.engine.region_finder and threshold == self.engine.diff_threshold: then()
+        self.run_in_background('regions', "差异区域", finder.regions, threshold, on_done=on_done,
+                               error_text="差异区域计算失败！", executor=self.analysis_executor)
+
+    def next_region(self, event=None): self.with_regions(lambda: self.step_region(1))
+    def prev_region(self, event=None): self.with_regions(lambda: self.step_region(-1))
+
+    def step_region(self, step):
+        regions = self.engine.diff_regions()
+        if not regions:
+            self.region_index = -1
+        else:
+            if self.region_index < 0 and step < 0: self.region_index = 0
+            self.region_index = (self.region_index + step) % len(regions)
+            self.goto_region(regions[self.region_index])
+        self.update_diff_info()
+
+    def goto_region(self, region):
+        engine = self.engine
+        if engine.viewport is None: return
+        engine.show_rect(region.x0, region.y0, region.x1, region.y1)
+        # 放大镜跟随到区域中心
+        self.mouse_x, self.mouse_y = (int(v) for v in engine.image_to_canvas((region.x0 + region.x1) / 2,
+                                                                            (region.y0 + region.y1) / 2))
+        self.redraw(engine.split_x)
+
+    def toggle_regions(self, event=None):
+        if not self.engine.has_pair(): return
+        self.show_regions = not self.show_regions
+        if self.show_regions:
+            self.with_regions(self.on_regions_ready)
+        else:
+            self.on_regions_ready()
+
+    def on_regions_ready(self):
+        self.update_diff_info()
+        self.redraw_overlays()
+
+    def export_regions(self, event=None):
+        if not self.engine.has_pair(): return
+        path = filedialog.asksaveasfilename(defaultextension='.csv',
+                                            filetypes=[('CSV', '*.csv'), ('JSON Lines', '*.jsonl')])
+        if not path: return
+
+        def write():
+            try:
+                count = write_regions(path, self.engine.diff_regions())
+                ModernPopup(self.root, "成功", f"已导出 {count} 个差异区域！")
+            except Exception as e:
+                ModernPopup(self.root, "错误", f"导出失败！\n{e}", is_error=True)
+        self.with_regions(write)
+
+    def on_metric_change(self, title):
+        name = self.metric_titles[title]
+        engine = self.engine
+        self.cancel_task('metric')
+        if not engine.has_pair(): return
+        if name is None or engine.metrics.has(name):
+            self.apply_metric(engine.metrics, name)
+            return
+        # 每个指标对每对图片只计算一次，之后切换直接读取缓存
+        metrics = engine.metrics
+        self.run_in_background('metric', f"计算 {title}", metrics.compute, name,
+                               on_done=lambda result: self.apply_metric(metrics, name),
+                               error_text=f"{title} 计算失败！", executor=self.metric_executor)
+
+    def apply_metric(self, metrics, name):
+        if metrics is not self.engine.metrics: return
+        self.engine.set_metric(name)
+        self.update_diff_info()
+        self.redraw(self.engine.split_x)
+
+    def line_spec(self):
+        if not self.show_line: return None
+        return LineStyle(hex_to_rgb(self.line_color), self.line_thickness, self.line_style)
 
     def redraw(self, value):
-        if self.img_a_final is None or self.img_b_final is None: return
-
-        split_x = int(value)
-        h, w, _ = self.img_a_final.shape
-        
-        canvas = np.zeros((h, w, 3), dtype=np.uint8)
-        
-        if split_x > 0:
-            canvas[:, 0:split_x] = self.img_a_final[:, 0:split_x]
-        if split_x < w:
-            canvas[:, split_x:w] = self.img_b_final[:, split_x:w]
-        
-        if self.show_diff and self.diff_overlay is not None:
-            canvas = cv2.addWeighted(canvas, 1, self.diff_overlay, 0.5, 0)
-        
-        if self.show_line:
-            bgr_color = self.hex_to_bgr(self.line_color)
-            self.draw_line(canvas, (split_x, 0), (split_x, h), bgr_color, 
-                          self.line_thickness, self.line_style)
-
-        if self.show_ab_labels:
-            font = cv2.FONT_HERSHEY_SIMPLEX
-            font_scale = 2.0
-            font_thickness = 4
-            padding = 20
-            
-            text_a = "A"
-            text_b = "B"
-            
-            (text_w_a, text_h_a), _ = cv2.getTextSize(text_a, font, font_scale, font_thickness)
-            (text_w_b, text_h_b), _ = cv2.getTextSize(text_b, font, font_scale, font_thickness)
-            
-            box_w_a = text_w_a + padding * 2
-            box_h_a = text_h_a + padding * 2
-            box_w_b = text_w_b + padding * 2
-            box_h_b = text_h_b + padding * 2
-            
-            if self.swapped:
-                box_x_a = w - box_w_a - 20
-                box_y_a = h - box_h_a - 20
-                box_x_b = 20
-                box_y_b = h - box_h_b - 20
+        """记录新的中线位置并请求重绘，实际渲染由 RenderScheduler 在下一帧进行"""
+        if not self.engine.has_pair(): return
+        self.engine.set_split(value)
+        self.renderer.request('view')
+
+    def redraw_overlays(self):
+        """只有中线或标签变化时不重新合成底图；放大镜里也画有中线，显示时一并刷新"""
+        if not self.engine.has_pair(): return
+        self.renderer.request('overlay')
+        if self.ctrl_pressed: self.renderer.request('magnifier')
+
+    def update_overlays(self):
+        engine = self.engine
+        if engine.view_a is None: return
+        ox, oy = self.display_offset_x, self.display_offset_y
+        with engine.timer.stage("叠加图层"):
+            line = self.line_spec()
+            layer = engine.line_layer(line) if line is not None else None
+            if layer is None:
+                self.line_sprite.hide()
             else:
-                box_x_a = 20
-                box_y_a = h - box_h_a - 20
-                box_x_b = w - box_w_b - 20
-                box_y_b = h - box_h_b - 20
-            
-            alpha = int(self.ab_label_alpha * 255)
-            
-            overlay = canvas.copy()
-            
-            cv2.rectangle(overlay, (box_x_a, box_y_a), (box_x_a + box_w_a, box_y_a + box_h_a), (0, 0, 0), -1)
-            cv2.rectangle(overlay, (box_x_a, box_y_a), (box_x_a + box_w_a, box_y_a + box_h_a), (255, 255, 255), 2)
-            cv2.putText(overlay, text_a, (box_x_a + padding, box_y_a + text_h_a + padding - 5), 
-                       font, font_scale, (255, 255, 255), font_thickness, cv2.LINE_AA)
-            
-            cv2.rectangle(overlay, (box_x_b, box_y_b), (box_x_b + box_w_b, box_y_b + box_h_b), (0, 0, 0), -1)
-            cv2.rectangle(overlay, (box_x_b, box_y_b), (box_x_b + box_w_b, box_y_b + box_h_b), (255, 255, 255), 2)
-            cv2.putText(overlay, text_b, (box_x_b + padding, box_y_b + text_h_b + padding - 5), 
-                       font, font_scale, (255, 255, 255), font_thickness, cv2.LINE_AA)
-            
-            cv2.addWeighted(overlay, alpha / 255.0, canvas, 1 - alpha / 255.0, 0, canvas)
-
-        self.img_combined_bgr = canvas
-        img_rgb = cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB)
-        self.combined_image_pil = Image.fromarray(img_rgb)
-        
-        self.update_image_display()
+                key, x, rgba = layer
+                self.line_sprite.show(key, rgba, ox + x, oy)
+
+            labels = engine.ab_label_layers(self.ab_label_alpha) if self.show_ab_labels else []
+            for i, sprite in enumerate(self.label_sprites):
+                if i < len(labels):
+                    key, x, y, rgba = labels[i]
+                    sprite.show(key, rgba, ox + x, oy + y)
+                else:
+                    sprite.hide()
+            self.update_region_boxes()
+            self.update_selection_box()
+            self.update_grid_marks()
+            self.update_minimap()
+        if self.magnifier_item is not None: self.canvas.tag_raise(self.magnifier_item)
+
+    def update_region_boxes(self):
+        self.canvas.delete("region")
+        if not self.show_regions and self.region_index < 0: return
+        regions = self.engine.diff_regions()
+        if not regions: return
+        engine = self.engine
+        view_w, view_h = self.view_canvas_size
+        drawn = 0
+        for i, region in enumerate(regions):
+            current = i == self.region_index
+            if not current and (not self.show_regions or drawn >= MAX_REGION_BOXES): continue
+            x0, y0 = engine.image_to_canvas(region.x0, region.y0)
+            x1, y1 = engine.image_to_canvas(region.x1, region.y1)
+            if x1 < 0 or y1 < 0 or x0 > view_w or y0 > view_h: continue
+            # 向外扩 2 像素，单个像素的区域在缩小显示时也能看到
+            self.canvas.create_rectangle(x0 - 2, y0 - 2, x1 + 2, y1 + 2, width=2 if current else 1,
+                                         outline=self.colors['accent'] if current else "#ffd400", tags="region")
+            if not current: drawn += 1
+
+    def render_frame(self, layers):
+        if not self.engine.has_pair(): return
+        timer = self.engine.timer
+        timer.begin_frame(next(kind for kind in ('view', 'overlay', 'magnifier') if kind in layers))
+        try:
+            if 'view' in layers:
+                if self.engine.view_a is None and not self.update_view_cache(): return
+
+                self.display_frame = self.engine.compose_view(self.show_diff)
+                self.update_image_display()
+                self.update_overlays()
+            else:
+                if 'overlay' in layers: self.update_overlays()
+                if 'magnifier' in layers: self.update_magnifier()
+        finally:
+            timer.end_frame()
+        if timer.enabled: self.update_hud()
 
     def on_canvas_click(self, event):
-        if self.img_a_final is None: return
-        if not hasattr(self, 'display_scale') or self.display_scale == 0: return
-        
-        offset_x = self.display_offset_x
-        click_x = event.x - offset_x
-        img_width = self.img_a_final.shape[1]
-        display_width = img_width * self.display_scale
-        
-        if 0 <= click_x <= display_width:
-            self.split_x = int(click_x / self.display_scale)
-            self.split_x = max(0, min(self.split_x, img_width))
-            self.slider.set(self.split_x)
-            self.redraw(self.split_x) # 显式调用 redraw，因为 set() 只是更新 UI
+        engine = self.engine
+        if not engine.has_pair() or engine.display_scale == 0: return
+        if self.minimap_at(event.x, event.y) is not None:
+            self.minimap_dragging = True
+            self.minimap_jump(event.x, event.y, zoom_in=True)
+            return
+        
+        click_x, _ = engine.canvas_to_image(event.x, event.y)
+        # 多分割布局拖动离点击处最近的分割线
+        if isinstance(engine, GridEngine): engine.grab_divider(click_x)
+        
+        if 0 <= click_x <= engine.width:
+            split_x = engine.set_split(click_x)
+            self.slider.set(split_x)
+            self.redraw(split_x) # 显式调用 redraw，因为 set() 只是更新 UI
             self.is_dragging = True
 
     def on_canvas_drag(self, event):
-        if not self.is_dragging or self.img_a_final is None: return
-        offset_x = self.display_offset_x
-        drag_x = event.x - offset_x
-        img_width = self.img_a_final.shape[1]
-        self.split_x = max(0, min(int(drag_x / self.display_scale), img_width))
-        self.slider.set(self.split_x)
-        self.redraw(self.split_x)
+        engine = self.engine
+        if self.minimap_dragging and engine.has_pair():
+            self.minimap_jump(event.x, event.y, zoom_in=False)
+            return
+        if self.select_start is not None and engine.has_pair():
+            self.update_selection(event)
+            return
+        if not self.is_dragging or not engine.has_pair(): return
+        drag_x, _ = engine.canvas_to_image(event.x, event.y)
+        split_x = engine.set_split(drag_x)
+        self.slider.set(split_x)
+        self.redraw(split_x)
 
-    def on_canvas_release(self, event): self.is_dragging = False
+    def on_canvas_release(self, event):
+        self.is_dragging = False
+        self.minimap_dragging = False
+        if self.select_start is None: return
+        self.select_start = None
+        # 只点击不拖动时取消选区
+        x0, y0, x1, y1 = self.selection
+        if x1 - x0 <= 1 and y1 - y0 <= 1:
+            self.selection = None
+            self.update_diff_info()
+            self.update_selection_box()
 
     def on_canvas_configure(self, event):
-        if self.combined_image_pil:
-            self.update_image_display()
+        if self.engine.has_pair():
+            if self.view_canvas_size != (event.width, event.height):
+                self.invalidate_view_cache()
+                self.redraw(self.engine.split_x)
+        else:
+            self.layout_placeholder(event.width, event.height)
 
     def choose_line_color(self):
         color = colorchooser.askcolor(title="选择中线颜色", initialcolor=self.line_color)
         if color[1]:
             self.line_color = color[1]
             self.btn_color.config(bg=self.line_color)
-            if self.img_a_final is not None: self.redraw(self.slider.get())
+            self.redraw_overlays()
 
     def on_thickness_change(self, value):
         self.line_thickness = int(value)
-        if self.img_a_final is not None: self.redraw(self.slider.get())
+        self.redraw_overlays()
 
     def on_style_change(self, value):
         self.line_style = value
-        if self.img_a_final is not None: self.redraw(self.slider.get())
+        self.redraw_overlays()
 
     def on_checkbutton_toggle(self):
         self.show_line = self.show_line_var.get()
-        if self.img_a_final is not None: self.redraw(self.slider.get())
+        self.redraw_overlays()
 
     def on_diff_toggle(self):
         self.show_diff = self.show_diff_var.get()
-        if self.img_a_final is not None: self.redraw(self.slider.get())
+        if self.engine.has_pair(): self.redraw(self.slider.get())
 
     def on_threshold_change(self, value):
-        self.diff_threshold = int(value)
-        if self.img_a_final is not None:
-            self.calculate_diff()
+        self.engine.set_threshold(value)
+        self.region_index = -1
+        if self.video is not None:
+            # 曲线按新阈值重新记录，当前帧立即补上
+            self.video.set_threshold(value)
+            if self.video_shown >= 0: self.video.record(self.video_shown, self.engine.diff_percent())
+            self.draw_video_plot()
+        if self.engine.has_pair():
+            self.update_diff_info()
             self.redraw(self.slider.get())
-
-    def draw_line(self, img, start_pos, end_pos, color, thickness, style):
-        if style == "solid":
-            cv2.line(img, start_pos, end_pos, color, thickness)
-        elif style == "dashed":
-            self.draw_dashed_line(img, start_pos, end_pos, color, thickness, 10, 7)
-        elif style == "dotted":
-            self.draw_dashed_line(img, start_pos, end_pos, color, thickness, 2, 4)
-
-    def draw_dashed_line(self, img, start_pos, end_pos, color, thickness, dash_len, gap_len):
-        x0, y0 = start_pos
-        x1, y1 = end_pos
-        dist = ((x1-x0)**2 + (y1-y0)**2)**0.5
-        if dist == 0: return
-        vx, vy = (x1-x0)/dist, (y1-y0)/dist
-        curr = 0
-        while curr < dist:
-            p1 = (int(x0 + vx*curr), int(y0 + vy*curr))
-            p2 = (int(x0 + vx*min(curr+dash_len, dist)), int(y0 + vy*min(curr+dash_len, dist)))
-            cv2.line(img, p1, p2, color, thickness)
-            curr += dash_len + gap_len
-
-    def hex_to_bgr(self, hex_color):
-        hex_color = hex_color.lstrip('#')
-        return tuple(int(hex_color[i:i+2], 16) for i in (4, 2, 0))
+            if self.show_regions: self.with_regions(self.on_regions_ready)
 
     def on_ctrl_press(self, event):
         self.ctrl_pressed = True
         self.canvas.config(cursor="plus")
-        if self.img_a_final is not None: self.update_image_display()
+        if self.engine.has_pair(): self.renderer.request('magnifier')
 
     def on_ctrl_release(self, event):
         self.ctrl_pressed = False
         self.canvas.config(cursor="")
-        if self.img_a_final is not None: self.update_image_display()
+        self.hide_magnifier()
 
-    def save_gif_animation(self):
-        if self.img_a_final is None: return
-        path = filedialog.asksaveasfilename(defaultextension='.gif', filetypes=[('GIF', '*.gif')])
+    def save_animation(self):
+        if not self.engine.has_pair(): return
+        if 'export' in self.tasks:
+            ModernPopup(self.root, "提示", "正在导出，请等待完成或按 Esc 取消")
+            return
+        path = filedialog.asksaveasfilename(defaultextension='.gif',
+                                            filetypes=[('GIF', '*.gif'), ('APNG', '*.png *.apng'), ('MP4', '*.mp4')])
         if not path: return
-        
+        ExportDialog(self.root, f"导出 {EXPORT_FORMATS.get(os.path.splitext(path)[1].lower(), 'GIF')}",
+                     self.export_options, lambda options: self.start_export(path, options))
+
+    def start_export(self, path, options):
+        """在后台逐帧渲染并写入，进度显示在工具栏右侧，Esc 或点击状态文字取消"""
+        self.export_options = options
+        line_color = hex_to_rgb(self.line_color) if self.show_line else None
+        self.run_in_background('export', "导出动画", self.engine.export_animation, path, options, line_color,
+                               on_done=lambda count: ModernPopup(self.root, "成功", f"动画已保存！共 {count} 帧"),
+                               error_text="导出失败！", executor=self.export_executor)
+
+    def cancel_export(self, event=None):
+        if 'export' in self.tasks:
+            self.cancel_task('export')
+
+    def run_in_background(self, key, label, func, *args, on_done, error_text="后台任务失败！", executor=None):
+        """
+        在工作线程中执行 func(*args, task)，完成后经 after 回到 Tk 主线程调用 on_done
+        executor 默认为解码与预处理的线程池
+        """
+        self.cancel_task(key)
+        task = TaskHandle(label)
+        task.future = (executor or self.executor).submit(func, *args, task)
+        self.track_task(key, task, on_done, error_text)
+
+    def track_task(self, key, task, on_done, error_text="后台任务失败！"):
+        """登记已经提交的任务，经 after 在 Tk 主线程中轮询它的 future"""
+        self.cancel_task(key)
+        self.tasks[key] = task
+        self.root.after(30, self.poll_task, key, task, on_done, error_text)
+        self.update_busy_indicator()
+
+    def cancel_task(self, key):
+        task = self.tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+            self.update_busy_indicator()
+
+    def poll_task(self, key, task, on_done, error_text):
+        if task.cancelled: return
+        if not task.future.done():
+            self.root.after(30, self.poll_task, key, task, on_done, error_text)
+            return
+
+        self.tasks.pop(key, None)
+        self.update_busy_indicator()
         try:
-            frames = []
-            h, w, _ = self.img_a_final.shape
-            bgr_color = self.hex_to_bgr(self.line_color)
-            
-            for i in range(0, 101, 5):
-                split_x = int(w * i / 100)
-                canvas = np.zeros((h, w, 3), dtype=np.uint8)
-                canvas[:, 0:split_x] = self.img_a_final[:, 0:split_x]
-                canvas[:, split_x:w] = self.img_b_final[:, split_x:w]
-                
-                if self.show_line:
-                    cv2.line(canvas, (split_x, 0), (split_x, h), bgr_color, 2)
-
-                img_rgb = cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB)
-                frames.append(Image.fromarray(img_rgb).resize((w//2, h//2)))
-
-            frames[0].save(path, save_all=True, append_images=frames[1:], duration=100, loop=0)
-            ModernPopup(self.root, "成功", "GIF 动画已保存！")
+            result = task.future.result()
+        except TaskCancelled:
+            return
+        except Exception as e:
+            ModernPopup(self.root, "错误", f"{error_text}\n{e}", is_error=True)
+            return
+        # 计时记录按任务键归类（例如 'pair'），与状态栏显示的文字无关
+        self.engine.timer.record(key, task.timings)
+        on_done(result)
+
+    def update_busy_indicator(self):
+        self.update_progress_bar()
+        if not self.tasks:
+            self.busy_label.config(text="")
+            if self.busy_timer:
+                self.root.after_cancel(self.busy_timer)
+                self.busy_timer = None
+            return
+
+        spinner = "⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏"
+        self.busy_frame = (self.busy_frame + 1) % len(spinner)
+        status = "  ".join(f"{t.label}: {t.stage}" if t.stage else t.label for t in self.tasks.values())
+        self.busy_label.config(text=f"{spinner[self.busy_frame]} {status}")
+        if self.busy_timer is None:
+            self.busy_timer = self.root.after(100, self.animate_busy_indicator)
+
+    def update_progress_bar(self):
+        self.progress_bar.delete("all")
+        task = self.tasks.get('export')
+        if task is None: return
+        self.progress_bar.create_rectangle(0, 0, 120, 6, fill=self.colors['input'], width=0)
+        self.progress_bar.create_rectangle(0, 0, int(120 * (task.progress or 0)), 6, fill=self.colors['accent'], width=0)
+
+    def animate_busy_indicator(self):
+        self.busy_timer = None
+        self.update_busy_indicator()
+
+    # 性能 HUD
+    def toggle_hud(self, event=None):
+        timer = self.engine.timer
+        timer.set_enabled(not timer.enabled)
+        if not timer.enabled:
+            self.canvas.delete("hud")
+            return
+        self.update_hud(force=True)
+        # 立即渲染一帧，HUD 打开后就有数据
+        if self.engine.has_pair(): self.redraw(self.engine.split_x)
+
+    def update_hud(self, force=False):
+        """HUD 最多每 250ms 刷新一次，避免它本身成为负担；被跳过的刷新在稍后补上"""
+        timer = self.engine.timer
+        if not timer.enabled: return
+        now = time.perf_counter()
+        if not force and now - self.hud_updated < 0.25:
+            if self.hud_timer is None:
+                self.hud_timer = self.root.after(250, self.flush_hud)
+            return
+        self.hud_updated = now
+
+        stats = self.renderer.stats()
+        lines = [f"FPS {stats['fps']:3d}   帧 {stats['frames']}   丢弃 {stats['dropped']}   超时 {stats['late']}"]
+        for kind, title in (('view', "重绘"), ('overlay', "叠加图层"), ('magnifier', "放大镜")):
+            averages = timer.averages(kind)
+            if not averages: continue
+            lines.append(f"{title} (最近平均, ms)")
+            lines += format_rows(averages)
+        last = timer.last('pair')
+        if last is not None:
+            lines.append("差异计算 (上次, ms)")
+            lines += format_rows(last['stages'].items())
+        lines.append("F3 关闭   F4 导出计时记录")
+        text = "\n".join(lines)
+
+        if not self.canvas.find_withtag("hud_text"):
+            self.canvas.create_rectangle(0, 0, 0, 0, fill="#000000", outline="#404040",
+                                         tags=("hud", "hud_bg"))
+            self.canvas.create_text(16, 16, anchor="nw", fill="#7cfc00", font=('Consolas', 9),
+                                    tags=("hud", "hud_text"))
+        self.canvas.itemconfig("hud_text", text=text)
+        x1, y1, x2, y2 = self.canvas.bbox("hud_text")
+        self.canvas.coords("hud_bg", x1 - 6, y1 - 6, x2 + 6, y2 + 6)
+        self.canvas.tag_raise("hud_bg")
+        self.canvas.tag_raise("hud_text")
+
+    def flush_hud(self):
+        self.hud_timer = None
+        self.update_hud(force=True)
+
+    def dump_trace(self, event=None):
+        timer = self.engine.timer
+        if not timer.trace:
+            ModernPopup(self.root, "提示", "还没有计时记录，请先按 F3 开启性能 HUD 并操作一段时间")
+            return
+        path = filedialog.asksaveasfilename(defaultextension='.json',
+                                            filetypes=[('Chrome Trace', '*.json'), ('JSON Lines', '*.jsonl')])
+        if not path: return
+        try:
+            count = timer.dump(path)
+            ModernPopup(self.root, "成功", f"已导出 {count} 条计时记录！")
         except Exception as e:
             ModernPopup(self.root, "错误", str(e), is_error=True)
 
+    def on_close(self):
+        self.renderer.cancel()
+        if self.review is not None: self.review.close()
+        self.close_video()
+        if self.hud_timer:
+            self.root.after_cancel(self.hud_timer)
+        for task in self.tasks.values():
+            task.cancel()
+        for executor in (self.executor, self.analysis_executor, self.metric_executor, self.export_executor):
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
+
     def show_shortcuts_help(self):
         msg = ("• 按住 Ctrl + 移动鼠标：开启像素放大镜\n"
-               "• 鼠标滚轮：调整放大镜倍率\n"
+               "• Ctrl + 鼠标滚轮：调整放大镜倍率\n"
+               "• 鼠标滚轮：以鼠标为中心缩放视图\n"
+               "• 中键 / 右键拖动：平移视图\n"
+               "• 键盘 0 / 1：适应窗口 / 100% 显示\n"
                "• 键盘 A / D：微调中线位置\n"
                "• 键盘 L：快速显示/隐藏中线\n"
                "• 键盘 K：快速显示/隐藏差异高亮\n"
-               "• 键盘 S：切换显示A / B 图片")
+               "• 键盘 S：切换显示A / B 图片\n"
+               "• Shift + 拖动：框选区域，统计其中灰度差的均值、标准差与最大值；Shift + 单击取消\n"
+               "• 键盘 N / P：跳转到下一个 / 上一个差异区域（按面积排序）\n"
+               "• 键盘 R / E：显示全部差异区域框 / 导出区域列表\n"
+               "• 键盘 M：显示 / 隐藏差异小地图，点击或拖动小地图跳转视图\n"
+               "• PageDown / PageUp：文件夹对比时切换到下一对 / 上一对\n"
+               "• 空格 / 键盘 , . / Home：视频对比时播放暂停 / 上一帧 下一帧 / 回到开头\n"
+               "• 键盘 G / F：多图对比时切换网格 / 多分割布局，以鼠标所在图片为基准\n"
+               "• Esc：取消正在进行的动画导出\n"
+               "• F3 / F4：性能 HUD / 导出逐帧计时记录")
         ModernPopup(self.root, "操作指南", msg)
     
     def fine_tune_left(self, event): 
-        if self.img_a_final is not None: 
+        if self.engine.has_pair(): 
             val = self.slider.get() - 1
             self.slider.set(val)
             self.redraw(val)
 
     def fine_tune_right(self, event): 
-        if self.img_a_final is not None: 
+        if self.engine.has_pair(): 
             val = self.slider.get() + 1
             self.slider.set(val)
             self.redraw(val)
@@ -857,4 +1946,11 @@ class ImageComparer:
 if __name__ == "__main__":
     root = tk.Tk()
     app = ImageComparer(root)
-    root.mainloop()
\ No newline at end of file
+    if "--startup-probe" in sys.argv:
+        # 供 benchmarks/startup.py 测量冷启动：窗口首次可见后输出 ready 并退出
+        root.wait_visibility()
+        root.update()
+        print("ready", flush=True)
+        root.destroy()
+    else:
+        root.mainloop()
\ No newline at end of file
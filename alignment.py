@@ -0,0 +1,211 @@
+import math
+
+from disk_image import LARGE_IMAGE_PIXELS, disk_array, is_disk_backed, read_region, release, strip_rows, strips
+from lazy_import import LazyModule
+from tiles import LRUTileCache, TilePyramid
+
+# 自动配准：在缩小的金字塔上粗估 B 相对 A 的平移 / 相似变换 / 透视变换，再逐层用 ECC 精化，
+# 最后把 B 一次重采样到 A 的坐标系（同时完成尺寸对齐），渲染结果之间的微小位移、裁切与缩放不再让整幅差异图变红
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+# 模式名称 -> 显示名称
+ALIGN_MODES = {
+    'translation': "平移",
+    'similarity': "相似变换",
+    'homography': "透视",
+}
+# 粗估所在层级的长边上限
+COARSE_SIZE = 1024
+# 精化的最细层级的像素数上限；不超过它的图片在原始分辨率上精化
+REFINE_PIXELS = 16 * 1024 * 1024
+# 特征点粗估至少需要的匹配数，不足时退回相位相关（只估计平移）
+MIN_MATCHES = 12
+# ECC 相关系数低于该值时认为配准失败（例如两张图片内容无关），B 只缩放到 A 的尺寸
+MIN_SCORE = 0.6
+ORB_FEATURES = 4000
+
+_ECC_MOTION = {'translation': 'MOTION_TRANSLATION', 'similarity': 'MOTION_AFFINE', 'homography': 'MOTION_HOMOGRAPHY'}
+
+class Alignment:
+    """
+    配准结果：matrix (3x3) 把 A 的像素坐标映射到缩放到 A 尺寸后的 B 上，
+    score 为最后一次 ECC 精化的相关系数（没有精化成功时为 None）
+    """
+    def __init__(self, mode, matrix, width, height, score=None):
+        self.mode = mode
+        self.matrix = np.asarray(matrix, np.float64)
+        self.width = width
+        self.height = height
+        self.score = score
+
+    @property
+    def ok(self):
+        return self.score is not None and self.score >= MIN_SCORE
+
+    def offset(self):
+        """A 的中心在 B 上对应位置的偏移 (dx, dy)，即 B 的内容相对 A 的位移"""
+        cx, cy = (self.width - 1) / 2, (self.height - 1) / 2
+        x, y, s = self.matrix @ (cx, cy, 1.0)
+        return x / s - cx, y / s - cy
+
+    def scale_angle(self):
+        m = self.matrix
+        return math.hypot(m[0, 0], m[1, 0]), math.degrees(math.atan2(m[1, 0], m[0, 0]))
+
+    def describe(self):
+        if not self.ok: return f"{ALIGN_MODES[self.mode]}: 配准失败"
+        dx, dy = self.offset()
+        text = f"{ALIGN_MODES[self.mode]} ({dx:+.2f}, {dy:+.2f}) px"
+        if self.mode != 'translation':
+            scale, angle = self.scale_angle()
+            text += f" x{scale:.4f} {angle:+.2f}°"
+        return text
+
+    def to_array(self):
+        """保存到缓存用的 10 个数：矩阵按行展开，最后是 score (NaN 表示无)"""
+        return np.append(self.matrix.ravel(), np.nan if self.score is None else self.score)
+
+    @classmethod
+    def from_array(cls, mode, arr, width, height):
+        score = float(arr[9])
+        return cls(mode, arr[:9].reshape(3, 3), width, height, None if math.isnan(score) else score)
+
+def _level_scale(level):
+    """第 0 层坐标 -> 第 level 层坐标（像素中心对齐）"""
+    s = 1.0 / (1 << level)
+    return np.array([[s, 0, 0.5 * s - 0.5], [0, s, 0.5 * s - 0.5], [0, 0, 1]])
+
+def _to_level(matrix, level_from, level_to):
+    """把某一层上的变换换算到另一层"""
+    d = _level_scale(level_from) @ np.linalg.inv(_level_scale(level_to))
+    return np.linalg.inv(d) @ matrix @ d
+
+def _to_similarity(matrix):
+    # ECC 没有相似变换模型，用仿射精化后投影回旋转 + 等比缩放
+    a = (matrix[0, 0] + matrix[1, 1]) / 2
+    b = (matrix[1, 0] - matrix[0, 1]) / 2
+    out = matrix.copy()
+    out[:2, :2] = [[a, -b], [b, a]]
+    out[2] = (0, 0, 1)
+    return out
+
+def gray_levels(img_a, img_b, task=None):
+    """
+    A、B 在精化层级 (fine) 上的灰度图（B 缩放到 A 在该层的尺寸），以及从它逐级减半到粗估层级的列表
+    金字塔按瓦片读取，磁盘数组也只需一次顺序扫描
+    """
+    pyr_a = TilePyramid.from_array(img_a, LRUTileCache(64 * 1024 * 1024))
+    pyr_b = TilePyramid.from_array(img_b, LRUTileCache(64 * 1024 * 1024))
+    fine = 0
+    while fine < pyr_a.max_level and pyr_a.level_size(fine)[0] * pyr_a.level_size(fine)[1] > REFINE_PIXELS:
+        fine += 1
+    coarse = fine
+    while coarse < pyr_a.max_level and max(pyr_a.level_size(coarse)) > COARSE_SIZE:
+        coarse += 1
+
+    if task is not None: task.report("配准", 0.0)
+    w, h = pyr_a.level_size(fine)
+    gray_a = cv2.cvtColor(pyr_a.region(fine, 0, 0, w, h), cv2.COLOR_RGB2GRAY)
+    if task is not None: task.report("配准", 0.1)
+    bw, bh = pyr_b.level_size(fine)
+    gray_b = cv2.cvtColor(pyr_b.region(fine, 0, 0, bw, bh), cv2.COLOR_RGB2GRAY)
+    if (bw, bh) != (w, h):
+        gray_b = cv2.resize(gray_b, (w, h), interpolation=cv2.INTER_AREA if bw > w else cv2.INTER_LINEAR)
+
+    levels = [(fine, gray_a, gray_b)]
+    for level in range(fine + 1, coarse + 1):
+        _, a, b = levels[-1]
+        size = (-(-a.shape[1] // 2), -(-a.shape[0] // 2))
+        levels.append((level, cv2.resize(a, size, interpolation=cv2.INTER_AREA),
+                       cv2.resize(b, size, interpolation=cv2.INTER_AREA)))
+    return levels[::-1]
+
+def coarse_estimate(mode, gray_a, gray_b):
+    """粗估：平移用相位相关；相似 / 透视用 ORB 特征匹配 + RANSAC，匹配不足时退回相位相关"""
+    if mode != 'translation':
+        orb = cv2.ORB_create(ORB_FEATURES)
+        kp_a, des_a = orb.detectAndCompute(gray_a, None)
+        kp_b, des_b = orb.detectAndCompute(gray_b, None)
+        if des_a is not None and des_b is not None:
+            matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(des_a, des_b)
+            if len(matches) >= MIN_MATCHES:
+                pts_a = np.float32([kp_a[m.queryIdx].pt for m in matches])
+                pts_b = np.float32([kp_b[m.trainIdx].pt for m in matches])
+                if mode == 'similarity':
+                    m, _ = cv2.estimateAffinePartial2D(pts_a, pts_b, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+                    if m is not None: return np.vstack([m, (0, 0, 1)])
+                else:
+                    m, _ = cv2.findHomography(pts_a, pts_b, cv2.RANSAC, 3.0)
+                    if m is not None: return m
+
+    a, b = gray_a.astype(np.float32), gray_b.astype(np.float32)
+    window = cv2.createHanningWindow((a.shape[1], a.shape[0]), cv2.CV_32F)
+    (dx, dy), _ = cv2.phaseCorrelate(a, b, window)
+    return np.array([[1, 0, dx], [0, 1, dy], [0, 0, 1]], np.float64)
+
+def refine(mode, matrix, gray_a, gray_b, iterations):
+    """ECC 精化，返回 (matrix, 相关系数)；不收敛时原样返回，相关系数为 None"""
+    motion = getattr(cv2, _ECC_MOTION[mode])
+    warp = matrix.astype(np.float32) if mode == 'homography' else matrix[:2].astype(np.float32)
+    criteria = (cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS, iterations, 1e-5)
+    try:
+        score, warp = cv2.findTransformECC(gray_a, gray_b, warp, motion, criteria, None, 5)
+    except cv2.error:
+        return matrix, None
+    out = warp.astype(np.float64) if mode == 'homography' else np.vstack([warp.astype(np.float64), (0, 0, 1)])
+    if mode == 'similarity': out = _to_similarity(out)
+    return out, float(score)
+
+def register(img_a, img_b, mode, task=None):
+    """估计 B 相对 A 的变换 (mode 为 ALIGN_MODES 之一)，由粗到细逐层精化"""
+    h, w = img_a.shape[:2]
+    levels = gray_levels(img_a, img_b, task)
+    coarse_level, gray_a, gray_b = levels[0]
+    matrix = coarse_estimate(mode, gray_a, gray_b)
+    score = None
+    prev_level = coarse_level
+    for i, (level, gray_a, gray_b) in enumerate(levels):
+        if task is not None: task.report("配准", 0.2 + 0.8 * i / len(levels))
+        matrix = _to_level(matrix, prev_level, level)
+        prev_level = level
+        # 粗层迭代次数多，越往细层初值越准、每次迭代越贵
+        matrix, level_score = refine(mode, matrix, gray_a, gray_b, 100 if i == 0 else 30)
+        if level_score is not None: score = level_score
+    result = Alignment(mode, _to_level(matrix, prev_level, 0), w, h, score)
+    if not result.ok: result.matrix = np.eye(3)
+    return result
+
+def warp_to(img_b, shape, matrix, task=None):
+    """
+    按 matrix (A 坐标 -> 缩放到 A 尺寸后的 B 坐标) 把 B 重采样到 A 的尺寸，缩放与配准只插值一次；
+    B 之外的区域填黑。磁盘数组或超大图片逐条带处理，每个条带只读取它映射到的源图行
+    """
+    target_h, target_w = shape[:2]
+    src_h, src_w = img_b.shape[:2]
+    sx, sy = src_w / target_w, src_h / target_h
+    resize = np.array([[sx, 0, 0.5 * sx - 0.5], [0, sy, 0.5 * sy - 0.5], [0, 0, 1]])
+    full = resize @ np.asarray(matrix, np.float64)
+    flags = cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP
+
+    if not is_disk_backed(img_b) and target_w * target_h <= LARGE_IMAGE_PIXELS:
+        return cv2.warpPerspective(img_b, full, (target_w, target_h), flags=flags, borderMode=cv2.BORDER_CONSTANT)
+
+    out = disk_array((target_h, target_w) + img_b.shape[2:], img_b.dtype)
+    for y0, y1 in strips(target_h, strip_rows(out)):
+        if task is not None: task.report("配准变换", y0 / target_h)
+        corners = np.array([[0, y0, 1], [target_w, y0, 1], [0, y1, 1], [target_w, y1, 1]], np.float64) @ full.T
+        src_y = corners[:, 1] / corners[:, 2]
+        sy0 = max(0, int(math.floor(src_y.min())) - 2)
+        sy1 = min(src_h, int(math.ceil(src_y.max())) + 3)
+        if sy1 <= sy0:
+            out[y0:y1] = 0
+        else:
+            window = read_region(img_b, 0, sy0, src_w, sy1)
+            # 目标条带的第 0 行对应全图第 y0 行，源窗口的第 0 行对应 B 的第 sy0 行
+            m = np.array([[1, 0, 0], [0, 1, -sy0], [0, 0, 1]]) @ full @ np.array([[1, 0, 0], [0, 1, y0], [0, 0, 1]])
+            out[y0:y1] = cv2.warpPerspective(window, m, (target_w, y1 - y0), flags=flags,
+                                             borderMode=cv2.BORDER_CONSTANT)
+        release(out, y0, y1)
+    return out
@@ -0,0 +1,162 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import cv2
+
+import alignment
+import compare_engine as engine
+
+# 批量比较：无界面运行，不会导入 tkinter
+#   python batch_compare.py DIR_A DIR_B -o report.csv
+#   python batch_compare.py --manifest pairs.csv -o report.jsonl --mask-dir masks
+
+REPORT_FIELDS = ['name', 'path_a', 'path_b', 'width', 'height', 'width_b', 'height_b', 'resized',
+                 'align', 'offset_x', 'offset_y', 'align_score', 'threshold', 'diff_pixels', 'diff_percent',
+                 'decode_ms', 'diff_ms', 'total_ms', 'mask', 'error']
+
+def read_manifest(path):
+    """每行两列 (图片A, 图片B)，逗号或制表符分隔；相对路径以清单所在目录为基准"""
+    base = os.path.dirname(os.path.abspath(path))
+    pairs = []
+    names = set()
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        dialect = csv.Sniffer().sniff(sample, delimiters=',\t;') if sample.strip() else csv.excel
+        for row in csv.reader(f, dialect):
+            row = [c.strip() for c in row]
+            if len(row) < 2 or not row[0] or row[0].startswith('#'): continue
+            if not pairs and row[0].lower() in ('a', 'path_a', 'image_a'): continue
+            path_a, path_b = (os.path.join(base, p) for p in row[:2])
+            name = os.path.splitext(os.path.basename(path_a))[0]
+            # 清单中可能有同名文件，保证掩码文件名不互相覆盖
+            if name in names: name = f"{name}_{len(pairs)}"
+            names.add(name)
+            pairs.append((name, path_a, path_b))
+    return pairs
+
+def init_worker():
+    # 每个进程只用一个 OpenCV 线程，避免多进程下线程过量竞争，保证随核数近似线性扩展
+    cv2.setNumThreads(1)
+
+def compare_job(job):
+    name, path_a, path_b, threshold, mask_path, large_pixels, align = job
+    row = {'name': name, 'path_a': path_a, 'path_b': path_b, 'threshold': threshold}
+    start = time.perf_counter()
+    try:
+        img_a = engine.decode_image(path_a, large_pixels=large_pixels)
+        img_b = engine.decode_image(path_b, large_pixels=large_pixels)
+        decoded = time.perf_counter()
+
+        h, w = img_a.shape[:2]
+        row.update(width=w, height=h, width_b=img_b.shape[1], height_b=img_b.shape[0],
+                   resized=img_b.shape[:2] != (h, w))
+        transform = None
+        if align:
+            result = alignment.register(img_a, img_b, align)
+            transform = result.matrix
+            offset_x, offset_y = result.offset()
+            row.update(align=align, offset_x=round(offset_x, 3), offset_y=round(offset_y, 3),
+                       align_score=None if result.score is None else round(result.score, 5))
+        _, _, gray_diff, count_above = engine.prepare_pair(img_a, img_b, transform=transform)
+        diff_pixels = int(count_above[threshold])
+        row.update(diff_pixels=diff_pixels, diff_percent=round(diff_pixels / gray_diff.size * 100, 4))
+
+        if mask_path:
+            os.makedirs(os.path.dirname(mask_path), exist_ok=True)
+            engine.write_image(mask_path, engine.threshold_mask(gray_diff, threshold))
+            row['mask'] = mask_path
+        finished = time.perf_counter()
+        row.update(decode_ms=round((decoded - start) * 1000, 2), diff_ms=round((finished - decoded) * 1000, 2))
+    except Exception as e:
+        row['error'] = str(e) or type(e).__name__
+    row['total_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    return row
+
+class ReportWriter:
+    """逐行写出并立即 flush，便于流水线边跑边读"""
+    def __init__(self, stream, fmt):
+        self.stream = stream
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(stream, fieldnames=REPORT_FIELDS, extrasaction='ignore')
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.fmt == 'csv':
+            self.writer.writerow(row)
+        else:
+            self.stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+        self.stream.flush()
+
+def build_jobs(pairs, args):
+    jobs = []
+    large_pixels = int(args.large_mpix * 1024 * 1024) if args.large_mpix > 0 else None
+    for name, path_a, path_b in pairs:
+        mask_path = os.path.join(args.mask_dir, name + '.png') if args.mask_dir else None
+        jobs.append((name, path_a, path_b, args.threshold, mask_path, large_pixels, args.align))
+    return jobs
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="无界面批量比较图片对，输出差异报告")
+    parser.add_argument('dir_a', nargs='?', help="图片 A 所在目录")
+    parser.add_argument('dir_b', nargs='?', help="图片 B 所在目录（按相对路径与文件名匹配）")
+    parser.add_argument('--manifest', help="图片对清单 (CSV/TSV，每行 A,B)")
+    parser.add_argument('-o', '--output', help="报告路径，默认输出到 stdout")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help="报告格式，默认按输出文件扩展名判断")
+    parser.add_argument('-t', '--threshold', type=int, default=30, help="灰度差异阈值 0-255 (默认 30)")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help="进程数 (默认 CPU 核数)")
+    parser.add_argument('--mask-dir', help="如指定，则把差异掩码 PNG 写入该目录")
+    parser.add_argument('--large-mpix', type=float, default=engine.LARGE_IMAGE_PIXELS / 1024 / 1024,
+                        help="超过该像素数 (百万) 的图片转存到磁盘并按条带处理，0 表示禁用 (默认 64)")
+    parser.add_argument('--align', choices=list(alignment.ALIGN_MODES),
+                        help="计算差异前自动配准 B：translation / similarity / homography (默认只缩放到 A 的尺寸)")
+    parser.add_argument('--fail-above', type=float, help="任一图片对差异百分比超过该值时以状态码 1 退出")
+    args = parser.parse_args(argv)
+
+    if not args.manifest and not (args.dir_a and args.dir_b):
+        parser.error("需要指定 DIR_A DIR_B 或 --manifest")
+    if not 0 <= args.threshold <= 255:
+        parser.error("--threshold 必须在 0-255 之间")
+    if args.format is None:
+        args.format = 'csv' if args.output and args.output.lower().endswith('.csv') else 'jsonl'
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.manifest:
+        pairs = read_manifest(args.manifest)
+    else:
+        pairs, only_a, only_b = engine.match_folder_pairs(args.dir_a, args.dir_b)
+        for path in only_a: print(f"仅存在于 A: {path}", file=sys.stderr)
+        for path in only_b: print(f"仅存在于 B: {path}", file=sys.stderr)
+
+    jobs = build_jobs(pairs, args)
+    out = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    writer = ReportWriter(out, args.format)
+
+    start = time.perf_counter()
+    failed = errors = 0
+    try:
+        with Pool(processes=max(1, args.workers), initializer=init_worker) as pool:
+            for row in pool.imap_unordered(compare_job, jobs):
+                writer.write(row)
+                if row.get('error'):
+                    errors += 1
+                elif args.fail_above is not None and row['diff_percent'] > args.fail_above:
+                    failed += 1
+    finally:
+        if out is not sys.stdout: out.close()
+
+    elapsed = time.perf_counter() - start
+    rate = len(jobs) / elapsed if elapsed > 0 else 0
+    print(f"完成 {len(jobs)} 对，错误 {errors}，超出阈值 {failed}，耗时 {elapsed:.2f}s ({rate:.1f} 对/秒)", file=sys.stderr)
+    return 1 if failed or errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+# 热点路径基准：在可复现的合成图片对上无界面运行渲染、差异、放大镜与导出，
+# 输出延迟分位数、吞吐量与峰值内存，结果可保存为 JSON 并与其他版本对比
+#   python benchmarks/bench_hotpaths.py --sizes 1 4 16 100 -n 20 --json before.json
+#   python benchmarks/bench_hotpaths.py --compare before.json after.json
+# 每个 (路径, 尺寸) 在独立进程中运行，峰值内存互不影响
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import compare_engine as engine  # noqa: E402
+
+cv2 = engine.cv2
+np = engine.np
+
+SIZES_MP = [1, 4, 16, 100]
+VIEWPORT = (1600, 900)
+LINE = engine.LineStyle((0, 0, 255), 2, 'dashed')
+
+def synthetic_pair(megapixels, seed=0):
+    """4:3 的合成图片对：平滑起伏的底图 + 噪声，B 在若干矩形区域内有差异"""
+    pixels = int(megapixels * 1_000_000)
+    w = int(round((pixels * 4 / 3) ** 0.5))
+    h = max(1, pixels // w)
+    rng = np.random.default_rng(seed)
+
+    coarse = rng.integers(0, 256, (48, 64, 3), dtype=np.uint8)
+    img_a = cv2.resize(coarse, (w, h), interpolation=cv2.INTER_CUBIC)
+    cv2.add(img_a, rng.integers(0, 16, (h, w, 3), dtype=np.uint8), dst=img_a)
+
+    img_b = img_a.copy()
+    for _ in range(20):
+        x0, y0 = int(rng.integers(0, w)), int(rng.integers(0, h))
+        x1, y1 = min(w, x0 + int(rng.integers(8, w // 8 + 9))), min(h, y0 + int(rng.integers(8, h // 8 + 9)))
+        cv2.add(img_b[y0:y1, x0:x1], (40, 40, 40, 0), dst=img_b[y0:y1, x0:x1])
+    return img_a, img_b
+
+# 峰值内存：Linux 上可以清零 VmHWM，只统计测量阶段；其他平台退回进程级峰值
+def current_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'): return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'): return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 以字节为单位，Linux 以 KB 为单位
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        return None
+
+# 各热点路径：setup 在计时之外完成准备，返回每次迭代调用的函数
+def case_diff(eng, img_a, img_b):
+    # calculate_diff：对齐 + absdiff + 灰度 + 直方图
+    return lambda i: engine.prepare_pair(img_a, img_b)
+
+def case_diff_1t(eng, img_a, img_b):
+    # 同上，但 OpenCV 与条带线程池都限制为单线程；与 diff 的 p50 之比即为多线程加速比
+    cv2.setNumThreads(1)
+    return case_diff(eng, img_a, img_b)
+
+def case_metrics(eng, img_a, img_b):
+    # 分块 SSIM / PSNR / ΔE2000 各计算一次（每次迭代都清空缓存）
+    from metrics import METRICS, BlockMetrics
+    def run(i):
+        block_metrics = BlockMetrics(eng.img_a_final, eng.img_b_final)
+        for name in METRICS:
+            block_metrics.compute(name)
+    return run
+
+def case_threshold(eng, img_a, img_b):
+    def run(i):
+        eng.set_threshold(10 + i * 7 % 200)
+        eng.diff_percent()
+    return run
+
+def case_view(eng, img_a, img_b):
+    # 缩放 / 平移后重新渲染视口（瓦片缓存已预热）
+    zooms = [eng.fit_zoom(), 0.5, 1.0, 2.0]
+    def run(i):
+        eng.zoom_to(zooms[i % len(zooms)], VIEWPORT[0] / 2, VIEWPORT[1] / 2)
+        eng.pan((i % 3 - 1) * 40, (i % 5 - 2) * 20)
+        eng.update_view()
+    return run
+
+def case_redraw(eng, img_a, img_b):
+    # redraw：拖动中线时在显示缓存上合成一帧
+    eng.update_view()
+    def run(i):
+        eng.set_split(eng.width * (i % 50) / 50)
+        eng.compose_view(True, LINE, None)
+    return run
+
+def case_display(eng, img_a, img_b):
+    # update_image_display 中与 Tk 无关的部分：把合成结果写入复用的 PIL 图像
+    from PIL import Image
+    eng.update_view()
+    frame = eng.compose_view(True, LINE, None)
+    image = Image.new('RGB', (frame.shape[1], frame.shape[0]))
+    return lambda i: image.frombytes(frame)
+
+def case_magnifier(eng, img_a, img_b):
+    # apply_magnifier_overlay：在原始分辨率上合成并放大一小块
+    rng = np.random.default_rng(1)
+    points = [(int(rng.integers(0, eng.width)), int(rng.integers(0, eng.height))) for _ in range(64)]
+    return lambda i: eng.render_loupe(*points[i % len(points)], 4.0, 150, True, LINE)
+
+def case_gif(eng, img_a, img_b):
+    # 导出动画：21 帧半尺寸 GIF，逐帧量化并流式写入
+    path = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'out.gif')
+    return lambda i: eng.export_animation(path, line_color=(0, 0, 255))
+
+CASES = {
+    'diff': case_diff,
+    'diff_1t': case_diff_1t,
+    'metrics': case_metrics,
+    'threshold': case_threshold,
+    'view': case_view,
+    'redraw': case_redraw,
+    'display': case_display,
+    'magnifier': case_magnifier,
+    'gif': case_gif,
+}
+
+def percentile(sorted_samples, q):
+    if len(sorted_samples) == 1: return sorted_samples[0]
+    pos = (len(sorted_samples) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_samples) - 1)
+    return sorted_samples[lo] + (sorted_samples[hi] - sorted_samples[lo]) * (pos - lo)
+
+def run_worker(name, megapixels, runs, warmup, max_seconds):
+    """在当前进程中测量一个路径，返回结果字典"""
+    img_a, img_b = synthetic_pair(megapixels)
+    eng = engine.CompareEngine()
+    eng.set_image('A', img_a)
+    eng.set_image('B', img_b)
+    if not name.startswith('diff'):
+        eng.prepare()
+        eng.set_viewport(*VIEWPORT)
+    op = CASES[name](eng, img_a, img_b)
+
+    for i in range(warmup):
+        op(i)
+
+    reset_peak_rss()
+    start_rss = current_rss_mb()
+    samples = []
+    deadline = time.perf_counter() + max_seconds
+    for i in range(runs):
+        t0 = time.perf_counter()
+        op(warmup + i)
+        t1 = time.perf_counter()
+        samples.append((t1 - t0) * 1000)
+        # 大图上的慢路径不必跑满次数，至少保留 3 个样本
+        if t1 > deadline and len(samples) >= min(3, runs): break
+    peak = peak_rss_mb()
+
+    ordered = sorted(samples)
+    mean = sum(samples) / len(samples)
+    h, w = img_a.shape[:2]
+    return {
+        'case': name, 'megapixels': megapixels, 'width': w, 'height': h, 'runs': len(samples),
+        'p50_ms': round(percentile(ordered, 50), 3), 'p90_ms': round(percentile(ordered, 90), 3),
+        'p99_ms': round(percentile(ordered, 99), 3), 'mean_ms': round(mean, 3),
+        'min_ms': round(ordered[0], 3), 'max_ms': round(ordered[-1], 3),
+        'ops_per_s': round(1000 / mean, 2) if mean > 0 else None,
+        'mpix_per_s': round(w * h / 1e6 / (mean / 1000), 1) if mean > 0 else None,
+        'peak_rss_mb': round(peak, 1) if peak is not None else None,
+        'peak_delta_mb': round(peak - start_rss, 1) if peak is not None and start_rss is not None else None,
+    }
+
+def run_isolated(name, megapixels, args):
+    cmd = [sys.executable, os.path.abspath(__file__), '--worker', name, str(megapixels),
+           '-n', str(args.runs), '--warmup', str(args.warmup), '--max-seconds', str(args.max_seconds)]
+    proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0 or not proc.stdout.strip():
+        error = proc.stderr.strip().splitlines()
+        return {'case': name, 'megapixels': megapixels, 'error': error[-1] if error else f"exit {proc.returncode}"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def environment():
+    info = {'python': sys.version.split()[0], 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'numpy': np.__version__, 'opencv': cv2.__version__,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    try:
+        import PIL
+        info['pillow'] = PIL.__version__
+    except ImportError:
+        pass
+    try:
+        info['commit'] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                        text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return info
+
+def print_row(row):
+    if 'error' in row:
+        print(f"{row['case']:10s} {row['megapixels']:>6g} MP   失败: {row['error']}")
+        return
+    peak = f"{row['peak_rss_mb']:8.1f} MB" if row['peak_rss_mb'] is not None else "       -   "
+    print(f"{row['case']:10s} {row['megapixels']:>6g} MP   p50 {row['p50_ms']:9.2f}  p90 {row['p90_ms']:9.2f}  "
+          f"p99 {row['p99_ms']:9.2f} ms   {row['mpix_per_s']:9.1f} MP/s   peak {peak}")
+
+def compare(old_path, new_path, tolerance):
+    """逐项对比两次结果的 p50 与峰值内存，p50 变慢超过 tolerance% 视为退化"""
+    with open(old_path, encoding='utf-8') as f:
+        old = {(r['case'], r['megapixels']): r for r in json.load(f)['results'] if 'error' not in r}
+    with open(new_path, encoding='utf-8') as f:
+        new = {(r['case'], r['megapixels']): r for r in json.load(f)['results'] if 'error' not in r}
+
+    regressions = 0
+    print(f"{'路径':8s} {'尺寸':>9s}   {'p50 旧':>10s} {'p50 新':>10s} {'变化':>8s}   {'峰值 旧':>9s} {'峰值 新':>9s}")
+    for key in sorted(set(old) & set(new), key=lambda k: (k[0], k[1])):
+        o, n = old[key], new[key]
+        change = (n['p50_ms'] - o['p50_ms']) / o['p50_ms'] * 100 if o['p50_ms'] else 0.0
+        flag = ""
+        if change > tolerance:
+            regressions += 1
+            flag = "  <- 退化"
+        peak_o = f"{o['peak_rss_mb']:.0f}" if o.get('peak_rss_mb') is not None else "-"
+        peak_n = f"{n['peak_rss_mb']:.0f}" if n.get('peak_rss_mb') is not None else "-"
+        print(f"{key[0]:10s} {key[1]:>6g} MP   {o['p50_ms']:10.2f} {n['p50_ms']:10.2f} {change:+7.1f}%   "
+              f"{peak_o:>9s} {peak_n:>9s}{flag}")
+    for key in sorted(set(old) ^ set(new)):
+        print(f"{key[0]:10s} {key[1]:>6g} MP   仅存在于{'旧' if key in old else '新'}结果中")
+    return 1 if regressions else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="无界面测量渲染、差异、放大镜与导出热点路径")
+    parser.add_argument('--sizes', nargs='*', type=float, default=SIZES_MP, help="图片尺寸 (百万像素)")
+    parser.add_argument('--cases', nargs='*', default=list(CASES), choices=list(CASES))
+    parser.add_argument('-n', '--runs', type=int, default=20, help="每项最多测量次数 (默认 20)")
+    parser.add_argument('--warmup', type=int, default=2, help="预热次数 (默认 2)")
+    parser.add_argument('--max-seconds', type=float, default=10.0, help="每项测量的时间上限 (默认 10 秒)")
+    parser.add_argument('--json', help="把结果写入 JSON 文件")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="对比两次保存的结果")
+    parser.add_argument('--tolerance', type=float, default=10.0, help="对比时 p50 允许变慢的百分比 (默认 10)")
+    parser.add_argument('--worker', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare, args.tolerance)
+
+    if args.worker:
+        name, megapixels = args.worker[0], float(args.worker[1])
+        print(json.dumps(run_worker(name, megapixels, args.runs, args.warmup, args.max_seconds)))
+        return 0
+
+    results = []
+    for megapixels in args.sizes:
+        for name in args.cases:
+            row = run_isolated(name, megapixels, args)
+            print_row(row)
+            results.append(row)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'environment': environment(), 'runs': args.runs, 'results': results}, f, indent=2,
+                      ensure_ascii=False)
+    return 1 if any('error' in r for r in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# 冷启动测量：每次都启动一个全新的解释器进程，从 Popen 到目标就绪计时
+#   python benchmarks/startup.py -n 10 --json startup.json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = {
+    # 解释器本身的启动开销，作为其他各项的基准
+    'python': [sys.executable, '-c', 'print("ready")'],
+    # 仅导入引擎并创建对象：OpenCV / NumPy 应尚未加载
+    'engine_import': [sys.executable, '-c',
+                      'import sys, compare_engine; compare_engine.CompareEngine(); '
+                      'assert "cv2" not in sys.modules and "tkinter" not in sys.modules; print("ready")'],
+    # 引擎首次真正用到 OpenCV / NumPy 时的开销
+    'engine_first_use': [sys.executable, '-c',
+                         'import compare_engine as e; e.np.zeros(1); e.cv2.absdiff; print("ready")'],
+    # 作为对照：启动时就导入全部重量级依赖
+    'eager_imports': [sys.executable, '-c', 'import cv2, numpy, PIL.ImageTk; print("ready")'],
+    # 界面窗口首次可见
+    'gui_window': [sys.executable, os.path.join(ROOT, 'ImageCompare.py'), '--startup-probe'],
+}
+
+def time_case(cmd):
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    ready = None
+    for line in proc.stdout:
+        if line.strip() == 'ready':
+            ready = time.perf_counter() - start
+            break
+    proc.wait()
+    if ready is None:
+        raise RuntimeError(f"{cmd[-1]} 未就绪: {proc.stderr.read().strip()}")
+    return ready * 1000
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="测量引擎与界面的冷启动时间")
+    parser.add_argument('-n', '--runs', type=int, default=5, help="每项重复次数 (默认 5)")
+    parser.add_argument('--cases', nargs='*', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--json', help="把结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in args.cases:
+        try:
+            samples = [time_case(CASES[name]) for _ in range(args.runs)]
+        except RuntimeError as e:
+            # 无显示环境时界面项会失败，其余各项照常输出
+            print(f"{name:18s} 跳过: {e}", file=sys.stderr)
+            continue
+        results[name] = {'median_ms': round(statistics.median(samples), 1),
+                         'min_ms': round(min(samples), 1), 'samples_ms': [round(s, 1) for s in samples]}
+        print(f"{name:18s} median {results[name]['median_ms']:8.1f} ms   min {results[name]['min_ms']:8.1f} ms")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version, 'runs': args.runs, 'results': results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
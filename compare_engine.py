@@ -0,0 +1,839 @@
+import math
+import os
+import time
+from collections import namedtuple
+
+from alignment import warp_to
+from disk_image import (LARGE_IMAGE_PIXELS, disk_array, is_disk_backed, map_strips, parallel_workers, read_region,
+                        release, strip_rows, strips, to_disk)
+from export import DEFAULT_OPTIONS, export_animation
+from lazy_import import LazyModule
+from metrics import BlockMetrics, format_score, sample_blocks
+from profiling import StageTimer
+from region_stats import RegionStats
+from regions import RegionFinder
+from tiles import LRUTileCache, TilePyramid
+
+# 图像比较的核心逻辑：不依赖 Tk，界面与批量命令行共用同一套对齐 + absdiff + 阈值实现
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif')
+
+# 并行计算差异时每个条带的目标像素数；calcHist 以 float32 计数，单个条带不超过 2^24 像素才能精确
+DIFF_STRIP_PIXELS = 1024 * 1024
+HIST_EXACT_PIXELS = 1 << 24
+
+# 中线样式：color 为 RGB 元组，style 为 solid / dashed / dotted
+LineStyle = namedtuple('LineStyle', ['color', 'thickness', 'style'])
+
+class TaskCancelled(Exception):
+    pass
+
+class TaskHandle:
+    """
+    后台任务句柄，工作线程通过它汇报进度并检查是否已被更新的请求取代
+    timings 记录每个阶段的耗时 (ms)，阶段在汇报下一个阶段时结束
+    """
+    def __init__(self, label=""):
+        self.label = label
+        self.stage = ""
+        self.progress = None
+        self.cancelled = False
+        self.future = None
+        self.timings = {}
+        self._stage_name = None
+        self._stage_start = 0.0
+
+    def report(self, stage, progress=None):
+        if self.cancelled:
+            raise TaskCancelled()
+        if stage != self._stage_name:
+            now = time.perf_counter()
+            if self._stage_name is not None:
+                self.timings[self._stage_name] = (now - self._stage_start) * 1000
+            self._stage_name, self._stage_start = stage, now
+        self.stage = f"{stage} {progress:.0%}" if progress is not None else stage
+        self.progress = progress
+
+    def cancel(self):
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+
+def decode_image(path, task=None, large_pixels=LARGE_IMAGE_PIXELS):
+    """
+    超过 large_pixels 的图片解码后立即转存为磁盘数组，后续处理都按条带进行；
+    OpenCV 无法解码到调用方提供的缓冲区，完整位图只在转存期间短暂存在
+    """
+    task = task or TaskHandle()
+    task.report("解码中")
+    image = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None: raise ValueError("Image decode failed")
+    # 解码后统一转为 RGB，之后的合成、显示与导出都不再转换通道顺序
+    cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+    if large_pixels is not None and image.shape[0] * image.shape[1] > large_pixels:
+        image = to_disk(image, task)
+    task.report("完成")
+    return image
+
+def write_image(path, image):
+    # 与 np.fromfile 对应，支持中文路径
+    ext = os.path.splitext(path)[1] or '.png'
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    ok, buf = cv2.imencode(ext, image)
+    if not ok: raise ValueError(f"Image encode failed: {path}")
+    buf.tofile(path)
+
+def align_to(img_b, shape, task=None):
+    """把 B 缩放到 A 的尺寸"""
+    target_h, target_w = shape[:2]
+    if img_b.shape[:2] != (target_h, target_w):
+        if is_disk_backed(img_b) or target_w * target_h > LARGE_IMAGE_PIXELS:
+            return resize_strips(img_b, (target_w, target_h), task)
+        return cv2.resize(img_b, (target_w, target_h))
+    return img_b
+
+def resize_strips(src, size, task=None):
+    """逐条带双线性缩放，结果写入磁盘数组；每个条带只读取它覆盖到的源图行"""
+    target_w, target_h = size
+    src_h, src_w = src.shape[:2]
+    out = disk_array((target_h, target_w) + src.shape[2:], src.dtype)
+    scale_x, scale_y = src_w / target_w, src_h / target_h
+
+    for y0, y1 in strips(target_h, strip_rows(out)):
+        if task is not None: task.report("对齐尺寸", y0 / target_h)
+        # 输出像素中心 y + 0.5 对应源图 (y + 0.5) * scale_y - 0.5，上下各多读一行供插值
+        sy0 = max(0, int(math.floor((y0 + 0.5) * scale_y - 0.5)) - 1)
+        sy1 = min(src_h, int(math.ceil((y1 - 0.5) * scale_y - 0.5)) + 2)
+        window = read_region(src, 0, sy0, src_w, sy1)
+        m = np.array([[scale_x, 0, 0.5 * scale_x - 0.5],
+                      [0, scale_y, (y0 + 0.5) * scale_y - 0.5 - sy0]], dtype=np.float64)
+        out[y0:y1] = cv2.warpAffine(window, m, (target_w, y1 - y0), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                                    borderMode=cv2.BORDER_REPLICATE)
+        release(out, y0, y1)
+    return out
+
+def diff_strip_rows(img, workers):
+    """磁盘数组按 STRIP_BYTES 分给各线程，常驻内存与单线程时相当；内存中的图片按 DIFF_STRIP_PIXELS 切分"""
+    w = img.shape[1]
+    if is_disk_backed(img):
+        rows = max(16, strip_rows(img) // workers)
+    else:
+        rows = max(16, DIFF_STRIP_PIXELS // max(1, w))
+    return max(1, min(rows, HIST_EXACT_PIXELS // max(1, w)))
+
+def compute_gray_diff(img_a, img_b, task=None, workers=None):
+    """
+    返回灰度差异图及 count_above 表：count_above[t] 为灰度差大于 t 的像素数
+    按水平条带在线程池中计算（OpenCV 计算时释放 GIL），各条带的直方图最后累加，结果与整幅计算逐位一致；
+    任一输入在磁盘上时差异图也写入磁盘数组
+    """
+    h, w = img_a.shape[:2]
+    workers = workers or parallel_workers()
+    disk = is_disk_backed(img_a) or is_disk_backed(img_b)
+    gray_diff = disk_array((h, w)) if disk else np.empty((h, w), np.uint8)
+
+    def diff_strip(y0, y1):
+        diff = cv2.absdiff(read_region(img_a, 0, y0, w, y1), read_region(img_b, 0, y0, w, y1))
+        gray = gray_diff[y0:y1]
+        cv2.cvtColor(diff, cv2.COLOR_RGB2GRAY, dst=gray)
+        hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
+        release(gray_diff, y0, y1)
+        return hist
+
+    rows = diff_strip_rows(img_a if is_disk_backed(img_a) else img_b, workers)
+    hist = np.zeros(256, dtype=np.int64)
+    for strip_hist in map_strips(diff_strip, h, rows, task, "计算差异", workers):
+        hist += strip_hist.ravel().astype(np.int64)
+    # 与 cv2.THRESH_BINARY 的判定 (src > thresh) 一致
+    count_above = gray_diff.size - np.cumsum(hist)
+    return gray_diff, count_above
+
+def threshold_mask(gray_diff, threshold, workers=None):
+    workers = workers or parallel_workers()
+    disk = is_disk_backed(gray_diff)
+    mask = disk_array(gray_diff.shape) if disk else np.empty_like(gray_diff)
+    w = gray_diff.shape[1]
+
+    def threshold_strip(y0, y1):
+        cv2.threshold(read_region(gray_diff, 0, y0, w, y1), threshold, 255, cv2.THRESH_BINARY, dst=mask[y0:y1])
+        release(mask, y0, y1)
+
+    map_strips(threshold_strip, gray_diff.shape[0], diff_strip_rows(gray_diff, workers), workers=workers)
+    return mask
+
+def prepare_pair(img_a, img_b, task=None, transform=None, workers=None):
+    """
+    transform 为配准得到的 3x3 矩阵 (见 alignment.register) 时，B 按它一次重采样到 A 的坐标系
+    workers 为差异计算的线程数，调用方本身已是逐帧的后台线程时传 1，不必每次新建线程池
+    """
+    task = task or TaskHandle()
+
+    task.report("对齐尺寸")
+    if transform is None:
+        img_b = align_to(img_b, img_a.shape, task)
+    else:
+        img_b = warp_to(img_b, img_a.shape, transform, task)
+
+    task.report("计算差异")
+    gray_diff, count_above = compute_gray_diff(img_a, img_b, task, workers)
+
+    task.report("完成")
+    return img_a, img_b, gray_diff, count_above
+
+def hex_to_rgb(hex_color):
+    hex_color = hex_color.lstrip('#')
+    return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+
+def draw_line(img, start_pos, end_pos, color, thickness, style):
+    if style == "solid":
+        cv2.line(img, start_pos, end_pos, color, thickness)
+    elif style == "dashed":
+        draw_dashed_line(img, start_pos, end_pos, color, thickness, 10, 7)
+    elif style == "dotted":
+        draw_dashed_line(img, start_pos, end_pos, color, thickness, 2, 4)
+
+def draw_dashed_line(img, start_pos, end_pos, color, thickness, dash_len, gap_len):
+    x0, y0 = start_pos
+    x1, y1 = end_pos
+    dist = ((x1-x0)**2 + (y1-y0)**2)**0.5
+    if dist == 0: return
+    vx, vy = (x1-x0)/dist, (y1-y0)/dist
+    curr = 0
+    while curr < dist:
+        p1 = (int(x0 + vx*curr), int(y0 + vy*curr))
+        p2 = (int(x0 + vx*min(curr+dash_len, dist)), int(y0 + vy*min(curr+dash_len, dist)))
+        cv2.line(img, p1, p2, color, thickness)
+        curr += dash_len + gap_len
+
+AB_LABEL_SCALE = 2.0
+AB_LABEL_THICKNESS = 4
+AB_LABEL_PADDING = 20
+
+def ab_label_boxes(w, h, swapped):
+    """A / B 标签框的位置：[(text, box_x, box_y, box_w, box_h, text_h), ...]"""
+    boxes = []
+    for text in ("A", "B"):
+        (text_w, text_h), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, AB_LABEL_SCALE, AB_LABEL_THICKNESS)
+        box_w = text_w + AB_LABEL_PADDING * 2
+        box_h = text_h + AB_LABEL_PADDING * 2
+        on_left = (text == "A") != swapped
+        box_x = 20 if on_left else w - box_w - 20
+        boxes.append((text, box_x, h - box_h - 20, box_w, box_h, text_h))
+    return boxes
+
+def _label_rect(box, w, h):
+    # 边框线宽 2，向外多取 2 像素
+    _, box_x, box_y, box_w, box_h, _ = box
+    rect = (max(0, box_x - 2), max(0, box_y - 2), min(w, box_x + box_w + 3), min(h, box_y + box_h + 3))
+    if rect[2] > rect[0] and rect[3] > rect[1]: return rect
+    return None
+
+def ab_label_rects(w, h, swapped):
+    """标签框会改动的像素范围 [(x0, y0, x1, y1), ...]"""
+    rects = [_label_rect(box, w, h) for box in ab_label_boxes(w, h, swapped)]
+    return [rect for rect in rects if rect is not None]
+
+def _draw_label_boxes(img, boxes, x0, y0, fill, outline, text_color):
+    for text, box_x, box_y, box_w, box_h, text_h in boxes:
+        ox, oy = box_x - x0, box_y - y0
+        cv2.rectangle(img, (ox, oy), (ox + box_w, oy + box_h), fill, -1)
+        cv2.rectangle(img, (ox, oy), (ox + box_w, oy + box_h), outline, 2)
+        cv2.putText(img, text, (ox + AB_LABEL_PADDING, oy + text_h + AB_LABEL_PADDING - 5),
+                   cv2.FONT_HERSHEY_SIMPLEX, AB_LABEL_SCALE, text_color, AB_LABEL_THICKNESS, cv2.LINE_AA)
+
+def ab_label_sprites(w, h, swapped):
+    """
+    两个标签框各自的 RGBA 图像 [(x, y, rgba), ...]，alpha 为 255，已裁剪到画面内
+    按透明度叠加到画面上与 draw_ab_labels 的结果一致
+    """
+    sprites = []
+    for box in ab_label_boxes(w, h, swapped):
+        rect = _label_rect(box, w, h)
+        if rect is None: continue
+        x0, y0, x1, y1 = rect
+        rgb = np.zeros((y1 - y0, x1 - x0, 3), np.uint8)
+        mask = np.zeros((y1 - y0, x1 - x0), np.uint8)
+        _draw_label_boxes(rgb, [box], x0, y0, (0, 0, 0), (255, 255, 255), (255, 255, 255))
+        _draw_label_boxes(mask, [box], x0, y0, 255, 255, 255)
+        sprites.append((x0, y0, np.dstack((rgb, mask))))
+    return sprites
+
+def draw_ab_labels(canvas, swapped, alpha, clip=None):
+    """
+    在包含两个标签框的底部区域内混合，不复制整幅画面
+    clip=(x0, y0, x1, y1) 时只改动该矩形内的像素，结果与整体绘制后裁剪一致
+    """
+    h, w = canvas.shape[:2]
+    boxes = ab_label_boxes(w, h, swapped)
+    x0 = max(0, min(b[1] for b in boxes) - 2)
+    y0 = max(0, min(b[2] for b in boxes) - 2)
+    x1 = min(w, max(b[1] + b[3] for b in boxes) + 3)
+    y1 = min(h, max(b[2] + b[4] for b in boxes) + 3)
+    if clip is not None:
+        x0, y0 = max(x0, clip[0]), max(y0, clip[1])
+        x1, y1 = min(x1, clip[2]), min(y1, clip[3])
+    if x1 <= x0 or y1 <= y0: return
+
+    roi = canvas[y0:y1, x0:x1]
+    overlay = roi.copy()
+    _draw_label_boxes(overlay, boxes, x0, y0, (0, 0, 0), (255, 255, 255), (255, 255, 255))
+    cv2.addWeighted(overlay, alpha, roi, 1 - alpha, 0, roi)
+
+class CompareEngine:
+    """
+    一对图片的比较状态：原图、对齐后的图片、差异缓存、显示缓存与合成
+    不依赖 Tk，界面只负责把用户操作转发给它并显示它返回的图像
+    """
+    # 放大镜外框宽度 (像素)
+    LOUPE_BORDER = 3
+    # 放大镜信息栏的行高 (像素)
+    LOUPE_ROW = 16
+
+    def __init__(self, diff_threshold=30):
+        self.img_a = None
+        self.img_b = None
+        # 图片的内容键 (见 image_cache)，没有使用缓存时为 None
+        self.key_a = None
+        self.key_b = None
+        self.img_a_final = None
+        self.img_b_final = None
+
+        # 每对图片只计算一次灰度差异图与累计直方图，调整阈值时只查表
+        self.gray_diff = None
+        self.diff_count_above = None
+        self.diff_threshold = diff_threshold
+        self.diff_lut = None
+        # 分块感知指标：metric 为 None 时高亮与统计使用灰度差阈值，否则使用该指标的热力图与分数
+        self.metrics = None
+        self.metric = None
+        # 差异区域，按阈值缓存
+        self.region_finder = None
+        # 灰度差的积分图与最大值金字塔，放大镜与选区的统计按需在后台计算一次
+        self.region_stats = None
+        # 自动配准的结果 (alignment.Alignment)，未配准时为 None
+        self.alignment = None
+
+        self.split_x = 0
+        self.swapped = False
+
+        # 视口：display_scale 为缩放倍率（显示像素 / 原图像素），view_x0 / view_y0 为视口左上角对应的原图坐标
+        self.viewport = None
+        self.display_scale = 0
+        self.fit_mode = True
+        self.view_x0 = 0.0
+        self.view_y0 = 0.0
+        self.max_zoom = 32.0
+
+        # 显示金字塔共用一个 LRU 瓦片缓存，平移缩放只渲染视口内的瓦片
+        self.tile_cache = LRUTileCache()
+        self.pyr_a = None
+        self.pyr_b = None
+        self.pyr_mask = None
+
+        # 当前视口的显示分辨率缓存：只在加载、缩放、平移或窗口尺寸变化时重建
+        self.view_a = None
+        self.view_b = None
+        # 开启高亮时按需生成的 (A, B) 高亮版本，切换高亮只换拼接来源，不再逐帧叠加
+        self.view_highlight = None
+        self.view_rect = None
+        self.view_origin = (0, 0)
+        # compose_view 复用的输出缓冲区，以及上一帧的合成参数（用于只重绘变化的区域）
+        self.frame = None
+        self.last_compose = None
+        self.dirty_rects = None
+        # 中线与 A/B 标签图层的精灵缓存：(key, 图像)
+        self.line_sprite = (None, None)
+        self.label_sprites = (None, None)
+
+        # 分阶段计时，默认关闭；界面的性能 HUD 开启它
+        self.timer = StageTimer()
+
+    # 图片与差异
+    def set_image(self, side, image, key=None):
+        if side == 'A':
+            self.img_a, self.key_a = image, key
+        else:
+            self.img_b, self.key_b = image, key
+
+    def can_prepare(self):
+        return self.img_a is not None and self.img_b is not None
+
+    def apply_prepared(self, result, previews=None, alignment=None):
+        """
+        接收 prepare_pair 的结果（可能来自工作线程）；previews 为两侧金字塔的预览层 ((level, array) 或 None)，
+        alignment 为 B 的配准结果
+        """
+        self.img_a_final, self.img_b_final, self.gray_diff, self.diff_count_above = result
+        self.alignment = alignment
+        self.swapped = False
+        self.split_x = self.width // 2
+        self.tile_cache.clear()
+        self.pyr_a = TilePyramid.from_array(self.img_a_final, self.tile_cache)
+        self.pyr_b = TilePyramid.from_array(self.img_b_final, self.tile_cache)
+        for pyramid, preview in zip((self.pyr_a, self.pyr_b), previews or ()):
+            if preview is not None: pyramid.seed(*preview)
+        self.metrics = BlockMetrics(self.img_a_final, self.img_b_final)
+        self.metric = None
+        self.region_finder = RegionFinder(self.gray_diff)
+        self.region_stats = RegionStats(self.gray_diff, self.region_finder)
+        self.set_threshold(self.diff_threshold)
+        self.fit_mode = True
+        self.invalidate_view()
+
+    def apply_frame(self, result):
+        """
+        视频播放时换上下一帧：尺寸不变时保留中线、缩放、视口与 A / B 交换状态，只重建与像素有关的缓存；
+        第一帧或尺寸变化时等同 apply_prepared
+        """
+        if not self.has_pair() or self.img_a_final.shape != result[0].shape:
+            self.apply_prepared(result)
+            return
+        img_a, img_b, self.gray_diff, self.diff_count_above = result
+        if self.swapped: img_a, img_b = img_b, img_a
+        self.img_a_final, self.img_b_final = img_a, img_b
+        self.alignment = None
+        self.tile_cache.clear()
+        self.pyr_a = TilePyramid.from_array(self.img_a_final, self.tile_cache)
+        self.pyr_b = TilePyramid.from_array(self.img_b_final, self.tile_cache)
+        self.pyr_mask = None
+        self.metrics = BlockMetrics(self.img_a_final, self.img_b_final)
+        self.metric = None
+        self.region_finder = RegionFinder(self.gray_diff)
+        self.region_stats = RegionStats(self.gray_diff, self.region_finder)
+        self.set_threshold(self.diff_threshold)
+        self.invalidate_view()
+
+    def prepare(self, task=None):
+        self.apply_prepared(prepare_pair(self.img_a, self.img_b, task))
+
+    def load(self, path_a, path_b):
+        self.set_image('A', decode_image(path_a))
+        self.set_image('B', decode_image(path_b))
+        self.prepare()
+
+    def has_pair(self):
+        return self.img_a_final is not None and self.img_b_final is not None
+
+    @property
+    def width(self):
+        return self.img_a_final.shape[1]
+
+    @property
+    def height(self):
+        return self.img_a_final.shape[0]
+
+    def swap(self):
+        # absdiff 是对称的，交换后无需重新计算差异
+        self.img_a_final, self.img_b_final = self.img_b_final, self.img_a_final
+        self.pyr_a, self.pyr_b = self.pyr_b, self.pyr_a
+        self.view_a, self.view_b = self.view_b, self.view_a
+        if self.view_highlight is not None:
+            self.view_highlight = self.view_highlight[::-1]
+        self.swapped = not self.swapped
+        self.last_compose = None
+
+    def set_threshold(self, threshold):
+        self.diff_threshold = int(threshold)
+        self.diff_lut = np.where(np.arange(256) > self.diff_threshold, 255, 0).astype(np.uint8)
+        if self.pyr_mask is not None:
+            self.tile_cache.discard(self.pyr_mask.id)
+            self.pyr_mask = None
+        self.view_highlight = None
+        self.last_compose = None
+
+    def diff_percent(self):
+        if self.gray_diff is None: return 0.0
+        return self.diff_count_above[self.diff_threshold] / self.gray_diff.size * 100
+
+    def diff_regions(self):
+        """当前阈值下已经算好的差异区域，尚未计算时返回 None"""
+        return self.region_finder.cache.get(self.diff_threshold)
+
+    def window_stats(self, x0, y0, x1, y1):
+        """原图矩形内灰度差的统计 (region_stats.WindowStats)；积分图还没有算好时返回 None"""
+        if self.region_stats is None or not self.region_stats.ready: return None
+        return self.region_stats.query(x0, y0, x1, y1)
+
+    def set_metric(self, name):
+        """切换高亮所用的指标；分块指标需要先用 metrics.compute() 计算好"""
+        self.metric = name
+        self.view_highlight = None
+        self.last_compose = None
+
+    def diff_text(self):
+        if self.metric is not None:
+            text = format_score(self.metric, self.metrics.score(self.metric))
+        else:
+            text = f"差异: {self.diff_percent():.2f}%"
+        if self.alignment is not None:
+            text += f"   {self.alignment.describe()}"
+        return text
+
+    def set_split(self, value):
+        self.split_x = max(0, min(int(value), self.width))
+        return self.split_x
+
+    # 视口
+    def invalidate_view(self):
+        self.view_a = None
+        self.view_b = None
+        self.view_highlight = None
+        self.last_compose = None
+
+    def view_size(self):
+        return self.view_a.shape[1], self.view_a.shape[0]
+
+    def fit_zoom(self):
+        view_w, view_h = self.viewport
+        return min(view_w / self.width, view_h / self.height)
+
+    def set_viewport(self, width, height):
+        self.viewport = (width, height)
+        if self.fit_mode:
+            self.fit()
+        else:
+            self.clamp_view()
+
+    def fit(self):
+        self.fit_mode = True
+        self.display_scale = self.fit_zoom()
+        self.clamp_view()
+
+    def clamp_view(self):
+        """图片小于视口时居中，否则不允许平移出图片范围"""
+        view_w, view_h = self.viewport
+        span_w = view_w / self.display_scale
+        span_h = view_h / self.display_scale
+        if span_w >= self.width:
+            self.view_x0 = (self.width - span_w) / 2
+        else:
+            self.view_x0 = max(0.0, min(self.view_x0, self.width - span_w))
+        if span_h >= self.height:
+            self.view_y0 = (self.height - span_h) / 2
+        else:
+            self.view_y0 = max(0.0, min(self.view_y0, self.height - span_h))
+        self.invalidate_view()
+
+    def zoom_at(self, factor, cx, cy):
+        """以视口坐标 (cx, cy) 为中心缩放，该点下的像素保持不动"""
+        fit_zoom = self.fit_zoom()
+        zoom = max(fit_zoom, min(self.max_zoom, self.display_scale * factor))
+        if zoom <= fit_zoom:
+            self.fit()
+            return
+        ix, iy = self.canvas_to_image(cx, cy)
+        self.fit_mode = False
+        self.display_scale = zoom
+        self.view_x0 = ix - cx / zoom
+        self.view_y0 = iy - cy / zoom
+        self.clamp_view()
+
+    def zoom_to(self, zoom, cx, cy):
+        self.zoom_at(zoom / self.display_scale, cx, cy)
+
+    def center_on(self, ix, iy):
+        view_w, view_h = self.viewport
+        self.view_x0 = ix - view_w / 2 / self.display_scale
+        self.view_y0 = iy - view_h / 2 / self.display_scale
+        self.clamp_view()
+
+    def show_rect(self, x0, y0, x1, y1, max_zoom=8.0):
+        """缩放并平移到原图矩形，使它约占视口的一半；不会缩小到适应窗口以下"""
+        view_w, view_h = self.viewport
+        zoom = min(view_w / (2 * max(1, x1 - x0)), view_h / (2 * max(1, y1 - y0)), max_zoom, self.max_zoom)
+        if zoom <= self.fit_zoom():
+            self.fit()
+        else:
+            self.fit_mode = False
+            self.display_scale = zoom
+        self.center_on((x0 + x1) / 2, (y0 + y1) / 2)
+
+    def pan(self, dx, dy):
+        if self.fit_mode: return
+        self.view_x0 -= dx / self.display_scale
+        self.view_y0 -= dy / self.display_scale
+        self.clamp_view()
+
+    def canvas_to_image(self, cx, cy):
+        return self.view_x0 + cx / self.display_scale, self.view_y0 + cy / self.display_scale
+
+    def image_to_canvas(self, ix, iy):
+        return (ix - self.view_x0) * self.display_scale, (iy - self.view_y0) * self.display_scale
+
+    def view_window(self):
+        """视口内可见的原图范围：(ix0, iy0, out_w, out_h, ox, oy)，ox / oy 为它在视口中的位置"""
+        view_w, view_h = self.viewport
+        zoom = self.display_scale
+        ix0 = max(0.0, self.view_x0)
+        iy0 = max(0.0, self.view_y0)
+        ix1 = min(float(self.width), self.view_x0 + view_w / zoom)
+        iy1 = min(float(self.height), self.view_y0 + view_h / zoom)
+
+        ox = int(round((ix0 - self.view_x0) * zoom))
+        oy = int(round((iy0 - self.view_y0) * zoom))
+        out_w = max(1, min(view_w - ox, int(round((ix1 - ix0) * zoom))))
+        out_h = max(1, min(view_h - oy, int(round((iy1 - iy0) * zoom))))
+        # 对齐到整数显示像素，保证视口坐标与原图坐标的换算与画面一致
+        ix0 = self.view_x0 + ox / zoom
+        iy0 = self.view_y0 + oy / zoom
+        return ix0, iy0, out_w, out_h, ox, oy
+
+    def update_view(self):
+        """
+        从金字塔渲染当前视口内的 A / B，之后拖动中线只在这两块显示分辨率的缓存上合成
+        view_origin 为缓存左上角在视口中的位置
+        """
+        zoom = self.display_scale
+        ix0, iy0, out_w, out_h, ox, oy = self.view_window()
+        nearest = zoom >= 2
+        with self.timer.stage("视口渲染"):
+            self.view_a = self.pyr_a.render(zoom, ix0, iy0, out_w, out_h, nearest)
+            self.view_b = self.pyr_b.render(zoom, ix0, iy0, out_w, out_h, nearest)
+        self.view_highlight = None
+        self.last_compose = None
+        self.view_rect = (ix0, iy0, out_w, out_h)
+        self.view_origin = (ox, oy)
+        return self.view_origin
+
+    def build_view_overlay(self):
+        # 只在开启高亮时按需生成，并且只保留显示分辨率的红色图层
+        ix0, iy0, out_w, out_h = self.view_rect
+        overlay = np.zeros_like(self.view_a)
+        if self.metric is not None:
+            # 热力图直接从块级结果按视口采样，与原图大小无关
+            zoom = self.display_scale
+            xs = ix0 + (np.arange(out_w) + 0.5) / zoom
+            ys = iy0 + (np.arange(out_h) + 0.5) / zoom
+            overlay[:, :, 0] = sample_blocks(self.metrics.heatmap(self.metric), self.metrics.block, xs, ys)
+            return overlay
+
+        if self.pyr_mask is None:
+            gray_diff, lut = self.gray_diff, self.diff_lut
+            self.pyr_mask = TilePyramid(self.width, self.height,
+                                        lambda x0, y0, x1, y1: cv2.LUT(read_region(gray_diff, x0, y0, x1, y1), lut),
+                                        self.tile_cache, cache_base=True)
+        mask = self.pyr_mask.render(self.display_scale, ix0, iy0, out_w, out_h, self.display_scale >= 2)
+        overlay[:, :, 0] = mask
+        return overlay
+
+    def build_view_highlight(self):
+        overlay = self.build_view_overlay()
+        return tuple(cv2.addWeighted(view, 1, overlay, 0.5, 0) for view in (self.view_a, self.view_b))
+
+    def view_split_x(self):
+        """中线在显示缓存中的列位置，可能落在缓存之外"""
+        return int(round((self.split_x - self.view_rect[0]) * self.display_scale))
+
+    # 合成
+    def compose_view(self, show_diff=False, line=None, label_alpha=None):
+        """
+        在显示分辨率下合成当前画面 (RGB)，结果写入复用的 self.frame
+        与上一帧相比只有中线位置或标签透明度变化时，只重新合成受影响的区域；
+        dirty_rects 为本帧改动过的矩形 [(x0, y0, x1, y1), ...]，None 表示整幅画面
+        """
+        h, w, _ = self.view_a.shape
+        split_x = self.view_split_x()
+
+        if show_diff and self.gray_diff is not None and self.view_highlight is None:
+            with self.timer.stage("差异图层"):
+                self.view_highlight = self.build_view_highlight()
+
+        prev = self.last_compose
+        if self.frame is None or self.frame.shape != self.view_a.shape:
+            self.frame = np.empty_like(self.view_a)
+            prev = None
+
+        if prev is None or prev[1:3] != (show_diff, line):
+            rects = None
+        else:
+            rects = []
+            prev_split, _, _, prev_alpha = prev
+            if prev_split != split_x:
+                # 新旧中线之间的竖条：A / B 的分界与中线本身都在这里
+                pad = (line.thickness if line is not None else 0) + 2
+                x0 = max(0, min(prev_split, split_x) - pad)
+                x1 = min(w, max(prev_split, split_x) + pad + 1)
+                if x1 > x0: rects.append((x0, 0, x1, h))
+            if prev_alpha != label_alpha:
+                rects += ab_label_rects(w, h, self.swapped)
+
+        self.last_compose = (split_x, show_diff, line, label_alpha)
+        self.dirty_rects = rects
+        for rect in rects if rects is not None else [(0, 0, w, h)]:
+            self.render_region(rect, split_x, show_diff, line, label_alpha)
+        return self.frame
+
+    def render_region(self, rect, split_x, show_diff, line, label_alpha):
+        """从显示缓存重新合成 self.frame 中的一个矩形"""
+        x0, y0, x1, y1 = rect
+        h = self.frame.shape[0]
+        region = self.frame[y0:y1, x0:x1]
+        timer = self.timer
+
+        view_a, view_b = self.view_a, self.view_b
+        if show_diff and self.view_highlight is not None:
+            view_a, view_b = self.view_highlight
+
+        with timer.stage("拼接 A/B"):
+            split = max(x0, min(split_x, x1))
+            region[:, :split - x0] = view_a[y0:y1, x0:split]
+            region[:, split - x0:] = view_b[y0:y1, split:x1]
+
+        if line is not None and x0 - line.thickness <= split_x <= x1 + line.thickness:
+            # 端点用整幅画面的坐标平移得到，虚线的相位与整体绘制一致
+            with timer.stage("中线"):
+                draw_line(region, (split_x - x0, -y0), (split_x - x0, h - y0), line.color, line.thickness,
+                          line.style)
+
+        if label_alpha is not None:
+            with timer.stage("A/B 标签"):
+                draw_ab_labels(self.frame, self.swapped, label_alpha, clip=rect)
+
+    # 叠加图层：界面把它们作为底图之上的独立画布对象，切换或淡出时不重新合成底图
+    def line_layer(self, line):
+        """
+        中线图层 (key, x, rgba)：rgba 为裁剪到画面内的整列高的 RGBA 精灵，x 为它在画面中的列位置
+        key 不变时精灵内容不变，只需移动位置；中线不在画面内时返回 None
+        """
+        h, w = self.view_a.shape[:2]
+        pad = line.thickness + 2
+        key, sprite = self.line_sprite
+        if key != (line, h):
+            # 端点与 compose_view 相同，虚线的相位一致
+            mask = np.zeros((h, pad * 2 + 1), np.uint8)
+            draw_line(mask, (pad, 0), (pad, h), 255, line.thickness, line.style)
+            sprite = np.empty(mask.shape + (4,), np.uint8)
+            sprite[:, :, :3] = line.color
+            sprite[:, :, 3] = mask
+            self.line_sprite = ((line, h), sprite)
+
+        left = self.view_split_x() - pad
+        c0, c1 = max(0, -left), min(sprite.shape[1], w - left)
+        if c1 <= c0: return None
+        return (line, h, c0, c1), left + c0, sprite[:, c0:c1]
+
+    def ab_label_layers(self, alpha):
+        """A / B 标签图层 [(key, x, y, rgba), ...]，淡出时只重新计算 alpha 通道"""
+        h, w = self.view_a.shape[:2]
+        key, sprites = self.label_sprites
+        if key != (w, h, self.swapped):
+            sprites = ab_label_sprites(w, h, self.swapped)
+            self.label_sprites = ((w, h, self.swapped), sprites)
+
+        layers = []
+        for x, y, sprite in sprites:
+            rgba = sprite.copy()
+            rgba[:, :, 3] = cv2.multiply(sprite[:, :, 3], alpha)
+            layers.append(((x, y, sprite.shape, alpha), x, y, rgba))
+        return layers
+
+    def compose_region(self, x1, y1, x2, y2, show_diff=False, line=None):
+        """在原始分辨率下合成指定区域，供放大镜等需要真实像素的地方使用"""
+        patch = self.img_b_final[y1:y2, x1:x2].copy()
+        split_x = self.split_x
+        if split_x > x1:
+            end = min(split_x, x2) - x1
+            patch[:, :end] = self.img_a_final[y1:y2, x1:x1 + end]
+
+        if show_diff and self.gray_diff is not None:
+            overlay = np.zeros_like(patch)
+            if self.metric is not None:
+                overlay[:, :, 0] = sample_blocks(self.metrics.heatmap(self.metric), self.metrics.block,
+                                                 np.arange(x1, x2), np.arange(y1, y2))
+            else:
+                overlay[:, :, 0] = self.diff_lut[self.gray_diff[y1:y2, x1:x2]]
+            patch = cv2.addWeighted(patch, 1, overlay, 0.5, 0)
+
+        if line is not None and x1 - line.thickness <= split_x < x2 + line.thickness:
+            draw_line(patch, (split_x - x1, -y1), (split_x - x1, self.height - y1), line.color,
+                      line.thickness, line.style)
+        return patch
+
+    def render_loupe(self, cx_src, cy_src, zoom, box_size, show_diff=False, line=None):
+        """
+        放大镜图像 (RGB)：以原图 (cx_src, cy_src) 为中心放大 zoom 倍，含边框与十字线；
+        下方的信息栏显示该点 A、B 的 RGB 与逐通道差 (B - A)，以及放大镜窗口内灰度差的均值、标准差与最大值
+        """
+        crop_radius = int(box_size / zoom / 2)
+        x1 = max(0, cx_src - crop_radius)
+        y1 = max(0, cy_src - crop_radius)
+        x2 = min(self.width, cx_src + crop_radius)
+        y2 = min(self.height, cy_src + crop_radius)
+        
+        if x2 <= x1 or y2 <= y1:
+            return None
+        
+        # 放大镜需要真实像素，直接从原始分辨率合成这一小块
+        src_patch = self.compose_region(x1, y1, x2, y2, show_diff, line)
+        zoomed_patch = cv2.resize(src_patch, (box_size, box_size), interpolation=cv2.INTER_NEAREST)
+
+        # 交换后仍按原来的 A / B 显示
+        img_a, img_b = (self.img_b_final, self.img_a_final) if self.swapped else (self.img_a_final, self.img_b_final)
+        rgb_a = [int(v) for v in img_a[cy_src, cx_src]]
+        rgb_b = [int(v) for v in img_b[cy_src, cx_src]]
+        rows = [("A", rgb_a), ("B", rgb_b), ("B-A " + ",".join(f"{b - a:+d}" for a, b in zip(rgb_a, rgb_b)), None)]
+        stats = self.window_stats(x1, y1, x2, y2)
+        if stats is not None:
+            rows.append((f"avg {stats.mean:.1f} sd {stats.std:.1f} max {stats.max}", None))
+
+        # 信息栏接在放大区域下方，不遮挡像素
+        row_h = self.LOUPE_ROW
+        panel = np.full((row_h * len(rows) + 6, box_size, 3), 20, np.uint8)
+        swatch_size = 10
+        for i, (text, rgb) in enumerate(rows):
+            text_x, base_y = 8, 3 + row_h * (i + 1) - 4
+            if rgb is not None:
+                sy1 = base_y - swatch_size
+                cv2.rectangle(panel, (text_x, sy1), (text_x + swatch_size, sy1 + swatch_size), rgb, -1)
+                cv2.rectangle(panel, (text_x, sy1), (text_x + swatch_size, sy1 + swatch_size), (200, 200, 200), 1)
+                text = f"{text} {rgb[0]},{rgb[1]},{rgb[2]}"
+                text_x += swatch_size + 6
+            cv2.putText(panel, text, (text_x, base_y), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (230, 230, 230), 1,
+                        cv2.LINE_AA)
+
+        # 外侧 2px 黑边 + 1px 白边
+        border = self.LOUPE_BORDER
+        loupe = cv2.copyMakeBorder(np.vstack([zoomed_patch, panel]), 1, 1, 1, 1, cv2.BORDER_CONSTANT,
+                                   value=(255, 255, 255))
+        loupe = cv2.copyMakeBorder(loupe, 2, 2, 2, 2, cv2.BORDER_CONSTANT, value=(0, 0, 0))
+        
+        dx1, dy1 = border, border
+        dx2, dy2 = dx1 + box_size, dy1 + box_size
+        cx, cy = dx1 + box_size // 2, dy1 + box_size // 2
+        cv2.line(loupe, (cx, dy1), (cx, dy2), (0, 255, 0), 1)
+        cv2.line(loupe, (dx1, cy), (dx2, cy), (0, 255, 0), 1)
+        cv2.line(loupe, (dx1, dy2), (dx2, dy2), (90, 90, 90), 1)
+        return loupe
+
+    # 导出
+    def export_animation(self, path, options=DEFAULT_OPTIONS, line_color=None, task=None):
+        """当前左右顺序的对比动画，见 export.export_animation；可在工作线程中调用，不使用共用的瓦片缓存"""
+        return export_animation(path, self.img_a_final, self.img_b_final, options, line_color, task)
+
+def list_images(folder):
+    """递归列出目录中的图片，返回 {小写的相对路径(不含扩展名): (相对路径, 完整路径)}"""
+    images = {}
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if not name.lower().endswith(IMAGE_EXTENSIONS): continue
+            full = os.path.join(dirpath, name)
+            key = os.path.splitext(os.path.relpath(full, folder))[0].replace(os.sep, '/')
+            images.setdefault(key.lower(), (key, full))
+    return images
+
+def match_folder_pairs(dir_a, dir_b):
+    """
+    按文件名（相对路径，忽略扩展名与大小写）匹配两个目录中的图片
+    返回 (pairs, only_a, only_b)，pairs 为 [(name, path_a, path_b), ...]
+    """
+    images_a = list_images(dir_a)
+    images_b = list_images(dir_b)
+    pairs = [(images_a[key][0], images_a[key][1], images_b[key][1]) for key in sorted(images_a) if key in images_b]
+    only_a = [images_a[key][1] for key in sorted(images_a) if key not in images_b]
+    only_b = [images_b[key][1] for key in sorted(images_b) if key not in images_a]
+    return pairs, only_a, only_b
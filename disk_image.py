@@ -0,0 +1,107 @@
+import mmap
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from lazy_import import LazyModule
+
+# 超大图片的磁盘缓存：像素放在临时文件的内存映射上，按条带 / 瓦片读写，
+# 处理过的页面随即从进程的工作集中释放，常驻内存与图片大小无关
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+# 超过该像素数的图片解码后立即转存到磁盘 (64 MP)
+LARGE_IMAGE_PIXELS = 64 * 1024 * 1024
+# 每个条带的目标字节数
+STRIP_BYTES = 32 * 1024 * 1024
+
+def disk_array(shape, dtype='uint8', dir=None):
+    """在临时文件上创建内存映射数组，数组被回收后临时文件自动删除"""
+    dtype = np.dtype(dtype)
+    nbytes = max(1, int(np.prod(shape)) * dtype.itemsize)
+    with tempfile.TemporaryFile(prefix='imagecompare-', dir=dir) as f:
+        f.truncate(nbytes)
+        # mmap 持有自己的文件句柄，关闭文件对象后映射仍然有效
+        buf = mmap.mmap(f.fileno(), nbytes)
+    return np.ndarray(shape, dtype, buffer=buf)
+
+def _mapping(arr):
+    base = arr
+    while base is not None and not isinstance(base, mmap.mmap):
+        base = getattr(base, 'base', None)
+    return base
+
+def is_disk_backed(arr):
+    return arr is not None and _mapping(arr) is not None
+
+def release(arr, y0, y1):
+    """
+    把 disk_array 第 y0..y1 行的页面移出工作集；数据仍在页缓存 / 临时文件中，再次访问时自动读回
+    只对 disk_array 直接返回的数组有效，其他数组忽略
+    """
+    if not hasattr(mmap, 'MADV_DONTNEED') or not isinstance(getattr(arr, 'base', None), mmap.mmap): return
+    row_bytes = arr.strides[0]
+    start = y0 * row_bytes // mmap.PAGESIZE * mmap.PAGESIZE
+    end = min(len(arr.base), y1 * row_bytes)
+    if end > start:
+        arr.base.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+def strip_rows(arr_or_shape, itemsize=1):
+    """每个条带的行数，使单个条带约为 STRIP_BYTES"""
+    if hasattr(arr_or_shape, 'shape'):
+        shape, itemsize = arr_or_shape.shape, arr_or_shape.itemsize
+    else:
+        shape = arr_or_shape
+    row_bytes = int(np.prod(shape[1:])) * itemsize
+    return max(16, STRIP_BYTES // max(1, row_bytes))
+
+def strips(height, rows):
+    for y0 in range(0, height, rows):
+        yield y0, min(height, y0 + rows)
+
+def parallel_workers():
+    """逐条带计算的线程数，跟随 OpenCV 的线程设置；批量模式的每个进程把它设为 1"""
+    return max(1, cv2.getNumThreads())
+
+def map_strips(func, height, rows, task=None, stage=None, workers=1):
+    """
+    对每个条带 (y0, y1) 调用 func，按条带顺序返回结果列表；workers > 1 时在线程池中执行
+    进度汇报与取消检查都在调用线程中进行，取消时还没开始的条带直接丢弃
+    """
+    bands = list(strips(height, rows))
+    if workers <= 1 or len(bands) <= 1:
+        results = []
+        for y0, y1 in bands:
+            if task is not None: task.report(stage, y0 / height)
+            results.append(func(y0, y1))
+        return results
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(func, y0, y1) for y0, y1 in bands]
+        try:
+            results = []
+            for (y0, _), future in zip(bands, futures):
+                if task is not None: task.report(stage, y0 / height)
+                results.append(future.result())
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return results
+
+def read_region(arr, x0, y0, x1, y1):
+    """读取一块区域；磁盘数组返回独立副本并释放读过的页面，普通数组直接返回视图"""
+    if not is_disk_backed(arr): return arr[y0:y1, x0:x1]
+    region = np.array(arr[y0:y1, x0:x1])
+    release(arr, y0, y1)
+    return region
+
+def to_disk(image, task=None, stage="写入磁盘缓存"):
+    """把内存中的图片逐条带复制到磁盘数组"""
+    out = disk_array(image.shape, image.dtype)
+    h = image.shape[0]
+    for y0, y1 in strips(h, strip_rows(image)):
+        if task is not None: task.report(stage, y0 / h)
+        out[y0:y1] = image[y0:y1]
+        release(out, y0, y1)
+    return out
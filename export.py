@@ -0,0 +1,250 @@
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import zlib
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from disk_image import parallel_workers, read_region
+from lazy_import import LazyModule
+from tiles import LRUTileCache, TilePyramid
+
+# 对比动画导出：分割线从左扫到右的各帧由生成器按需产生，在线程池中并行合成与编码，
+# 再按顺序流式写入文件；同时在途的帧数有上限，内存占用与帧数无关
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+Image = LazyModule("PIL.Image")
+GifImagePlugin = LazyModule("PIL.GifImagePlugin")
+
+# 扩展名 -> 显示名称
+EXPORT_FORMATS = {
+    '.gif': "GIF",
+    '.png': "APNG",
+    '.apng': "APNG",
+    '.mp4': "MP4",
+}
+
+# frames 为帧数，scale 为相对原图的缩放，duration 为整段动画的时长 (秒)
+ExportOptions = namedtuple('ExportOptions', ['frames', 'scale', 'duration'])
+DEFAULT_OPTIONS = ExportOptions(21, 0.5, 2.1)
+
+def ordered_map(func, items, workers, ahead=None):
+    """
+    对 items 中的每一项调用 func，在线程池中并行执行，按原顺序产出结果
+    items 可以是生成器，只在有空位时才取下一项；最多 ahead 个结果在途
+    """
+    ahead = ahead or workers * 2
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(pool.submit(func, item))
+                if len(pending) >= ahead:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+def scaled(img, scale):
+    """按 scale 缩放整幅图片；使用独立的金字塔与瓦片缓存，不与界面线程共用"""
+    if scale == 1: return img
+    h, w = img.shape[:2]
+    pyramid = TilePyramid.from_array(img, LRUTileCache(64 * 1024 * 1024))
+    return pyramid.render(scale, 0, 0, max(1, round(w * scale)), max(1, round(h * scale)))
+
+def wipe_frame(base_a, base_b, split_x, line_color=None):
+    h, w = base_a.shape[:2]
+    frame = np.array(read_region(base_b, 0, 0, w, h))
+    frame[:, :split_x] = read_region(base_a, 0, 0, split_x, h)
+    if line_color is not None:
+        cv2.line(frame, (split_x, 0), (split_x, h), line_color, 1)
+    return frame
+
+def wipe_frames(base_a, base_b, count, line_color=None):
+    """生成器：依次产出合成第 i 帧的函数，分割线从最左 (全 B) 均匀移到最右 (全 A)"""
+    w = base_a.shape[1]
+    for i in range(count):
+        split_x = round(w * i / max(1, count - 1))
+        yield lambda split_x=split_x: wipe_frame(base_a, base_b, split_x, line_color)
+
+class GifWriter:
+    """
+    逐帧写出的 GIF：每帧在工作线程中单独量化为 256 色并压缩，使用局部调色板，
+    主线程只按顺序写入，不需要像 Image.save(save_all=True) 那样先收齐所有帧
+    """
+    def __init__(self, path, width, height, frame_ms, count):
+        self.path = path
+        self.frame_ms = frame_ms
+        self.file = open(path, 'wb')
+        # 逻辑屏幕描述符不带全局调色板；NETSCAPE2.0 扩展设置无限循环
+        self.file.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0, 0, 0))
+        self.file.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', 0) + b'\x00')
+
+    def prepare(self, frame):
+        # 快速八叉树量化比默认的中位切分快一个数量级，每帧仍各自生成局部调色板
+        image = Image.fromarray(frame).quantize(256, method=Image.Quantize.FASTOCTREE)
+        return b''.join(GifImagePlugin.getdata(image, duration=self.frame_ms, include_color_table=True))
+
+    def write(self, data):
+        self.file.write(data)
+
+    def close(self):
+        self.file.write(b';')
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.path)
+
+def _png_chunks(data):
+    pos = 8
+    while pos < len(data):
+        length, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        yield kind, data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+
+def _png_chunk(kind, body):
+    return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body) & 0xffffffff)
+
+class ApngWriter:
+    """
+    逐帧写出的 APNG：每帧在工作线程中由 OpenCV 编码为 PNG，主线程取出其中的 IDAT 数据，
+    第一帧原样作为 IDAT（不支持动画的查看器会显示它），之后的帧改写为 fdAT
+    """
+    def __init__(self, path, width, height, frame_ms, count):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.frame_ms = frame_ms
+        self.count = count
+        self.sequence = 0
+        self.file = open(path, 'wb')
+
+    def prepare(self, frame):
+        ok, buf = cv2.imencode('.png', cv2.cvtColor(frame, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_PNG_COMPRESSION, 3])
+        if not ok: raise ValueError("PNG encode failed")
+        return buf.tobytes()
+
+    def write(self, data):
+        chunks = list(_png_chunks(data))
+        if self.sequence == 0:
+            self.file.write(data[:8])
+            self.file.write(_png_chunk(b'IHDR', chunks[0][1]))
+            self.file.write(_png_chunk(b'acTL', struct.pack('>II', self.count, 0)))
+        # 帧控制：全幅、延迟 frame_ms / 1000 秒、不清除、直接覆盖
+        self.file.write(_png_chunk(b'fcTL', struct.pack('>IIIIIHHBB', self.sequence, self.width, self.height, 0, 0,
+                                                        int(self.frame_ms), 1000, 0, 0)))
+        first = self.sequence == 0
+        self.sequence += 1
+        for kind, body in chunks:
+            if kind != b'IDAT': continue
+            if first:
+                self.file.write(_png_chunk(b'IDAT', body))
+            else:
+                self.file.write(_png_chunk(b'fdAT', struct.pack('>I', self.sequence) + body))
+                self.sequence += 1
+
+    def close(self):
+        self.file.write(_png_chunk(b'IEND', b''))
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.path)
+
+def find_ffmpeg():
+    """环境变量 IMAGECOMPARE_FFMPEG 指定的程序，或 PATH 中的 ffmpeg"""
+    return shutil.which(os.environ.get('IMAGECOMPARE_FFMPEG', 'ffmpeg'))
+
+class Mp4Writer:
+    """
+    通过管道把 RGB 原始帧写给本地 ffmpeg，编码为 H.264 (yuv420p)；宽高补到偶数
+    ffmpeg 的输出写入临时文件，避免管道写满阻塞，失败时附在异常信息里
+    """
+    def __init__(self, path, width, height, frame_ms, count):
+        ffmpeg = find_ffmpeg()
+        if ffmpeg is None: raise RuntimeError("未找到 ffmpeg，请把它加入 PATH 或设置环境变量 IMAGECOMPARE_FFMPEG")
+        self.path = path
+        self.pad_x, self.pad_y = width % 2, height % 2
+        self.log = tempfile.TemporaryFile()
+        cmd = [ffmpeg, '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width + self.pad_x}x{height + self.pad_y}',
+               '-framerate', f'{1000 / frame_ms:.6f}', '-i', '-',
+               '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-movflags', '+faststart', path]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self.log,
+                                        creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+
+    def prepare(self, frame):
+        if self.pad_x or self.pad_y:
+            frame = cv2.copyMakeBorder(frame, 0, self.pad_y, 0, self.pad_x, cv2.BORDER_REPLICATE)
+        return np.ascontiguousarray(frame).data
+
+    def write(self, data):
+        try:
+            self.process.stdin.write(data)
+        except OSError:
+            # ffmpeg 提前退出，_finish 会带上它的错误输出
+            self._finish()
+            raise RuntimeError("ffmpeg 提前退出")
+
+    def _finish(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        code = self.process.wait()
+        self.log.seek(0)
+        message = self.log.read().decode('utf-8', 'replace').strip()
+        self.log.close()
+        if code != 0:
+            raise RuntimeError(f"ffmpeg 编码失败 ({code})\n{message[-500:]}")
+
+    def close(self):
+        self._finish()
+
+    def abort(self):
+        self.process.kill()
+        self.process.wait()
+        self.log.close()
+        if os.path.exists(self.path): os.remove(self.path)
+
+WRITERS = {'GIF': GifWriter, 'APNG': ApngWriter, 'MP4': Mp4Writer}
+
+def export_animation(path, img_a, img_b, options=DEFAULT_OPTIONS, line_color=None, task=None, workers=None):
+    """
+    把 A / B 的对比动画写入 path，格式由扩展名决定 (EXPORT_FORMATS)；返回写出的帧数
+    取消或失败时删除不完整的文件
+    """
+    fmt = EXPORT_FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None: raise ValueError(f"Unsupported export format: {path}")
+    count = max(2, int(options.frames))
+    frame_ms = max(10, round(options.duration * 1000 / count))
+    if fmt == 'GIF': frame_ms = max(20, round(frame_ms, -1))  # GIF 的延迟以 10 ms 为单位，多数查看器不支持小于 20 ms
+
+    if task is not None: task.report("缩放", 0.0)
+    base_a = scaled(img_a, options.scale)
+    base_b = scaled(img_b, options.scale)
+    h, w = base_a.shape[:2]
+
+    writer = WRITERS[fmt](path, w, h, frame_ms, count)
+    try:
+        frames = wipe_frames(base_a, base_b, count, line_color)
+        encoded = ordered_map(lambda make: writer.prepare(make()), frames, workers or parallel_workers())
+        try:
+            for i, data in enumerate(encoded):
+                if task is not None: task.report(f"导出 {fmt}", i / count)
+                writer.write(data)
+        finally:
+            # 取消时立即停止线程池，不等生成器被回收
+            encoded.close()
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    if task is not None: task.report("完成")
+    return count
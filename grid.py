@@ -0,0 +1,410 @@
+import math
+
+from compare_engine import CompareEngine, draw_line
+from disk_image import read_region
+from lazy_import import LazyModule
+from metrics import BlockMetrics, sample_blocks
+from region_stats import RegionStats
+from regions import RegionFinder
+from tiles import TilePyramid
+
+# 多图对比：N 张图片以网格或多条分割线的方式同步显示，差异都相对选定的基准图计算
+# 每张图片有自己按需生成瓦片的显示金字塔，全部共用引擎的 LRU 瓦片缓存；
+# 加入图片、切换布局或焦点都不会重新解码，也不会重建其他图片的金字塔
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+# 布局名称 -> 显示名称
+GRID_LAYOUTS = {
+    'grid': "网格",
+    'split': "多分割",
+}
+# 网格单元之间的间隔 (像素)
+CELL_GAP = 2
+# 网格空白处的颜色，与画布背景一致
+BACKGROUND = (37, 37, 38)
+
+class GridItem:
+    """一张图片：原图与内容键，以及相对当前基准的比较结果；换基准时只清除后者"""
+    def __init__(self, name, image, key=None):
+        self.name = name
+        self.image = image
+        self.key = key
+        # result 为 prepare_pair 的返回值，shown 为显示用的图像（缩放或配准到基准的尺寸）
+        self.result = None
+        self.alignment = None
+        self.shown = None
+        self.pyramid = None
+        self.pyr_mask = None
+        self.metrics = None
+        self.region_finder = None
+        self.region_stats = None
+
+    @property
+    def ready(self):
+        return self.result is not None
+
+    def show(self, image, cache, preview=None):
+        """显示 image；与当前显示的是同一个数组时保留已有的金字塔与瓦片"""
+        if image is self.shown: return
+        self.shown = image
+        self.pyramid = TilePyramid.from_array(image, cache)
+        if preview is not None: self.pyramid.seed(*preview)
+
+    def reset(self, cache):
+        self.result = None
+        self.alignment = None
+        self.metrics = None
+        self.region_finder = None
+        self.region_stats = None
+        self.discard_mask(cache)
+
+    def discard_mask(self, cache):
+        if self.pyr_mask is not None:
+            cache.discard(self.pyr_mask.id)
+            self.pyr_mask = None
+
+class GridEngine(CompareEngine):
+    """
+    N 张图片的比较状态。基类的 A / B 为基准图与焦点图（鼠标所在的单元或分割条），
+    差异数字、指标、差异区域、放大镜与导出都针对这一对
+    网格布局下视口为单个单元的尺寸，各单元共用同一缩放与平移；多分割布局下视口为整个画布
+    """
+    def __init__(self, diff_threshold=30):
+        super().__init__(diff_threshold)
+        self.items = []
+        self.reference = 0
+        self.focus = 0
+        self.layout = 'grid'
+        # 多分割布局的分割线（原图列坐标，升序），拖动时移动离点击处最近的一条
+        self.dividers = []
+        self.active_divider = 0
+        self.canvas_size = None
+        # 各图片当前视口的显示缓存与高亮版本
+        self.views = []
+        self.view_highlights = None
+        self.cell_offset = (0, 0)
+        self.set_threshold(diff_threshold)
+
+    # 图片与基准
+    def add_image(self, name, image, key=None):
+        """加入一张图片，返回序号；第一张作为基准。与基准同尺寸的图片立即显示原图，差异算好后再高亮"""
+        item = GridItem(name, image, key)
+        self.items.append(item)
+        index = len(self.items) - 1
+        if index == self.reference:
+            self.set_reference(index)
+        elif image.shape[:2] == self.items[self.reference].image.shape[:2]:
+            item.show(image, self.tile_cache)
+        self.reset_dividers()
+        self.invalidate_view()
+        return index
+
+    def set_reference(self, index, preview=None):
+        """换基准：清除所有比较结果，基准与自身的差异为零；返回需要重新计算差异的序号"""
+        self.reference = index
+        ref = self.items[index]
+        h, w = ref.image.shape[:2]
+        for item in self.items:
+            item.reset(self.tile_cache)
+            # 尺寸不同的图片显示的是缩放后的版本，换基准后要重新计算，先不显示
+            if item.image.shape[:2] == (h, w):
+                item.show(item.image, self.tile_cache)
+            else:
+                item.shown = item.pyramid = None
+        ref.show(ref.image, self.tile_cache, preview)
+        self.reset_dividers()
+        self.apply_item(index, index, (ref.image, ref.image, np.zeros((h, w), np.uint8), np.zeros(256, np.int64)))
+        self.set_focus(index)
+        self.invalidate_view()
+        return [i for i in range(len(self.items)) if i != index]
+
+    def apply_item(self, index, reference, result, previews=None, alignment=None):
+        """
+        接收第 index 张相对基准 reference 的 prepare_pair 结果（可能来自工作线程）；基准已经换了时丢弃，返回是否采用
+        previews 与 ImageCache.prepare_pair 的返回值相同
+        """
+        if reference != self.reference or index >= len(self.items): return False
+        item = self.items[index]
+        item.reset(self.tile_cache)
+        item.result = result
+        item.alignment = alignment
+        item.show(result[1], self.tile_cache, previews[1] if previews else None)
+        item.metrics = BlockMetrics(result[0], result[1])
+        item.region_finder = RegionFinder(result[2])
+        item.region_stats = RegionStats(result[2], item.region_finder)
+        if index == self.focus: self.set_focus(index)
+        self.invalidate_view()
+        return True
+
+    def set_focus(self, index):
+        """焦点换到第 index 张（比较结果已经就绪时），基类的 A / B、差异与指标随之切换"""
+        item = self.items[index]
+        if not item.ready: return False
+        self.focus = index
+        ref = self.items[self.reference]
+        self.img_a_final = ref.shown
+        self.img_b_final, self.gray_diff, self.diff_count_above = item.result[1:]
+        self.pyr_a, self.pyr_b = ref.pyramid, item.pyramid
+        self.metrics = item.metrics
+        self.region_finder = item.region_finder
+        self.region_stats = item.region_stats
+        self.alignment = item.alignment
+        # 指标对新的焦点还没有算好时先退回灰度差，界面随后在后台计算
+        if self.metric is not None and not item.metrics.has(self.metric): self.set_metric(None)
+        if self.views: self.view_b = self.views[index]
+        return True
+
+    def item_at(self, cx, cy):
+        """画布坐标下的图片序号：网格布局为所在单元，多分割布局为所在分割条；不在任何图片上时返回 None"""
+        if not self.items or self.viewport is None: return None
+        if self.layout == 'grid':
+            cell = self.cell_at(cx, cy)
+            return cell if cell < len(self.items) else None
+        ix, _ = self.canvas_to_image(cx, cy)
+        return self.strip_at(ix)
+
+    # 布局
+    def set_layout(self, layout):
+        self.layout = layout
+        self.viewport = None
+        self.invalidate_view()
+
+    def grid_shape(self):
+        """(列数, 行数)：尽量接近正方形，列数不少于行数"""
+        count = max(1, len(self.items))
+        cols = math.ceil(math.sqrt(count))
+        return cols, math.ceil(count / cols)
+
+    def cell_size(self):
+        cols, rows = self.grid_shape()
+        width, height = self.canvas_size
+        return (max(1, (width - CELL_GAP * (cols - 1)) // cols),
+                max(1, (height - CELL_GAP * (rows - 1)) // rows))
+
+    def cell_origin(self, index):
+        cols, _ = self.grid_shape()
+        cell_w, cell_h = self.cell_size()
+        return (index % cols) * (cell_w + CELL_GAP), (index // cols) * (cell_h + CELL_GAP)
+
+    def cell_at(self, cx, cy):
+        cols, rows = self.grid_shape()
+        cell_w, cell_h = self.cell_size()
+        col = min(cols - 1, max(0, int(cx) // (cell_w + CELL_GAP)))
+        row = min(rows - 1, max(0, int(cy) // (cell_h + CELL_GAP)))
+        return row * cols + col
+
+    def set_viewport(self, width, height):
+        self.canvas_size = (width, height)
+        super().set_viewport(*(self.cell_size() if self.layout == 'grid' else (width, height)))
+
+    def canvas_to_image(self, cx, cy):
+        if self.layout == 'grid' and self.canvas_size is not None:
+            x0, y0 = self.cell_origin(self.cell_at(cx, cy))
+            cx, cy = cx - x0, cy - y0
+        return super().canvas_to_image(cx, cy)
+
+    def image_to_canvas(self, ix, iy):
+        """网格布局下换算到焦点所在的单元"""
+        cx, cy = super().image_to_canvas(ix, iy)
+        if self.layout == 'grid' and self.canvas_size is not None:
+            x0, y0 = self.cell_origin(self.focus)
+            cx, cy = cx + x0, cy + y0
+        return cx, cy
+
+    def zoom_at(self, factor, cx, cy):
+        if self.layout == 'grid' and self.canvas_size is not None:
+            x0, y0 = self.cell_origin(self.cell_at(cx, cy))
+            cx, cy = cx - x0, cy - y0
+        # 以单元内坐标缩放；单元内坐标落在第一个单元里，canvas_to_image 的换算不变
+        super().zoom_at(factor, cx, cy)
+
+    # 分割线
+    def reset_dividers(self):
+        count = len(self.items)
+        width = self.items[self.reference].image.shape[1] if self.items else 0
+        self.dividers = [round(width * i / count) for i in range(1, count)]
+        self.active_divider = min(self.active_divider, max(0, len(self.dividers) - 1))
+
+    def strip_at(self, ix):
+        """原图列 ix 所在的分割条序号"""
+        for i, x in enumerate(self.dividers):
+            if ix < x: return i
+        return len(self.dividers)
+
+    def grab_divider(self, ix):
+        """选中离原图列 ix 最近的分割线，之后 set_split 移动它"""
+        if not self.dividers: return
+        self.active_divider = min(range(len(self.dividers)), key=lambda i: abs(self.dividers[i] - ix))
+
+    @property
+    def split_x(self):
+        if self.layout != 'split' or not self.dividers: return 0
+        return self.dividers[self.active_divider]
+
+    @split_x.setter
+    def split_x(self, value):
+        # 基类在初始化时会写入 split_x，多图对比的分割位置只由 dividers 决定
+        pass
+
+    def set_split(self, value):
+        """移动选中的分割线，不越过相邻的分割线"""
+        if self.layout != 'split' or not self.dividers: return 0
+        i = self.active_divider
+        low = self.dividers[i - 1] if i > 0 else 0
+        high = self.dividers[i + 1] if i + 1 < len(self.dividers) else self.width
+        self.dividers[i] = max(low, min(int(value), high))
+        return self.dividers[i]
+
+    def swap(self):
+        # 多图对比没有左右之分，基准由 set_reference 切换
+        pass
+
+    # 视口与合成
+    def invalidate_view(self):
+        super().invalidate_view()
+        self.views = []
+        self.view_highlights = None
+
+    def set_threshold(self, threshold):
+        super().set_threshold(threshold)
+        for item in self.items:
+            item.discard_mask(self.tile_cache)
+        self.view_highlights = None
+
+    def set_metric(self, name):
+        # 焦点切换时常常重设同一个指标，这时各单元的高亮不变
+        if name != self.metric: self.view_highlights = None
+        super().set_metric(name)
+
+    def update_view(self):
+        """渲染每张图片在当前视口内的显示缓存；尚未就绪（尺寸不同、差异未算完）的图片为 None"""
+        zoom = self.display_scale
+        ix0, iy0, out_w, out_h, ox, oy = self.view_window()
+        nearest = zoom >= 2
+        with self.timer.stage("视口渲染"):
+            self.views = [item.pyramid.render(zoom, ix0, iy0, out_w, out_h, nearest) if item.pyramid else None
+                          for item in self.items]
+        # 基类用 view_a / view_b 判断显示缓存是否有效，并据此计算叠加图层的位置
+        self.view_a = self.views[self.reference]
+        self.view_b = self.views[self.focus]
+        self.view_highlights = None
+        self.last_compose = None
+        self.view_rect = (ix0, iy0, out_w, out_h)
+        self.view_origin = (0, 0) if self.layout == 'grid' else (ox, oy)
+        self.cell_offset = (ox, oy)
+        return self.view_origin
+
+    def view_size(self):
+        if self.layout == 'grid': return self.canvas_size
+        return super().view_size()
+
+    def item_overlay(self, item, xs, ys, region):
+        """第 item 张图片的高亮图层 (R 通道)：分块指标已经算好时用热力图，否则用灰度差阈值"""
+        if self.metric is not None and item.metrics.has(self.metric):
+            return sample_blocks(item.metrics.heatmap(self.metric), item.metrics.block, xs, ys)
+        return region()
+
+    def view_highlight_of(self, index):
+        item = self.items[index]
+        view = self.views[index]
+        if view is None or not item.ready or index == self.reference: return view
+        ix0, iy0, out_w, out_h = self.view_rect
+        zoom = self.display_scale
+
+        def mask():
+            if item.pyr_mask is None:
+                gray_diff, lut = item.result[2], self.diff_lut
+                item.pyr_mask = TilePyramid(self.width, self.height,
+                                            lambda x0, y0, x1, y1: cv2.LUT(read_region(gray_diff, x0, y0, x1, y1), lut),
+                                            self.tile_cache, cache_base=True)
+            return item.pyr_mask.render(zoom, ix0, iy0, out_w, out_h, zoom >= 2)
+
+        overlay = np.zeros_like(view)
+        overlay[:, :, 0] = self.item_overlay(item, ix0 + (np.arange(out_w) + 0.5) / zoom,
+                                             iy0 + (np.arange(out_h) + 0.5) / zoom, mask)
+        return cv2.addWeighted(view, 1, overlay, 0.5, 0)
+
+    def compose_view(self, show_diff=False, line=None, label_alpha=None):
+        """
+        网格布局：每个单元放一张图片，画面为整个画布；多分割布局：各分割条取对应图片的显示缓存
+        分割线与图片名称由界面作为画布图层绘制，这里每次整幅合成
+        """
+        views = self.views
+        if show_diff and self.view_highlights is None:
+            with self.timer.stage("差异图层"):
+                self.view_highlights = [self.view_highlight_of(i) for i in range(len(views))]
+        if show_diff: views = self.view_highlights
+        _, _, out_w, out_h = self.view_rect
+        self.dirty_rects = None
+        self.last_compose = None
+
+        with self.timer.stage("拼接"):
+            if self.layout == 'grid':
+                width, height = self.canvas_size
+                if self.frame is None or self.frame.shape[:2] != (height, width):
+                    self.frame = np.empty((height, width, 3), np.uint8)
+                self.frame[:] = BACKGROUND
+                ox, oy = self.cell_offset
+                for i, view in enumerate(views):
+                    if view is None: continue
+                    x0, y0 = self.cell_origin(i)
+                    self.frame[y0 + oy:y0 + oy + out_h, x0 + ox:x0 + ox + out_w] = view
+                return self.frame
+
+            if self.frame is None or self.frame.shape[:2] != (out_h, out_w):
+                self.frame = np.empty((out_h, out_w, 3), np.uint8)
+            self.frame[:] = BACKGROUND
+            bounds = [0] + [self.view_column(x) for x in self.dividers] + [out_w]
+            for i, view in enumerate(views):
+                if view is not None and bounds[i + 1] > bounds[i]:
+                    self.frame[:, bounds[i]:bounds[i + 1]] = view[:, bounds[i]:bounds[i + 1]]
+            return self.frame
+
+    def view_column(self, ix):
+        """原图列 ix 在显示缓存中的列位置，限制在缓存范围内"""
+        _, _, out_w, _ = self.view_rect
+        return max(0, min(out_w, int(round((ix - self.view_rect[0]) * self.display_scale))))
+
+    def line_layer(self, line):
+        # 分割线由界面画成画布上的线条
+        return None
+
+    def ab_label_layers(self, alpha):
+        return []
+
+    def compose_region(self, x1, y1, x2, y2, show_diff=False, line=None):
+        """放大镜：网格布局取焦点图片，多分割布局按分割条拼接各图片；高亮与分割线同显示画面"""
+        if self.layout == 'grid':
+            parts = [(self.focus, x1, x2)]
+        else:
+            bounds = [0] + self.dividers + [self.width]
+            parts = [(i, max(x1, bounds[i]), min(x2, bounds[i + 1])) for i in range(len(self.items))
+                     if max(x1, bounds[i]) < min(x2, bounds[i + 1])]
+        patch = np.empty((y2 - y1, x2 - x1, 3), np.uint8)
+        patch[:] = BACKGROUND
+        for index, s0, s1 in parts:
+            item = self.items[index]
+            if item.shown is None: continue
+            region = item.shown[y1:y2, s0:s1]
+            if show_diff and item.ready and index != self.reference:
+                overlay = np.zeros_like(region)
+                overlay[:, :, 0] = self.item_overlay(item, np.arange(s0, s1), np.arange(y1, y2),
+                                                     lambda: self.diff_lut[item.result[2][y1:y2, s0:s1]])
+                region = cv2.addWeighted(region, 1, overlay, 0.5, 0)
+            patch[:, s0 - x1:s1 - x1] = region
+
+        if line is not None and self.layout == 'split':
+            for x in self.dividers:
+                if x1 - line.thickness <= x < x2 + line.thickness:
+                    draw_line(patch, (x - x1, -y1), (x - x1, self.height - y1), line.color, line.thickness,
+                              line.style)
+        return patch
+
+    def diff_text(self):
+        text = super().diff_text()
+        if len(self.items) < 2: return text
+        ref, item = self.items[self.reference], self.items[self.focus]
+        if self.focus == self.reference: return f"基准 {ref.name}"
+        return f"{item.name} ↔ {ref.name}   {text}"
@@ -0,0 +1,290 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+
+from alignment import Alignment, register
+from compare_engine import TaskHandle, decode_image, prepare_pair
+from disk_image import LARGE_IMAGE_PIXELS, is_disk_backed, read_region, strip_rows, strips
+from lazy_import import LazyModule
+from tiles import LRUTileCache, TilePyramid
+
+# 持久化的图片缓存：解码后的图片、配准变换、对齐后的 B、灰度差异图与预览层按文件内容的哈希保存为 .npy，
+# 再次打开同一对图片时直接内存映射读取，不再解码、缩放与计算差异；总大小超过上限时删除最久未用的条目
+
+np = LazyModule("numpy")
+
+# 缓存格式变化时递增，旧版本的条目放在另一个目录里，不会被误读
+CACHE_VERSION = 1
+# 默认容量上限 (MB)，可用环境变量 IMAGECOMPARE_CACHE_MB 修改，设为 0 关闭缓存
+DEFAULT_CACHE_MB = 8192
+# 预览层：金字塔中长边不超过该值的最细层级，整层存进缓存，适应窗口的视图不必再读原图
+PREVIEW_SIZE = 4096
+# 文件指纹的记录条数上限：路径、大小与修改时间都没变的文件不再重新计算哈希
+MAX_FINGERPRINTS = 4096
+HASH_CHUNK = 8 * 1024 * 1024
+
+def default_root():
+    root = os.environ.get('IMAGECOMPARE_CACHE_DIR')
+    if root: return root
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'ImageCompare')
+
+def default_max_bytes():
+    try:
+        return int(float(os.environ.get('IMAGECOMPARE_CACHE_MB', DEFAULT_CACHE_MB)) * 1024 * 1024)
+    except ValueError:
+        return DEFAULT_CACHE_MB * 1024 * 1024
+
+def preview_level(pyramid):
+    """长边不超过 PREVIEW_SIZE 的最细层级；0 表示原图已经足够小，不需要预览层"""
+    level = 0
+    while level < pyramid.max_level and max(pyramid.level_size(level)) > PREVIEW_SIZE:
+        level += 1
+    return level
+
+class ImageCache:
+    """
+    以内容哈希为键的磁盘缓存，每个条目是一个 .npy 文件；超过 large_pixels 的数组以只读内存映射返回，
+    其余读入内存。写入失败（磁盘已满、文件被占用等）只会让缓存失效，不影响正常处理
+    decode() / prepare_pair() 可在工作线程中调用
+    """
+    def __init__(self, root=None, max_bytes=None):
+        self.root = os.path.join(root or default_root(), f'v{CACHE_VERSION}')
+        self.max_bytes = default_max_bytes() if max_bytes is None else max_bytes
+        self.lock = threading.Lock()
+        self.fingerprints = None
+        # 缓存目录总大小的估计：第一次写入时扫描一次，之后按写入的字节累加，超过上限才再次扫描并清理
+        self.used = None
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def path(self, kind, key):
+        return os.path.join(self.root, f'{kind}-{key}.npy')
+
+    def _fingerprint_path(self):
+        return os.path.join(self.root, 'fingerprints.json')
+
+    def _load_fingerprints(self):
+        if self.fingerprints is not None: return
+        try:
+            with open(self._fingerprint_path(), encoding='utf-8') as f:
+                self.fingerprints = dict(json.load(f))
+        except (OSError, ValueError, TypeError):
+            self.fingerprints = {}
+
+    def file_key(self, path, task=None):
+        """文件内容的 BLAKE2b 哈希；路径、大小与修改时间都没变时直接使用上次的结果"""
+        st = os.stat(path)
+        stamp = f'{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}'
+        with self.lock:
+            self._load_fingerprints()
+            key = self.fingerprints.get(stamp)
+        if key is not None: return key
+
+        digest = hashlib.blake2b(digest_size=20)
+        done = 0
+        with open(path, 'rb') as f:
+            while True:
+                if task is not None: task.report("计算文件指纹", done / max(1, st.st_size))
+                chunk = f.read(HASH_CHUNK)
+                if not chunk: break
+                digest.update(chunk)
+                done += len(chunk)
+        key = digest.hexdigest()
+
+        with self.lock:
+            self.fingerprints.pop(stamp, None)
+            self.fingerprints[stamp] = key
+            while len(self.fingerprints) > MAX_FINGERPRINTS:
+                del self.fingerprints[next(iter(self.fingerprints))]
+            try:
+                os.makedirs(self.root, exist_ok=True)
+                tmp = self._fingerprint_path() + f'.{threading.get_ident()}.tmp'
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(list(self.fingerprints.items()), f)
+                os.replace(tmp, self._fingerprint_path())
+            except OSError:
+                pass
+        return key
+
+    def load(self, kind, key, large_pixels=LARGE_IMAGE_PIXELS):
+        """
+        读取条目，不存在或已损坏时返回 None；命中时刷新修改时间，作为 LRU 的使用时间
+        与 decode_image 一致，只有超过 large_pixels 的数组保持内存映射（按磁盘数组处理），其余读入内存：
+        同一对图片无论是否命中缓存都走同样的缩放与差异路径，结果逐位一致；Windows 上也不会因为文件
+        仍被映射而无法清理或覆盖
+        """
+        path = self.path(kind, key)
+        try:
+            arr = np.load(path, mmap_mode='r')
+            if large_pixels is None or arr.shape[0] * (arr.shape[1] if arr.ndim > 1 else 1) <= large_pixels:
+                arr = np.array(arr)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            self._remove(path)
+            return None
+        return arr
+
+    def store(self, kind, key, arr, task=None):
+        """逐条带写入临时文件后改名，中途取消或失败不会留下不完整的条目"""
+        path = self.path(kind, key)
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                np.lib.format.write_array_header_1_0(f, np.lib.format.header_data_from_array_1_0(arr))
+                h = arr.shape[0]
+                width = arr.shape[1] if arr.ndim > 1 else 1
+                for y0, y1 in strips(h, strip_rows(arr)):
+                    if task is not None: task.report("写入缓存", y0 / max(1, h))
+                    region = read_region(arr, 0, y0, width, y1) if arr.ndim > 1 else arr[y0:y1]
+                    f.write(np.ascontiguousarray(region).data)
+            # 覆盖已有的条目时只累加大小之差
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp, path)
+            written = os.path.getsize(path) - replaced
+        except OSError:
+            self._remove(tmp)
+            return False
+        except BaseException:
+            self._remove(tmp)
+            raise
+        with self.lock:
+            if self.used is not None: self.used += written
+            over = self.used is None or self.used > self.max_bytes
+        if over: self.trim()
+        return True
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def entries(self):
+        """[(修改时间, 大小, 路径)]，按最近使用时间从旧到新排列"""
+        try:
+            files = [e for e in os.scandir(self.root) if e.is_file() and e.name.endswith('.npy')]
+        except OSError:
+            return []
+        items = []
+        for entry in files:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            items.append((st.st_mtime, st.st_size, entry.path))
+        items.sort()
+        return items
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def trim(self):
+        """删除最久未用的条目，直到总大小不超过上限；仍被映射的文件在 Windows 上删不掉，跳过即可"""
+        with self.lock:
+            items = self.entries()
+            total = sum(size for _, size, _ in items)
+            for _, size, path in items:
+                if total <= self.max_bytes: break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self.used = total
+
+    def clear(self):
+        with self.lock:
+            for _, _, path in self.entries():
+                self._remove(path)
+            self.used = 0
+
+    def cached(self, kind, key, compute, task=None, large_pixels=LARGE_IMAGE_PIXELS):
+        """读取条目，未命中时调用 compute() 计算并写入"""
+        arr = self.load(kind, key, large_pixels)
+        if arr is not None: return arr
+        return self._stored(kind, key, compute(), task)
+
+    def decode(self, path, task=None, large_pixels=LARGE_IMAGE_PIXELS):
+        """返回 (图片, 内容键)；缓存关闭时内容键为 None"""
+        task = task or TaskHandle()
+        if not self.enabled: return decode_image(path, task, large_pixels), None
+        key = self.file_key(path, task)
+        image = self.cached('image', key, lambda: decode_image(path, task, large_pixels), task, large_pixels)
+        task.report("完成")
+        return image, key
+
+    def prepare_pair(self, img_a, img_b, key_a=None, key_b=None, align=None, task=None):
+        """
+        与 compare_engine.prepare_pair 相同，另外返回两侧的预览层 ((level, array) 或 None) 与配准结果；
+        align 为 alignment.ALIGN_MODES 之一时先配准 B，变换按图片对缓存。任一侧没有内容键时不使用缓存
+        """
+        task = task or TaskHandle()
+        if not self.enabled or key_a is None or key_b is None:
+            alignment = register(img_a, img_b, align, task) if align else None
+            return prepare_pair(img_a, img_b, task, alignment and alignment.matrix), None, alignment
+
+        h, w = img_a.shape[:2]
+        key_pair = f'{key_a}-{key_b}'
+        key_aligned = f'{key_b}-{w}x{h}'
+        alignment = None
+        if align:
+            key_pair += f'-{align}'
+            key_aligned += f'-{align}-{key_a}'
+            saved = self.load('align', key_pair)
+            if saved is not None:
+                alignment = Alignment.from_array(align, saved, w, h)
+            else:
+                alignment = register(img_a, img_b, align, task)
+                self.store('align', key_pair, alignment.to_array(), task)
+
+        resampled = align or img_b.shape[:2] != (h, w)
+        aligned = self.load('aligned', key_aligned) if resampled else img_b
+        gray_diff = self.load('diff', key_pair)
+        count_above = self.load('hist', key_pair)
+        if aligned is None or gray_diff is None or count_above is None:
+            _, aligned, gray_diff, count_above = prepare_pair(img_a, img_b, task, alignment and alignment.matrix)
+            if resampled:
+                aligned = self._stored('aligned', key_aligned, aligned, task)
+            gray_diff = self._stored('diff', key_pair, gray_diff, task)
+            self.store('hist', key_pair, count_above, task)
+
+        previews = (self.preview(key_a, img_a, task), self.preview(key_aligned if resampled else key_b, aligned, task))
+        task.report("完成")
+        return (img_a, aligned, gray_diff, count_above), previews, alignment
+
+    def _stored(self, kind, key, arr, task):
+        # 磁盘数组写入成功后改用缓存文件的映射，不必再占一份临时文件
+        if not self.store(kind, key, arr, task) or not is_disk_backed(arr): return arr
+        cached = self.load(kind, key)
+        return arr if cached is None else cached
+
+    def preview(self, key, img, task=None):
+        """
+        图片在金字塔 preview_level 层的完整图像；与显示金字塔使用同样的逐层 2x2 面积平均，
+        用它作为该层的瓦片时结果逐位一致
+        """
+        pyramid = TilePyramid.from_array(img, LRUTileCache(64 * 1024 * 1024))
+        level = preview_level(pyramid)
+        if level == 0: return None
+
+        def build():
+            level_w, level_h = pyramid.level_size(level)
+            rows = pyramid.tile_size
+            out = np.empty((level_h, level_w) + img.shape[2:], img.dtype)
+            for y0, y1 in strips(level_h, rows):
+                task.report("生成预览", y0 / level_h)
+                out[y0:y1] = pyramid.region(level, 0, y0, level_w, y1)
+            return out
+
+        return level, self.cached(f'preview{level}', key, build, task)
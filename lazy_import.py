@@ -0,0 +1,14 @@
+import importlib
+
+class LazyModule:
+    """
+    首次访问属性时才真正导入模块，让界面在 OpenCV / NumPy 加载完成前就能显示
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
@@ -0,0 +1,214 @@
+import math
+
+from disk_image import map_strips, parallel_workers, read_region
+from lazy_import import LazyModule
+
+# 感知差异指标：SSIM、PSNR 与 CIEDE2000 色差，按固定大小的块计算
+# 每个指标逐条带算出各块的累计值，缓存在图片对上；之后切换指标、显示热力图都只读取块级结果，
+# 不保留整幅的 Lab / 局部均值平面，内存与图片大小基本无关
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+# 块大小 (像素)，热力图的分辨率
+BLOCK_SIZE = 16
+# 每个条带的目标像素数
+STRIP_PIXELS = 1024 * 1024
+
+# SSIM 使用 11x11、sigma 1.5 的高斯窗口 (Wang et al. 2004)，条带上下各多读 5 行
+SSIM_WINDOW = 11
+SSIM_SIGMA = 1.5
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# 指标名称 -> (显示名称, 热力图满红时的取值)：SSIM 以 1 - SSIM 计，PSNR 以 dB 计（越低越差），ΔE 以色差计
+METRICS = {
+    'ssim': ("SSIM", 0.5),
+    'psnr': ("PSNR", 20.0),
+    'delta_e': ("ΔE2000", 10.0),
+}
+# 热力图上视为无差异的 PSNR
+PSNR_CLEAN = 50.0
+
+def block_sums(values, block):
+    """values 各 block x block 块内的和 (float64)；边缘不足一块的部分单独成块"""
+    h, w = values.shape[:2]
+    rows = np.add.reduceat(values, np.arange(0, h, block), axis=0, dtype=np.float64)
+    return np.add.reduceat(rows, np.arange(0, w, block), axis=1)
+
+def block_counts(width, height, block):
+    """每块包含的像素数"""
+    ys = np.minimum(block, height - np.arange(0, height, block))
+    xs = np.minimum(block, width - np.arange(0, width, block))
+    return np.outer(ys, xs).astype(np.float64)
+
+def ssim_map(gray_a, gray_b):
+    """两幅 float32 灰度图的逐像素 SSIM"""
+    def blur(img):
+        return cv2.GaussianBlur(img, (SSIM_WINDOW, SSIM_WINDOW), SSIM_SIGMA)
+    mu_a, mu_b = blur(gray_a), blur(gray_b)
+    mu_aa, mu_bb, mu_ab = mu_a * mu_a, mu_b * mu_b, mu_a * mu_b
+    var_a = blur(gray_a * gray_a) - mu_aa
+    var_b = blur(gray_b * gray_b) - mu_bb
+    cov = blur(gray_a * gray_b) - mu_ab
+    return ((2 * mu_ab + SSIM_C1) * (2 * cov + SSIM_C2)) / ((mu_aa + mu_bb + SSIM_C1) * (var_a + var_b + SSIM_C2))
+
+def to_lab(rgb):
+    """8 位 sRGB -> CIELAB (float32，L 为 0~100)"""
+    return cv2.cvtColor(rgb.astype(np.float32) * (1 / 255), cv2.COLOR_RGB2Lab)
+
+def _pow7(x):
+    # 比 x ** 7 快一个数量级
+    x2 = x * x
+    return x2 * x2 * x2 * x
+
+def _norm(a, b):
+    # float32 的 np.hypot 比直接开方慢数倍，Lab 的取值范围内不存在溢出问题
+    return np.sqrt(a * a + b * b)
+
+def _hue(b, a):
+    h = np.degrees(np.arctan2(b, a))
+    return np.where(h < 0, h + 360, h)
+
+def delta_e2000(lab_a, lab_b):
+    """逐像素 CIEDE2000 色差 (Sharma et al. 2005)"""
+    # 拆成连续的单通道平面，交错存储的通道切片会让后面每一步都走慢速路径
+    l1, a1, b1 = cv2.split(lab_a)
+    l2, a2, b2 = cv2.split(lab_b)
+
+    c_bar = (_norm(a1, b1) + _norm(a2, b2)) / 2
+    c_bar7 = _pow7(c_bar)
+    g = 0.5 * (1 - np.sqrt(c_bar7 / (c_bar7 + 25.0 ** 7)))
+    a1p, a2p = a1 * (1 + g), a2 * (1 + g)
+    c1p, c2p = _norm(a1p, b1), _norm(a2p, b2)
+    h1p, h2p = _hue(b1, a1p), _hue(b2, a2p)
+    chroma0 = c1p * c2p == 0
+
+    dl = l2 - l1
+    dc = c2p - c1p
+    dh = h2p - h1p
+    dh = np.where(dh > 180, dh - 360, np.where(dh < -180, dh + 360, dh))
+    dh = np.where(chroma0, 0, dh)
+    dh_big = 2 * np.sqrt(c1p * c2p) * np.sin(np.radians(dh / 2))
+
+    l_bar = (l1 + l2) / 2
+    cp_bar = (c1p + c2p) / 2
+    h_sum = h1p + h2p
+    h_bar = np.where(np.abs(h1p - h2p) <= 180, h_sum / 2, np.where(h_sum < 360, (h_sum + 360) / 2, (h_sum - 360) / 2))
+    h_bar = np.where(chroma0, h_sum, h_bar)
+
+    t = (1 - 0.17 * np.cos(np.radians(h_bar - 30)) + 0.24 * np.cos(np.radians(2 * h_bar))
+         + 0.32 * np.cos(np.radians(3 * h_bar + 6)) - 0.20 * np.cos(np.radians(4 * h_bar - 63)))
+    # 指数下限截断在 -50 (结果约 2e-22)，避免产生非规格化数拖慢后续每一步
+    d_theta = 30 * np.exp(np.maximum(-((h_bar - 275) / 25) ** 2, -50))
+    cp_bar7 = _pow7(cp_bar)
+    r_c = 2 * np.sqrt(cp_bar7 / (cp_bar7 + 25.0 ** 7))
+    l50 = (l_bar - 50) ** 2
+    s_l = 1 + 0.015 * l50 / np.sqrt(20 + l50)
+    s_c = 1 + 0.045 * cp_bar
+    s_h = 1 + 0.015 * cp_bar * t
+    r_t = -np.sin(np.radians(2 * d_theta)) * r_c
+
+    tl, tc, th = dl / s_l, dc / s_c, dh_big / s_h
+    return np.sqrt(np.maximum(0, tl * tl + tc * tc + th * th + r_t * tc * th))
+
+def format_score(name, score):
+    title = METRICS[name][0]
+    if name == 'ssim': return f"{title}: {score:.4f}"
+    if name == 'psnr': return f"{title}: {'∞' if math.isinf(score) else f'{score:.2f}'} dB"
+    return f"{title}: {score:.2f}"
+
+def sample_blocks(blocks, block, xs, ys):
+    """按原图坐标 xs / ys 取块级图像上对应的值，用于按任意缩放显示热力图"""
+    bh, bw = blocks.shape[:2]
+    by = np.clip((np.asarray(ys) // block).astype(np.intp), 0, bh - 1)
+    bx = np.clip((np.asarray(xs) // block).astype(np.intp), 0, bw - 1)
+    return blocks.take(by, axis=0).take(bx, axis=1)
+
+class BlockMetrics:
+    """
+    一对已对齐图片的分块指标：每个指标第一次使用时逐条带计算一次，之后直接读取缓存
+    compute() 可在工作线程中调用；A / B 交换不影响结果（三个指标都是对称的）
+    """
+    def __init__(self, img_a, img_b, block=BLOCK_SIZE):
+        self.img_a = img_a
+        self.img_b = img_b
+        self.block = block
+        self.height, self.width = img_a.shape[:2]
+        self.counts = block_counts(self.width, self.height, block)
+        # 每个指标的块级累计值与热力图；块均值与总体分数都由累计值直接算出
+        self.sums = {}
+        self.heatmaps = {}
+
+    def has(self, name):
+        return name in self.sums
+
+    def compute(self, name, task=None, workers=None):
+        if name in self.sums: return self.sums[name]
+        strip = {'ssim': self._ssim_strip, 'psnr': self._psnr_strip, 'delta_e': self._delta_e_strip}[name]
+        # 条带高度取块大小的整数倍，各条带的块行直接拼接
+        block = self.block
+        rows = max(block, STRIP_PIXELS // max(1, self.width) // block * block)
+        parts = map_strips(strip, self.height, rows, task, f"计算 {METRICS[name][0]}", workers or parallel_workers())
+        self.sums[name] = np.vstack(parts)
+        return self.sums[name]
+
+    def _read(self, img, y0, y1):
+        return read_region(img, 0, y0, self.width, y1)
+
+    def _ssim_strip(self, y0, y1):
+        pad = SSIM_WINDOW // 2
+        r0, r1 = max(0, y0 - pad), min(self.height, y1 + pad)
+        gray_a = cv2.cvtColor(self._read(self.img_a, r0, r1), cv2.COLOR_RGB2GRAY).astype(np.float32)
+        gray_b = cv2.cvtColor(self._read(self.img_b, r0, r1), cv2.COLOR_RGB2GRAY).astype(np.float32)
+        # 条带边缘多读的行只用于高斯窗口，结果与整幅计算一致
+        return block_sums(ssim_map(gray_a, gray_b)[y0 - r0:y1 - r0], self.block)
+
+    def _psnr_strip(self, y0, y1):
+        diff = cv2.absdiff(self._read(self.img_a, y0, y1), self._read(self.img_b, y0, y1)).astype(np.float32)
+        return block_sums(cv2.multiply(diff, diff).sum(axis=2), self.block)
+
+    def _delta_e_strip(self, y0, y1):
+        rgb_a, rgb_b = self._read(self.img_a, y0, y1), self._read(self.img_b, y0, y1)
+        # 颜色相同的像素色差为 0，只转换并计算颜色不同的像素
+        changed = cv2.absdiff(rgb_a, rgb_b).max(axis=2) > 0
+        delta_e = np.zeros(changed.shape, np.float32)
+        if changed.any():
+            lab_a = to_lab(rgb_a[changed][:, None])
+            lab_b = to_lab(rgb_b[changed][:, None])
+            delta_e[changed] = delta_e2000(lab_a, lab_b)[:, 0]
+        return block_sums(delta_e, self.block)
+
+    def blocks(self, name):
+        """每块的指标值：SSIM 与 ΔE 为块内均值，PSNR 为块内的 dB 值"""
+        sums = self.sums[name]
+        if name == 'psnr':
+            mse = sums / (self.counts * 3)
+            with np.errstate(divide='ignore'):
+                return 10 * np.log10(255.0 ** 2 / mse)
+        return sums / self.counts
+
+    def score(self, name):
+        """整幅图片的分数：SSIM 与 ΔE 为逐像素均值，PSNR 由整幅的均方误差计算"""
+        total = float(self.sums[name].sum())
+        pixels = self.width * self.height
+        if name == 'psnr':
+            if total == 0: return math.inf
+            return 10 * math.log10(255.0 ** 2 / (total / (pixels * 3)))
+        return total / pixels
+
+    def heatmap(self, name):
+        """块级热力图 (uint8)，0 为无差异，255 为差异达到 METRICS 中的满红取值"""
+        heat = self.heatmaps.get(name)
+        if heat is not None: return heat
+        values = self.blocks(name)
+        full = METRICS[name][1]
+        if name == 'ssim':
+            badness = (1 - values) / full
+        elif name == 'psnr':
+            badness = (PSNR_CLEAN - values) / (PSNR_CLEAN - full)
+        else:
+            badness = values / full
+        heat = (np.clip(badness, 0, 1) * 255 + 0.5).astype(np.uint8)
+        self.heatmaps[name] = heat
+        return heat
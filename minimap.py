@@ -0,0 +1,73 @@
+from lazy_import import LazyModule
+
+# 差异小地图：由差异区域的块级最大灰度差继续按最大值缩小到小地图的尺寸，
+# 单个像素的差异也不会在缩小时被平均掉；能量图与阈值无关，改变阈值时只重新查表着色
+
+np = LazyModule("numpy")
+
+# 小地图长边 (像素)
+MINIMAP_SIZE = 200
+# 小地图的不透明度 (0~255)
+MINIMAP_ALPHA = 230
+
+def energy_lut(threshold):
+    """
+    灰度差 -> RGB 查找表：不超过阈值的块为按差异略微提亮的深灰，
+    超过阈值的块从黄到红，越红差异越大
+    """
+    values = np.arange(256, dtype=np.float32)
+    lut = np.empty((256, 3), np.uint8)
+    below = values <= threshold
+    gray = 24 + values[below] * 48 / max(1, threshold)
+    lut[below] = gray.astype(np.uint8)[:, None]
+    t = (values[~below] - threshold) / max(1, 255 - threshold)
+    lut[~below, 0] = 255
+    lut[~below, 1] = (220 * (1 - t)).astype(np.uint8)
+    lut[~below, 2] = 0
+    return lut
+
+class Minimap:
+    """
+    一对图片的差异小地图。compute() 可在工作线程中调用，与 RegionFinder 共用块级最大值；
+    render() 按阈值着色，结果按阈值缓存一份
+    """
+    def __init__(self, finder, size=MINIMAP_SIZE):
+        self.finder = finder
+        self.height, self.width = finder.gray_diff.shape[:2]
+        scale = size / max(self.width, self.height)
+        self.size = (max(1, round(self.width * scale)), max(1, round(self.height * scale)))
+        self.energy = None
+        self.rendered = (None, None)
+
+    @property
+    def ready(self):
+        return self.energy is not None
+
+    def compute(self, task=None):
+        if self.ready: return self.energy
+        grid = self.finder.block_grid(task)
+        block = self.finder.block
+        w, h = self.size
+        # 每个小地图像素取它覆盖的所有块的最大值；块比像素少时相邻像素取同一块
+        ys = np.arange(h) * self.height // h // block
+        xs = np.arange(w) * self.width // w // block
+        self.energy = np.maximum.reduceat(np.maximum.reduceat(grid, ys, axis=0), xs, axis=1)
+        return self.energy
+
+    def render(self, threshold):
+        """RGBA 小地图；同一阈值只着色一次"""
+        if self.rendered[0] == threshold: return self.rendered[1]
+        rgba = np.empty(self.energy.shape + (4,), np.uint8)
+        rgba[:, :, :3] = energy_lut(threshold)[self.energy]
+        rgba[:, :, 3] = MINIMAP_ALPHA
+        self.rendered = (threshold, rgba)
+        return rgba
+
+    def to_image(self, mx, my):
+        """小地图坐标 -> 原图坐标"""
+        w, h = self.size
+        return mx * self.width / w, my * self.height / h
+
+    def to_minimap(self, ix, iy):
+        w, h = self.size
+        return ix * w / self.width, iy * h / self.height
@@ -0,0 +1,139 @@
+import json
+import time
+import unicodedata
+from collections import deque
+
+# 分阶段计时：关闭时 stage() 只返回一个共享的空上下文，几乎没有开销；
+# 开启后按帧记录各阶段耗时，供界面 HUD 显示，并可导出逐帧记录做离线分析
+
+class _NullStage:
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+NULL_STAGE = _NullStage()
+
+class _Stage:
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+class StageTimer:
+    """
+    begin_frame / end_frame 之间的 stage() 计时归入同一帧；不在帧内的计时直接忽略
+    只在 Tk 主线程中使用，后台任务的阶段耗时通过 record() 整体加入
+    """
+    def __init__(self, history=120, max_trace=100000):
+        self.enabled = False
+        self.history = deque(maxlen=history)
+        self.trace = deque(maxlen=max_trace)
+        self.current = None
+        self.origin = time.perf_counter()
+        self.count = 0
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        self.current = None
+        if enabled:
+            # 每次开启都是新的一段记录
+            self.history.clear()
+            self.trace.clear()
+            self.origin = time.perf_counter()
+            self.count = 0
+
+    def stage(self, name):
+        if not self.enabled: return NULL_STAGE
+        return _Stage(self, name)
+
+    def add(self, name, ms):
+        if self.current is None: return
+        stages = self.current['stages']
+        stages[name] = stages.get(name, 0.0) + ms
+
+    def begin_frame(self, kind):
+        if not self.enabled: return
+        self.current = {'frame': self.count, 'kind': kind,
+                        'start_ms': (time.perf_counter() - self.origin) * 1000, 'stages': {}}
+        self.count += 1
+
+    def end_frame(self):
+        frame = self.current
+        if frame is None: return
+        self.current = None
+        frame['total_ms'] = (time.perf_counter() - self.origin) * 1000 - frame['start_ms']
+        self._append(frame)
+
+    def record(self, kind, stages):
+        """加入一条已经完成的记录，例如后台任务各阶段的耗时"""
+        if not self.enabled or not stages: return
+        total = sum(stages.values())
+        frame = {'frame': self.count, 'kind': kind,
+                 'start_ms': (time.perf_counter() - self.origin) * 1000 - total,
+                 'stages': dict(stages), 'total_ms': total}
+        self.count += 1
+        self._append(frame)
+
+    def _append(self, frame):
+        self.history.append(frame)
+        self.trace.append(frame)
+
+    def averages(self, kind):
+        """最近若干帧中各阶段的平均耗时，按阶段首次出现的顺序返回 [(name, ms), ...]"""
+        frames = [f for f in self.history if f['kind'] == kind]
+        if not frames: return []
+        totals = {}
+        for frame in frames:
+            for name, ms in frame['stages'].items():
+                totals[name] = totals.get(name, 0.0) + ms
+        totals['总计'] = sum(f['total_ms'] for f in frames)
+        return [(name, ms / len(frames)) for name, ms in totals.items()]
+
+    def last(self, kind):
+        for frame in reversed(self.history):
+            if frame['kind'] == kind: return frame
+        return None
+
+    def dump(self, path):
+        """
+        .json 写成 Chrome Trace Event 格式，可在 chrome://tracing 或 Perfetto 中打开；
+        其他扩展名写成 JSON Lines，每行一帧
+        """
+        frames = list(self.trace)
+        with open(path, 'w', encoding='utf-8') as f:
+            if path.lower().endswith('.json'):
+                json.dump({'traceEvents': trace_events(frames), 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+            else:
+                for frame in frames:
+                    f.write(json.dumps(frame, ensure_ascii=False) + '\n')
+        return len(frames)
+
+def format_rows(rows, width=16):
+    """把 [(name, ms), ...] 排成等宽字体下对齐的文本行，中文按两个字符宽计算"""
+    lines = []
+    for name, ms in rows:
+        name_width = sum(2 if unicodedata.east_asian_width(c) in 'WF' else 1 for c in name)
+        lines.append(f"  {name}{' ' * max(1, width - name_width)}{ms:8.2f}")
+    return lines
+
+def trace_events(frames):
+    # 同一帧内的阶段依次排列在帧的时间段内，阶段之间的空隙为未计时部分
+    events = []
+    for frame in frames:
+        tid = frame['kind']
+        start = frame['start_ms'] * 1000
+        events.append({'name': frame['kind'], 'ph': 'X', 'pid': 1, 'tid': tid, 'ts': start,
+                       'dur': frame['total_ms'] * 1000, 'args': {'frame': frame['frame']}})
+        offset = start
+        for name, ms in frame['stages'].items():
+            events.append({'name': name, 'ph': 'X', 'pid': 1, 'tid': tid, 'ts': offset, 'dur': ms * 1000})
+            offset += ms * 1000
+    return events
@@ -0,0 +1,114 @@
+from collections import namedtuple
+
+from disk_image import disk_array, is_disk_backed, map_strips, read_region, release
+from lazy_import import LazyModule
+from regions import REGION_BLOCK, block_max
+
+# 区域统计：灰度差的积分图（和与平方和）每对图片只计算一次，任意矩形的均值与标准差只需读四个角，
+# 与矩形大小无关；最大值无法由积分图得到，改用块级最大值逐层合并的金字塔，
+# 矩形内整块的部分在粗层上取，只有四周不足一块的边条读取细层
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+# 每个条带的目标像素数
+STRIP_PIXELS = 1024 * 1024
+# 积分图（每像素 16 字节）超过该大小 (MB) 或差异图本身在磁盘上时，积分图也放到磁盘数组上
+INTEGRAL_MEMORY_MB = 256
+# 单元数不超过该值的矩形直接读取，不再向粗层拆分
+DIRECT_CELLS = 4096
+
+# 一个矩形内灰度差的统计：像素数、均值、标准差与最大值
+WindowStats = namedtuple('WindowStats', ['pixels', 'mean', 'std', 'max'])
+
+def pool_max(grid):
+    """2x2 最大值池化，边缘不足 2 的部分单独成块"""
+    h, w = grid.shape
+    return np.maximum.reduceat(np.maximum.reduceat(grid, np.arange(0, h, 2), axis=0), np.arange(0, w, 2), axis=1)
+
+class RegionStats:
+    """
+    一对图片灰度差的区域统计；积分图与最大值金字塔在 compute() 中计算一次（可在工作线程中调用），
+    之后 query() 可查询任意矩形。finder 为同一对图片的 RegionFinder，两者共用块级最大值
+    """
+    def __init__(self, gray_diff, finder=None):
+        self.gray_diff = gray_diff
+        self.finder = finder
+        self.height, self.width = gray_diff.shape[:2]
+        self.sums = None
+        self.squares = None
+        # levels[0] 为差异图本身，之后各层每个单元覆盖 factors[i] x factors[i] 像素
+        self.levels = None
+        self.factors = None
+
+    @property
+    def ready(self):
+        return self.levels is not None
+
+    def compute(self, task=None):
+        if self.ready: return self
+        h, w = self.height, self.width
+        shape = (h + 1, w + 1)
+        nbytes = (h + 1) * (w + 1) * 8
+        on_disk = is_disk_backed(self.gray_diff) or nbytes > INTEGRAL_MEMORY_MB * 1024 * 1024
+        sums = disk_array(shape, np.float64) if on_disk else np.empty(shape, np.float64)
+        squares = disk_array(shape, np.float64) if on_disk else np.empty(shape, np.float64)
+        sums[0] = 0
+        squares[0] = 0
+
+        def strip(y0, y1):
+            # 各条带单独求积分图，再加上前一条带的最后一行；条带必须按顺序计算
+            part, part_sq = cv2.integral2(read_region(self.gray_diff, 0, y0, w, y1), sdepth=cv2.CV_64F,
+                                          sqdepth=cv2.CV_64F)
+            sums[y0 + 1:y1 + 1] = part[1:] + sums[y0]
+            squares[y0 + 1:y1 + 1] = part_sq[1:] + squares[y0]
+            release(sums, y0, y1)
+            release(squares, y0, y1)
+
+        map_strips(strip, h, max(1, STRIP_PIXELS // max(1, w)), task, "区域统计")
+
+        finder = self.finder
+        if finder is not None and finder.block == REGION_BLOCK:
+            grid = finder.block_grid(task)
+        else:
+            grid = block_max(self.gray_diff, REGION_BLOCK, task)
+        levels, factors = [self.gray_diff, grid], [1, REGION_BLOCK]
+        while levels[-1].size > DIRECT_CELLS:
+            levels.append(pool_max(levels[-1]))
+            factors.append(factors[-1] * 2)
+        self.sums, self.squares = sums, squares
+        self.factors = factors
+        self.levels = levels
+        return self
+
+    def query(self, x0, y0, x1, y1):
+        """原图矩形 [x0, x1) x [y0, y1) 内的统计，超出图片的部分裁掉；矩形为空时返回 None"""
+        x0, x1 = max(0, int(x0)), min(self.width, int(x1))
+        y0, y1 = max(0, int(y0)), min(self.height, int(y1))
+        if x1 <= x0 or y1 <= y0: return None
+        pixels = (x1 - x0) * (y1 - y0)
+        total = self._rect_sum(self.sums, x0, y0, x1, y1)
+        square = self._rect_sum(self.squares, x0, y0, x1, y1)
+        mean = total / pixels
+        std = max(0.0, square / pixels - mean * mean) ** 0.5
+        return WindowStats(pixels, mean, std, self._max(0, x0, y0, x1, y1))
+
+    @staticmethod
+    def _rect_sum(table, x0, y0, x1, y1):
+        return float(table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0])
+
+    def _max(self, level, x0, y0, x1, y1):
+        """第 level 层坐标下矩形 [x0, x1) x [y0, y1) 内的最大值"""
+        if x1 <= x0 or y1 <= y0: return 0
+        grid = self.levels[level]
+        if level + 1 == len(self.levels) or (x1 - x0) * (y1 - y0) <= DIRECT_CELLS:
+            return int(read_region(grid, x0, y0, x1, y1).max())
+        step = self.factors[level + 1] // self.factors[level]
+        # 完全落在矩形内的上一层单元
+        cx0, cy0 = -(-x0 // step), -(-y0 // step)
+        cx1, cy1 = x1 // step, y1 // step
+        if cx1 <= cx0 or cy1 <= cy0: return int(read_region(grid, x0, y0, x1, y1).max())
+        ax0, ay0, ax1, ay1 = cx0 * step, cy0 * step, cx1 * step, cy1 * step
+        return max(self._max(level + 1, cx0, cy0, cx1, cy1),
+                   self._max(level, x0, y0, x1, ay0), self._max(level, x0, ay1, x1, y1),
+                   self._max(level, x0, ay0, ax0, ay1), self._max(level, ax1, ay0, x1, ay1))
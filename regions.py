@@ -0,0 +1,105 @@
+import csv
+import json
+from collections import namedtuple
+
+from disk_image import map_strips, parallel_workers, read_region
+from lazy_import import LazyModule
+
+# 差异区域：把阈值后的差异掩码聚成连通区域，按面积排序，供逐个跳转与导出
+# 每对图片只计算一次块级最大值；改变阈值时只在这张小图上做连通域分析，再逐个区域读取原始差异统计
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+# 聚类的块大小：相距不到一块的差异像素归入同一区域
+REGION_BLOCK = 8
+# 按块数取前若干个区域计算精确统计，其余的忽略
+MAX_REGIONS = 1000
+STRIP_PIXELS = 4 * 1024 * 1024
+
+# 原图坐标 [x0, x1) x [y0, y1) 为区域内超过阈值像素的外接矩形，area 为这些像素的个数，mean 为它们的平均灰度差
+DiffRegion = namedtuple('DiffRegion', ['x0', 'y0', 'x1', 'y1', 'area', 'mean'])
+
+REGION_FIELDS = ['rank', 'x', 'y', 'width', 'height', 'area', 'mean']
+
+def block_max(gray_diff, block=REGION_BLOCK, task=None, workers=None):
+    """每个 block x block 块内的最大灰度差，逐条带并行计算"""
+    h, w = gray_diff.shape[:2]
+    rows = max(block, STRIP_PIXELS // max(1, w) // block * block)
+    xs = np.arange(0, w, block)
+
+    def strip(y0, y1):
+        region = read_region(gray_diff, 0, y0, w, y1)
+        return np.maximum.reduceat(np.maximum.reduceat(region, np.arange(0, y1 - y0, block), axis=0), xs, axis=1)
+
+    return np.vstack(map_strips(strip, h, rows, task, "差异区域", workers or parallel_workers()))
+
+class RegionFinder:
+    """
+    一对图片的差异区域；块级最大值第一次使用时计算，各阈值的结果分别缓存
+    regions() 可在工作线程中调用
+    """
+    def __init__(self, gray_diff, block=REGION_BLOCK, max_regions=MAX_REGIONS):
+        self.gray_diff = gray_diff
+        self.block = block
+        self.max_regions = max_regions
+        self.grid = None
+        self.cache = {}
+
+    def block_grid(self, task=None):
+        """每块的最大灰度差，第一次使用时计算；区域统计与差异小地图也使用它"""
+        if self.grid is None:
+            self.grid = block_max(self.gray_diff, self.block, task)
+        return self.grid
+
+    def regions(self, threshold, task=None):
+        """阈值为 threshold 时的差异区域，按面积从大到小排列"""
+        threshold = int(threshold)
+        if threshold in self.cache: return self.cache[threshold]
+        grid = self.block_grid(task)
+
+        if task is not None: task.report("差异区域")
+        # 与 cv2.THRESH_BINARY 的判定 (src > thresh) 一致；8 连通，块对角相邻也算同一区域
+        grid_mask = (grid > threshold).astype(np.uint8)
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(grid_mask, connectivity=8)
+        order = np.argsort(-stats[1:, cv2.CC_STAT_AREA], kind='stable')[:self.max_regions] + 1
+
+        regions = []
+        for label in order:
+            region = self._measure(labels, stats[label], label, threshold)
+            if region is not None: regions.append(region)
+        regions.sort(key=lambda r: (-r.area, r.y0, r.x0))
+        self.cache[threshold] = regions
+        return regions
+
+    def _measure(self, labels, stat, label, threshold):
+        # 只统计属于该连通域的块内的像素，相邻区域的外接矩形可能重叠
+        b = self.block
+        bx, by, bw, bh = (int(v) for v in stat[:4])
+        h, w = self.gray_diff.shape[:2]
+        x0, y0 = bx * b, by * b
+        x1, y1 = min(w, (bx + bw) * b), min(h, (by + bh) * b)
+        diff = read_region(self.gray_diff, x0, y0, x1, y1)
+        owned = np.kron(labels[by:by + bh, bx:bx + bw] == label, np.ones((b, b), bool))[:y1 - y0, :x1 - x0]
+        selected = (diff > threshold) & owned
+        ys, xs = np.nonzero(selected)
+        if len(ys) == 0: return None
+        return DiffRegion(x0 + int(xs.min()), y0 + int(ys.min()), x0 + int(xs.max()) + 1, y0 + int(ys.max()) + 1,
+                          len(ys), float(diff[selected].mean()))
+
+def region_rows(regions):
+    for rank, r in enumerate(regions, 1):
+        yield {'rank': rank, 'x': r.x0, 'y': r.y0, 'width': r.x1 - r.x0, 'height': r.y1 - r.y0,
+               'area': r.area, 'mean': round(r.mean, 2)}
+
+def write_regions(path, regions):
+    """.csv 写成表格，其他扩展名写成 JSON Lines，每行一个区域"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if path.lower().endswith('.csv'):
+            writer = csv.DictWriter(f, fieldnames=REGION_FIELDS)
+            writer.writeheader()
+            writer.writerows(region_rows(regions))
+        else:
+            for row in region_rows(regions):
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+    return len(regions)
@@ -0,0 +1,99 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from compare_engine import TaskHandle
+
+# 文件夹对比：两个目录按文件名匹配出图片对，逐对浏览；后台线程提前解码、配准并计算之后几对的差异，
+# 切换到下一对时通常已经准备好，可以直接显示
+
+# 当前位置之后预先准备的图片对数；加上当前与上一对，最多同时保留 PREFETCH_PAIRS + 2 对
+PREFETCH_PAIRS = 2
+
+# 一对已经准备好的图片：result / previews / alignment 与 ImageCache.prepare_pair 的返回值相同
+PreparedPair = namedtuple('PreparedPair', ['index', 'img_a', 'img_b', 'key_a', 'key_b', 'result', 'previews', 'alignment'])
+
+class ReviewSession:
+    """
+    图片对列表与预取队列；request() / move_to() / close() 只在 Tk 主线程调用
+    预取使用单独的单线程池，不占用界面的后台线程，各对按顺序准备（每一对内部的计算本身按条带并行）
+    """
+    def __init__(self, pairs, cache, ahead=PREFETCH_PAIRS):
+        self.pairs = pairs
+        self.cache = cache
+        self.ahead = ahead
+        self.index = -1
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # (序号, 对齐模式) -> TaskHandle，结果在 TaskHandle.future 上
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def name(self, index):
+        return self.pairs[index][0]
+
+    def load_pair(self, index, align, task):
+        _, path_a, path_b = self.pairs[index]
+        img_a, key_a = self.cache.decode(path_a, task)
+        img_b, key_b = self.cache.decode(path_b, task)
+        result, previews, alignment = self.cache.prepare_pair(img_a, img_b, key_a, key_b, align, task)
+        return PreparedPair(index, img_a, img_b, key_a, key_b, result, previews, alignment)
+
+    def _submit(self, index, align):
+        entry = self.entries.get((index, align))
+        # 失败的条目（例如文件无法解码）重新排队，文件可能已经被修正
+        if entry is None or (entry.future.done() and not entry.future.cancelled() and entry.future.exception()):
+            entry = TaskHandle(f"预取 {self.name(index)}")
+            entry.future = self.executor.submit(self.load_pair, index, align, entry)
+            self.entries[(index, align)] = entry
+        return entry
+
+    def move_to(self, index, align=None):
+        """当前位置改为 index：取消窗口 [index - 1, index + ahead] 之外的条目，再依次排入当前与之后的各对"""
+        self.index = index
+        keep = {(i, align) for i in range(max(0, index - 1), min(len(self), index + self.ahead + 1))}
+        for key in [k for k in self.entries if k not in keep]:
+            self.entries.pop(key).cancel()
+        for i in range(index, min(len(self), index + self.ahead + 1)):
+            self._submit(i, align)
+
+    def request(self, index, align=None):
+        """移动到 index 并返回它的条目，界面用 FollowedTask 等待结果"""
+        self.move_to(index, align)
+        return self.entries[(index, align)]
+
+    def close(self):
+        for entry in self.entries.values():
+            entry.cancel()
+        self.entries.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class FollowedTask(TaskHandle):
+    """
+    界面等待预取条目 entry 的句柄：future、进度与计时都取自条目，由界面轮询，不占用后台线程
+    取消（又换了一对）只放弃等待，条目本身继续留在队列里
+    """
+    def __init__(self, entry, label):
+        super().__init__(label)
+        self.entry = entry
+        self.future = entry.future
+        self.timings = entry.timings
+
+    @property
+    def stage(self):
+        return self.entry.stage or "排队中"
+
+    @stage.setter
+    def stage(self, value):
+        pass
+
+    @property
+    def progress(self):
+        return self.entry.progress
+
+    @progress.setter
+    def progress(self, value):
+        pass
+
+    def cancel(self):
+        self.cancelled = True
@@ -0,0 +1,163 @@
+import itertools
+import math
+from collections import OrderedDict
+
+from disk_image import is_disk_backed, read_region
+from lazy_import import LazyModule
+
+# 显示金字塔：图片按层级切成固定大小的瓦片，只渲染视口内的瓦片，并放进容量受限的 LRU 缓存
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+TILE_SIZE = 256
+
+class LRUTileCache:
+    """
+    按字节数限制容量的 LRU 缓存，多个金字塔可以共用同一个缓存
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        tile = self._items.get(key)
+        if tile is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._items.move_to_end(key)
+        return tile
+
+    def put(self, key, tile):
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        self._items[key] = tile
+        self.nbytes += tile.nbytes
+        while self.nbytes > self.max_bytes and len(self._items) > 1:
+            _, evicted = self._items.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def discard(self, owner):
+        """丢弃某个金字塔的全部瓦片（键的第一个元素为金字塔编号）"""
+        for key in [k for k in self._items if k[0] == owner]:
+            self.nbytes -= self._items.pop(key).nbytes
+
+    def clear(self):
+        self._items.clear()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+class TilePyramid:
+    """
+    按需构建的图像金字塔：第 L 层是原图的 1/2^L，每块瓦片由下一层的 2x2 块面积平均得到
+    read_base(x0, y0, x1, y1) 返回原图（第 0 层）对应区域
+    """
+    _ids = itertools.count()
+
+    def __init__(self, width, height, read_base, cache, cache_base=False, tile_size=TILE_SIZE):
+        self.width = width
+        self.height = height
+        self.read_base = read_base
+        self.cache = cache
+        self.cache_base = cache_base
+        self.tile_size = tile_size
+        self.id = next(TilePyramid._ids)
+        self.max_level = max(0, math.ceil(math.log2(max(width, height) / tile_size)))
+        # 预先算好的整层图像 (level -> array)，这些层的瓦片直接从中切出
+        self.seeds = {}
+
+    @classmethod
+    def from_array(cls, img, cache, **kwargs):
+        # 磁盘数组的第 0 层瓦片是读出来的副本，同样放进缓存，避免反复读盘
+        kwargs.setdefault('cache_base', is_disk_backed(img))
+        h, w = img.shape[:2]
+        return cls(w, h, lambda x0, y0, x1, y1: read_region(img, x0, y0, x1, y1), cache, **kwargs)
+
+    def seed(self, level, image):
+        """提供第 level 层的完整图像，必须与逐层面积平均的结果一致（例如来自磁盘缓存）"""
+        if image.shape[:2] != self.level_size(level)[::-1]:
+            raise ValueError(f"Seed size mismatch at level {level}")
+        self.seeds[level] = image
+        self.cache.discard(self.id)
+
+    def level_size(self, level):
+        scale = 1 << level
+        return -(-self.width // scale), -(-self.height // scale)
+
+    def level_for_zoom(self, zoom):
+        """选择分辨率不低于显示所需的最粗层级"""
+        if zoom >= 1: return 0
+        return min(self.max_level, int(math.floor(math.log2(1 / zoom))))
+
+    def tile(self, level, tx, ty):
+        key = (self.id, level, tx, ty)
+        tile = self.cache.get(key)
+        if tile is not None: return tile
+
+        t = self.tile_size
+        level_w, level_h = self.level_size(level)
+        x0, y0 = tx * t, ty * t
+        x1, y1 = min(x0 + t, level_w), min(y0 + t, level_h)
+
+        if level in self.seeds:
+            tile = read_region(self.seeds[level], x0, y0, x1, y1)
+        elif level == 0:
+            tile = self.read_base(x0, y0, x1, y1)
+            if not self.cache_base: return tile
+        else:
+            # 由下一层对应的 2x2 区域（至多 4 块瓦片）面积平均而来
+            src = self.region(level - 1, x0 * 2, y0 * 2, x1 * 2, y1 * 2)
+            src_h, src_w = src.shape[:2]
+            if src_w % 2 or src_h % 2:
+                src = cv2.copyMakeBorder(src, 0, src_h % 2, 0, src_w % 2, cv2.BORDER_REPLICATE)
+            tile = cv2.resize(src, (x1 - x0, y1 - y0), interpolation=cv2.INTER_AREA)
+
+        self.cache.put(key, tile)
+        return tile
+
+    def region(self, level, x0, y0, x1, y1):
+        """拼出第 level 层上 [x0, x1) x [y0, y1) 的区域，超出边界的部分会被裁掉"""
+        level_w, level_h = self.level_size(level)
+        x0, y0 = max(0, x0), max(0, y0)
+        x1, y1 = min(level_w, x1), min(level_h, y1)
+        t = self.tile_size
+
+        first = self.tile(level, x0 // t, y0 // t)
+        out = np.empty((y1 - y0, x1 - x0) + first.shape[2:], dtype=first.dtype)
+        for ty in range(y0 // t, (y1 - 1) // t + 1):
+            for tx in range(x0 // t, (x1 - 1) // t + 1):
+                tile = self.tile(level, tx, ty)
+                tx0, ty0 = tx * t, ty * t
+                sx0, sy0 = max(x0, tx0), max(y0, ty0)
+                sx1, sy1 = min(x1, tx0 + tile.shape[1]), min(y1, ty0 + tile.shape[0])
+                out[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = tile[sy0 - ty0:sy1 - ty0, sx0 - tx0:sx1 - tx0]
+        return out
+
+    def render(self, zoom, ix0, iy0, out_w, out_h, nearest=False):
+        """
+        渲染原图坐标从 (ix0, iy0) 起、缩放为 zoom 的 out_w x out_h 视口
+        只读取视口覆盖到的瓦片，耗时与视口大小成正比，与原图大小无关
+        """
+        level = self.level_for_zoom(zoom)
+        s = 1.0 / (1 << level)
+        ratio = s / zoom
+        lx0 = int(math.floor(ix0 * s)) - 1
+        ly0 = int(math.floor(iy0 * s)) - 1
+        lx1 = int(math.ceil((ix0 + out_w / zoom) * s)) + 2
+        ly1 = int(math.ceil((iy0 + out_h / zoom) * s)) + 2
+        lx0, ly0 = max(0, lx0), max(0, ly0)
+        src = self.region(level, lx0, ly0, lx1, ly1)
+
+        # 目标像素中心 (u + 0.5) 对应原图 ix0 + (u + 0.5) / zoom，再换算到该层的像素坐标
+        m = np.array([[ratio, 0, (ix0 * s - lx0) + 0.5 * ratio - 0.5],
+                      [0, ratio, (iy0 * s - ly0) + 0.5 * ratio - 0.5]], dtype=np.float64)
+        interp = cv2.INTER_NEAREST if nearest else cv2.INTER_LINEAR
+        return cv2.warpAffine(src, m, (out_w, out_h), flags=interp | cv2.WARP_INVERSE_MAP,
+                              borderMode=cv2.BORDER_REPLICATE)
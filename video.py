@@ -0,0 +1,204 @@
+import threading
+from collections import namedtuple
+
+from compare_engine import prepare_pair
+from lazy_import import LazyModule
+
+# 视频对比：两个视频逐帧比较。每个视频由后台线程提前解码到有界的环形缓冲区，
+# 另一个线程在其后逐帧对齐并计算差异；内存占用只与缓冲帧数有关，与片长无关
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+# 每个视频提前解码的帧数
+DECODE_AHEAD = 12
+# 提前计算差异的帧数
+DIFF_AHEAD = 6
+# 所有缓冲区的内存上限 (MB)：两个解码缓冲区各占 1/4，差异缓冲区占 1/2；分辨率很高时相应减少缓冲帧数
+BUFFER_MB = 512
+# 当前帧之前保留的帧数，向后单步时不必重新定位
+KEEP_BEHIND = 2
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.mkv', '.avi', '.webm', '.m4v', '.ts', '.y4m')
+
+# 一帧的比较结果：result 与 prepare_pair 的返回值相同
+VideoFrame = namedtuple('VideoFrame', ['index', 'result'])
+
+class AheadBuffer:
+    """
+    后台线程从当前位置起依次调用 produce(index) 填充有界缓冲区，至多领先消费位置 capacity 帧
+    get() 请求的帧不在缓冲区、也不在即将生产的范围内时（跳转、倒退），从该帧重新开始，先调用 restart(index)
+    produce 返回 None 表示已经到达末尾
+    """
+    def __init__(self, produce, count, capacity, restart=None, name="ahead"):
+        self.produce = produce
+        self.restart = restart
+        self.count = count
+        self.capacity = capacity
+        self.items = {}
+        self.position = 0
+        self.next_index = 0
+        self.restart_pending = False
+        self.generation = 0
+        self.error = None
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.closed and (self.error is not None or self.next_index >= self.count
+                                           or self.next_index - self.position >= self.capacity):
+                    self.cond.wait()
+                if self.closed: return
+                index, generation, restart = self.next_index, self.generation, self.restart_pending
+                self.restart_pending = False
+
+            value, error = None, None
+            try:
+                if restart and self.restart is not None: self.restart(index)
+                value = self.produce(index)
+            except Exception as e:
+                error = e
+
+            with self.cond:
+                # 生产期间发生了跳转，结果作废
+                if generation != self.generation: continue
+                if error is not None:
+                    self.error = error
+                elif value is None:
+                    self.count = index
+                elif index < self.position - KEEP_BEHIND:
+                    # 跳过的中间帧只为顺序推进，不保留
+                    self.next_index = index + 1
+                else:
+                    self.items[index] = value
+                    self.next_index = index + 1
+                self.cond.notify_all()
+
+    def get(self, index, timeout=None):
+        """
+        第 index 帧；timeout 内没有准备好时返回 None（timeout 为 0 时只登记请求，立即返回）
+        index 超出片尾时返回 None；生产出错时抛出该异常
+        """
+        with self.cond:
+            if not 0 <= index < self.count: return None
+            self.position = index
+            # 只保留当前帧之前 KEEP_BEHIND 帧以内的旧帧
+            for key in [k for k in self.items if k < index - KEEP_BEHIND or k > index + self.capacity]:
+                del self.items[key]
+            # 生产位置在请求之前不远时顺序生产过去即可，比重新定位便宜；已经越过它或相距太远时重新开始
+            if index not in self.items and not index - self.capacity < self.next_index <= index:
+                self.generation += 1
+                self.items.clear()
+                self.next_index = index
+                self.restart_pending = True
+                self.error = None
+            self.cond.notify_all()
+            self.cond.wait_for(lambda: index in self.items or self.error is not None or index >= self.count
+                               or self.closed, timeout)
+            if self.error is not None: raise self.error
+            return self.items.get(index)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.items.clear()
+            self.cond.notify_all()
+
+def buffer_capacity(frame_bytes, budget, limit):
+    return max(2, min(limit, budget // max(1, frame_bytes)))
+
+class VideoReader:
+    """用 cv2.VideoCapture 顺序解码，帧转为 RGB；解码在 AheadBuffer 的线程中进行"""
+    def __init__(self, path):
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened(): raise ValueError(f"Cannot open video: {path}")
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 25.0
+        self.frame_count = max(0, int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT)))
+        self.width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        capacity = buffer_capacity(self.width * self.height * 3, BUFFER_MB * 1024 * 1024 // 4, DECODE_AHEAD)
+        self.buffer = AheadBuffer(self._decode, self.frame_count, capacity, self._seek, name=f"decode {path}")
+
+    def _seek(self, index):
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+
+    def _decode(self, index):
+        ok, frame = self.capture.read()
+        if not ok: return None
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+
+    def frame(self, index, timeout=None):
+        return self.buffer.get(index, timeout)
+
+    def close(self):
+        self.buffer.close()
+        self.buffer.thread.join(timeout=1.0)
+        # 解码线程仍卡在 read() 里时不能释放，交给垃圾回收
+        if not self.buffer.thread.is_alive(): self.capture.release()
+
+class VideoPair:
+    """
+    两个视频逐帧比较：frame(index) 返回 VideoFrame；差异比例按帧记录在 percents 中（未计算的帧为 NaN），
+    只保存当前阈值下的一个数，片长很长时也只占每帧 4 字节
+    """
+    def __init__(self, path_a, path_b, task=None):
+        if task is not None: task.report("打开视频")
+        self.reader_a = VideoReader(path_a)
+        self.reader_b = None
+        try:
+            self.reader_b = VideoReader(path_b)
+        except Exception:
+            self.close_readers()
+            raise
+        self.path_a, self.path_b = path_a, path_b
+        self.fps = self.reader_a.fps
+        self.frame_count = min(self.reader_a.frame_count, self.reader_b.frame_count)
+        if self.frame_count == 0:
+            self.close_readers()
+            raise ValueError("Cannot read frame count")
+        self.threshold = 30
+        self.percents = np.full(self.frame_count, np.nan, np.float32)
+        # 差异线程写入 percents 与界面换阈值互斥，旧阈值下算出的比例不会写到清空后的曲线上
+        self.lock = threading.Lock()
+        # 每帧保存 A、对齐后的 B (各 3 字节 / 像素) 与灰度差异图
+        frame_bytes = self.reader_a.width * self.reader_a.height * 7
+        capacity = buffer_capacity(frame_bytes, BUFFER_MB * 1024 * 1024 // 2, DIFF_AHEAD)
+        self.buffer = AheadBuffer(self._prepare, self.frame_count, capacity, name="video diff")
+
+    def _prepare(self, index):
+        img_a = self.reader_a.frame(index)
+        img_b = self.reader_b.frame(index)
+        if img_a is None or img_b is None: return None
+        threshold = self.threshold
+        # 已经在差异线程里逐帧计算，单线程即可，避免每帧新建并销毁条带线程池
+        result = prepare_pair(img_a, img_b, workers=1)
+        gray_diff, count_above = result[2], result[3]
+        self.record(index, count_above[threshold] / gray_diff.size * 100, threshold)
+        return VideoFrame(index, result)
+
+    def frame(self, index, timeout=None):
+        return self.buffer.get(index, timeout)
+
+    def set_threshold(self, threshold):
+        """换阈值后曲线清空重新记录；已经在缓冲区里的帧由界面显示时用 record() 补上"""
+        with self.lock:
+            self.threshold = int(threshold)
+            self.percents[:] = np.nan
+
+    def record(self, index, percent, threshold=None):
+        """记录第 index 帧的差异比例；threshold 为计算时使用的阈值，已经换了阈值时丢弃"""
+        with self.lock:
+            if threshold is None or threshold == self.threshold: self.percents[index] = percent
+
+    def close_readers(self):
+        self.reader_a.close()
+        if self.reader_b is not None: self.reader_b.close()
+
+    def close(self):
+        self.buffer.close()
+        self.close_readers()